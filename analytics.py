@@ -0,0 +1,258 @@
+"""Daily analytics: atomic counters, session rollups and the cached /analytics payload.
+
+Review counters on the analytics table are incremented by update_analytics
+as reviews are committed. Unique sessions come from the user_activities
+log, which grows with every page view, so they are rolled up instead. Each
+day's row stores the exact count plus a HyperLogLog sketch of its session
+ids, and sketches are merged to count unique sessions over a date range.
+/analytics then only reads the precomputed analytics rows.
+"""
+import functools
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import Date, DateTime, bindparam, func, insert, text, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+
+import archive
+from models import db, Analytics, UserActivity
+
+logger = logging.getLogger(__name__)
+
+REVIEW_COUNTERS = ('total_reviews', 'sm2_reviews', 'sm2_correct', 'fsrs_reviews', 'fsrs_correct')
+
+# HyperLogLog with 2^12 one-byte registers: ~1.6% standard error, 4 KB per day
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+
+
+def hll_sketch(values):
+    """HyperLogLog registers for an iterable of strings"""
+    registers = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+    for value in values:
+        h = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+        index = h >> (64 - HLL_PRECISION)
+        rest = h & ((1 << (64 - HLL_PRECISION)) - 1)
+        rank = (64 - HLL_PRECISION) - rest.bit_length() + 1
+        if rank > registers[index]:
+            registers[index] = rank
+    return registers.tobytes()
+
+
+def hll_count(sketches):
+    """Estimated number of distinct values across several sketches"""
+    registers = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+    for sketch in sketches:
+        if sketch:
+            np.maximum(registers, np.frombuffer(sketch, dtype=np.uint8), out=registers)
+    m = HLL_REGISTERS
+    estimate = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.power(2.0, -registers.astype(np.float64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * m and zeros:
+        # Linear counting is more accurate for small cardinalities
+        estimate = m * np.log(m / zeros)
+    return int(round(estimate))
+
+
+def upsert_statement(dialect, day, values, updates):
+    """INSERT ... ON CONFLICT DO UPDATE for day's row, or None if the dialect has no upsert"""
+    if dialect not in ('sqlite', 'postgresql'):
+        return None
+    upsert = sqlite_insert if dialect == 'sqlite' else postgresql_insert
+    stmt = upsert(Analytics).values(date=day, **values)
+    return stmt.on_conflict_do_update(index_elements=['date'], set_=updates)
+
+
+def upsert_analytics(day, values, updates):
+    """Insert the analytics row for day, or apply updates to it if it exists.
+
+    A single INSERT ... ON CONFLICT DO UPDATE on SQLite and Postgres; other
+    databases update first and insert on first use.
+    """
+    stmt = upsert_statement(db.session.get_bind().dialect.name, day, values, updates)
+    if stmt is not None:
+        db.session.execute(stmt)
+        return
+
+    result = db.session.execute(update(Analytics).where(Analytics.date == day).values(**updates))
+    if result.rowcount == 0:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(Analytics).values(date=day, **values))
+        except IntegrityError:
+            db.session.execute(update(Analytics).where(Analytics.date == day).values(**updates))
+
+
+@functools.lru_cache(maxsize=None)
+def review_upsert(dialect):
+    """INSERT ... ON CONFLICT DO UPDATE adding review_params to a day's counters, or None if the dialect has no upsert.
+
+    Written as text() and built once per dialect: an on_conflict_do_update()
+    construct has no cache key, so SQLAlchemy would compile it again for
+    every review.
+    """
+    if dialect not in ('sqlite', 'postgresql'):
+        return None
+    table = Analytics.__tablename__
+    columns = ', '.join(REVIEW_COUNTERS)
+    params = ', '.join(f':{name}' for name in REVIEW_COUNTERS)
+    increments = ', '.join(f'{name} = COALESCE({table}.{name}, 0) + excluded.{name}' for name in REVIEW_COUNTERS)
+    return text(
+        f'INSERT INTO {table} (date, {columns}, unique_sessions, updated_at) '
+        f'VALUES (:date, {params}, 0, :updated_at) '
+        f'ON CONFLICT (date) DO UPDATE SET {increments}, updated_at = excluded.updated_at'
+    ).bindparams(bindparam('date', type_=Date), bindparam('updated_at', type_=DateTime))
+
+
+def update_analytics(session_id, reviews):
+    """Add a batch of (algorithm, rating) pairs to today's analytics row.
+
+    The counters are incremented by a single atomic upsert, so concurrent
+    workers never lose increments and nobody reads the row first. Retention
+    is derived from the counters when reading.
+    """
+    now = datetime.utcnow()
+    stmt = review_upsert(db.session.get_bind().dialect.name)
+    if stmt is not None:
+        db.session.execute(stmt, review_params(reviews, now))
+    else:
+        upsert_analytics(now.date(), *review_counters(reviews, now))
+
+
+def review_counts(reviews):
+    """{counter: count} for a batch of (algorithm, rating) pairs"""
+    return {
+        'total_reviews': len(reviews),
+        'sm2_reviews': sum(1 for algorithm, _ in reviews if algorithm == 'sm2'),
+        'sm2_correct': sum(1 for algorithm, rating in reviews if algorithm == 'sm2' and rating >= 3),
+        'fsrs_reviews': sum(1 for algorithm, _ in reviews if algorithm == 'fsrs'),
+        'fsrs_correct': sum(1 for algorithm, rating in reviews if algorithm == 'fsrs' and rating >= 3)
+    }
+
+
+def review_params(reviews, now):
+    """Bind parameters of review_upsert for a batch of (algorithm, rating) pairs"""
+    return dict(review_counts(reviews), date=now.date(), updated_at=now)
+
+
+def review_counters(reviews, now):
+    """(insert values, update increments) adding a batch of (algorithm, rating) pairs to a day's row"""
+    counts = review_counts(reviews)
+    increments = {name: func.coalesce(getattr(Analytics, name), 0) + count for name, count in counts.items()}
+    increments['updated_at'] = now
+    return dict(counts, unique_sessions=0, updated_at=now), increments
+
+
+def rollup_day(day):
+    """Recompute the unique-session count and sketch for one day from user_activities and its archive"""
+    start = datetime.combine(day, datetime.min.time())
+    end = start + timedelta(days=1)
+    sessions = db.session.query(UserActivity.session_id).filter(
+        UserActivity.timestamp >= start,
+        UserActivity.timestamp < end
+    ).distinct()
+    session_ids = {session_id for (session_id,) in sessions}
+    for segment in archive.scan('user_activities', ['session_id'], start, end):
+        session_ids.update(segment['session_id'])
+    session_ids = list(session_ids)
+    values = {
+        'unique_sessions': len(session_ids),
+        'session_sketch': hll_sketch(session_ids),
+        'updated_at': datetime.utcnow()
+    }
+    upsert_analytics(day, dict(values, total_reviews=0), values)
+    db.session.commit()
+    return len(session_ids)
+
+
+def rollup_recent(days=2):
+    """Roll up today and the previous days, which may still receive late telemetry"""
+    today = datetime.utcnow().date()
+    for offset in range(days):
+        rollup_day(today - timedelta(days=offset))
+
+
+class PayloadCache:
+    """Small thread-safe LRU of /analytics payloads keyed by date range"""
+
+    def __init__(self, size=128):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, version, payload):
+        with self._lock:
+            self._entries[key] = (version, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+payload_cache = PayloadCache()
+
+
+def range_version(start_date, end_date):
+    """(last modified, row count) of the analytics rows in a range; changes whenever any row does"""
+    last_modified, rows = db.session.query(func.max(Analytics.updated_at), func.count(Analytics.id)).filter(
+        Analytics.date >= start_date,
+        Analytics.date <= end_date
+    ).one()
+    return last_modified, rows
+
+
+def analytics_payload(start_date, end_date):
+    """The /analytics response for a date range, built from the analytics rows only"""
+    analytics_data = Analytics.query.filter(
+        Analytics.date >= start_date,
+        Analytics.date <= end_date
+    ).order_by(Analytics.date).all()
+
+    response = {
+        'daily_stats': [],
+        'algorithm_comparison': {
+            'sm2': {'total_reviews': 0, 'avg_retention': 0},
+            'fsrs': {'total_reviews': 0, 'avg_retention': 0}
+        },
+        'user_engagement': {
+            'total_unique_sessions': hll_count(a.session_sketch for a in analytics_data),
+            'total_reviews': sum(a.total_reviews or 0 for a in analytics_data)
+        }
+    }
+
+    for analytic in analytics_data:
+        response['daily_stats'].append({
+            'date': analytic.date.isoformat(),
+            'total_reviews': analytic.total_reviews or 0,
+            'unique_sessions': analytic.unique_sessions or 0,
+            'sm2_reviews': analytic.sm2_reviews,
+            'fsrs_reviews': analytic.fsrs_reviews,
+            'sm2_retention': analytic.sm2_retention,
+            'fsrs_retention': analytic.fsrs_retention
+        })
+        response['algorithm_comparison']['sm2']['total_reviews'] += analytic.sm2_reviews
+        response['algorithm_comparison']['fsrs']['total_reviews'] += analytic.fsrs_reviews
+
+    if response['algorithm_comparison']['sm2']['total_reviews'] > 0:
+        response['algorithm_comparison']['sm2']['avg_retention'] = sum(
+            d['sm2_retention'] * d['sm2_reviews'] for d in response['daily_stats']
+        ) / response['algorithm_comparison']['sm2']['total_reviews']
+
+    if response['algorithm_comparison']['fsrs']['total_reviews'] > 0:
+        response['algorithm_comparison']['fsrs']['avg_retention'] = sum(
+            d['fsrs_retention'] * d['fsrs_reviews'] for d in response['daily_stats']
+        ) / response['algorithm_comparison']['fsrs']['total_reviews']
+    return response
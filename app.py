@@ -1,184 +1,610 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, make_response
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, Blueprint, render_template, request, jsonify, send_from_directory, make_response, Response, stream_with_context, g
 from datetime import datetime, timedelta
+from collections import namedtuple
 import json
 import os
 import logging
 import uuid
-from models import db, UserActivity, CardReview, AlgorithmPerformance, Analytics
+import time
+import csv
+import sqlite3
+import zipfile
+from sqlalchemy import insert, update, delete, select, bindparam, exists, literal, case, func, or_, and_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+import click
+import numpy as np
+from models import db, Card, CardState, UserActivity, CardReview, AlgorithmPerformance, DeckStats, FSRSParameters, MaintenanceJob, ReviewPlan
+from scheduler import compile_fsrs
+from telemetry import telemetry
+from jobs import jobs, job_status
+from instrumentation import instrumentation
+from snapshot import snapshots
+import analytics
+import archive
+import database
+import card_io
+from analytics import update_analytics
+import scheduler
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+# Routes and CLI commands, registered on the app by create_app
+bp = Blueprint('main', __name__, cli_group=None)
 
-# Use environment variable for database URL in production
-database_url = os.environ.get('DATABASE_URL', 'sqlite:///' + os.path.join(os.path.abspath(os.path.dirname(__file__)), 'flashcards.db'))
-if database_url.startswith("postgres://"):
-    database_url = database_url.replace("postgres://", "postgresql://", 1)
+# Keep the unique-session rollups for recent days fresh from the telemetry thread
+telemetry.every(float(os.environ.get('ANALYTICS_ROLLUP_INTERVAL', 300)), analytics.rollup_recent)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = database_url
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'default-secret-key')
+# Upper bound on the number of reviews accepted by /review_cards
+MAX_REVIEW_BATCH = int(os.environ.get('MAX_REVIEW_BATCH', 1000))
+# Page size for /get_due_cards
+DEFAULT_DUE_LIMIT = int(os.environ.get('DEFAULT_DUE_LIMIT', 100))
+MAX_DUE_LIMIT = int(os.environ.get('MAX_DUE_LIMIT', 1000))
+# The session_id cookie identifies a user and their card states, so it outlives a browser session
+USER_COOKIE_MAX_AGE = int(os.environ.get('USER_COOKIE_MAX_AGE', 365 * 86400))
+ALGORITHMS = ('sm2', 'fsrs')
+# deck_stats columns that are sums over a user's card states
+DECK_STATS_COUNTERS = ('card_count', 'sm2_total_reviews', 'sm2_correct_reviews', 'sm2_interval_sum',
+                       'fsrs_total_reviews', 'fsrs_correct_reviews', 'fsrs_stability_sum')
+# Seconds a worker keeps using its cached FSRS weights before checking for a newer fit
+FSRS_WEIGHTS_TTL = float(os.environ.get('FSRS_WEIGHTS_TTL', 300))
+# Up to this many FSRS reviews per batch are scheduled one by one: below it,
+# NumPy's per-call overhead costs more than the arithmetic it vectorizes
+SCALAR_FSRS_BATCH = int(os.environ.get('SCALAR_FSRS_BATCH', 16))
+# Cards per transaction for bulk import, and per query for export
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 5000))
+# Most cards held by one day's review plan; a longer queue is rebuilt when the plan runs out
+MAX_PLAN_SIZE = int(os.environ.get('MAX_PLAN_SIZE', 1000))
+# Horizon of /forecast
+DEFAULT_FORECAST_DAYS = 30
+MAX_FORECAST_DAYS = 365
+_fsrs_cache = {}
 
-# Ensure the template directory exists
-template_dir = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'templates')
-if not os.path.exists(template_dir):
-    os.makedirs(template_dir)
+# A row of due_page, from the database or from the user's snapshot
+DueCard = namedtuple('DueCard', 'id front back next_review')
 
-db.init_app(app)
+def create_app(config=None):
+    """Build the Flask app.
 
-class Card(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    front = db.Column(db.String(500), nullable=False)
-    back = db.Column(db.String(500), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # SM2 fields
-    sm2_interval = db.Column(db.Integer, default=0)
-    sm2_repetitions = db.Column(db.Integer, default=0)
-    sm2_ease_factor = db.Column(db.Float, default=2.5)
-    sm2_next_review = db.Column(db.DateTime, default=datetime.utcnow)
-    sm2_total_reviews = db.Column(db.Integer, default=0)
-    sm2_correct_reviews = db.Column(db.Integer, default=0)
-    
-    # FSRS fields
-    fsrs_difficulty = db.Column(db.Float, default=5.0)
-    fsrs_stability = db.Column(db.Float, default=2.0)
-    fsrs_next_review = db.Column(db.DateTime, default=datetime.utcnow)
-    fsrs_total_reviews = db.Column(db.Integer, default=0)
-    fsrs_correct_reviews = db.Column(db.Integer, default=0)
-
-class SM2:
-    def __init__(self):
-        self.interval = 0
-        self.repetitions = 0
-        self.ease_factor = 2.5
-        self.max_interval = 365  # Maximum interval of 1 year
-
-    def calculate(self, quality):
-        if quality >= 3:
-            if self.repetitions == 0:
-                self.interval = 1
-            elif self.repetitions == 1:
-                self.interval = 6
-            else:
-                self.interval = min(round(self.interval * self.ease_factor), self.max_interval)
-            
-            self.ease_factor += (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
-            self.ease_factor = max(1.3, min(2.5, self.ease_factor))  # Cap ease factor between 1.3 and 2.5
-            self.repetitions += 1
-        else:
-            self.interval = 1
-            self.repetitions = 0
-            self.ease_factor = max(1.3, self.ease_factor - 0.2)  # Decrease ease factor on failure
-        
-        return self.interval, self.repetitions, self.ease_factor
-
-class FSRS:
-    def __init__(self):
-        self.w = {
-            0: 0.40255, 1: 1.18385, 2: 3.173, 3: 15.69105, 4: 7.1949, 5: 0.5345,
-            6: 1.4604, 7: 0.0046, 8: 1.54575, 9: 0.1192, 10: 1.01925, 11: 1.9395,
-            12: 0.11, 13: 0.29605, 14: 2.2698, 15: 0.2315, 16: 2.9898, 17: 0.51655, 18: 0.6621
-        }
-        self.decay = -0.5
-        self.factor = 19/81
-        self.min_difficulty = 1
-        self.max_difficulty = 10
-
-    def retrievability(self, t, s):
-        return pow(1 + self.factor * t / s, self.decay)
-
-    def difficulty(self, d, rating):
-        return max(self.min_difficulty, min(self.max_difficulty, d + self.w[0] * (3 - rating)))
-
-    def stability(self, s, d, r, rating):
-        hard = 1 if rating == 2 else 0
-        easy = 1 if rating == 4 else 0
-        new_s = s * (1 + pow(2.718281828, self.w[1]) * (11 - d) * pow(s, -self.w[2]) * 
-                     (pow(2.718281828, (1 - r) * self.w[3]) - 1) * self.w[4] / (1 + self.w[5] * hard) * 
-                     (1 + self.w[6] * easy))
-        return max(0.1, new_s)
-
-    def next_interval(self, s):
-        return int(s * 9 / self.factor)
-
-    def calculate(self, difficulty, stability, last_review, now, rating):
-        elapsed = (now - last_review).days
-        r = self.retrievability(elapsed, stability)
-        new_d = self.difficulty(difficulty, rating)
-        new_s = self.stability(stability, difficulty, r, rating)
-        next_interval = self.next_interval(new_s)
-        return new_d, new_s, next_interval
-
-def create_app():
-    with app.app_context():
-        db.create_all()
-        # Check if we already have cards
-        card_count = Card.query.count()
-        logger.info(f"Found {card_count} existing cards")
-        if card_count == 0:
-            create_test_cards()
+    Nothing here touches the database: engines connect on first use and the
+    schema is created and upgraded by migrations.py, once per deploy rather
+    than by every worker.
+    """
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'default-secret-key')
+    app.config.update(config or {})
+    # Pool sizes, and WAL and a busy timeout on SQLite; see database.py
+    database.init_app(app)
+    telemetry.init_app(app)
+    jobs.init_app(app)
+    # Latency, SQL and profiling metrics at /metrics when INSTRUMENTATION=1
+    instrumentation.init_app(app)
+    # Per-worker array snapshots of users' card states for the read endpoints
+    snapshots.init_app(app)
+    app.register_blueprint(bp)
     return app
 
+def current_user_id():
+    """The user for this request, from the session_id cookie or a new one"""
+    if 'user_id' not in g:
+        user_id = request.cookies.get('session_id')
+        g.new_user = not user_id or len(user_id) > CardState.user_id.type.length
+        g.user_id = str(uuid.uuid4()) if g.new_user else user_id
+    return g.user_id
+
+@bp.after_app_request
+def set_user_cookie(response):
+    # New users get their cookie on whatever request first needed it; page
+    # views refresh its expiry
+    if 'user_id' in g and (g.new_user or request.endpoint == 'main.index'):
+        response.set_cookie('session_id', g.user_id, max_age=USER_COOKIE_MAX_AGE)
+    return response
+
 def track_user_activity(action):
     """Track user activity with session management"""
-    session_id = request.cookies.get('session_id', str(uuid.uuid4()))
-    activity = UserActivity(
+    session_id = current_user_id()
+    telemetry.record(
+        UserActivity,
         session_id=session_id,
         action=action,
         ip_address=request.remote_addr,
         user_agent=request.user_agent.string
     )
-    db.session.add(activity)
-    db.session.commit()
     return session_id
 
-def update_analytics(session_id, algorithm=None, rating=None):
-    """Update daily analytics"""
-    today = datetime.utcnow().date()
-    analytics = Analytics.query.filter_by(date=today).first()
+def empty_deck_stats(user_id):
+    return DeckStats(user_id=user_id, enrolled_through=0, **{column: 0 for column in DECK_STATS_COUNTERS})
+
+def deck_stats_totals(*criteria):
+    """Recompute the deck_stats counters from card states, grouped by user in one aggregate query.
+
+    criteria restrict it to some users or cards, e.g. to subtract them.
+    Returns {user_id: DeckStats}; enrolled_through is left at 0, which is
+    always safe since enrollment skips cards that already have states.
+    """
+    sm2 = CardState.algorithm == 'sm2'
+    fsrs = CardState.algorithm == 'fsrs'
+    rows = db.session.query(
+        CardState.user_id,
+        func.count(case((sm2, 1))),
+        func.coalesce(func.sum(case((sm2, CardState.total_reviews))), 0),
+        func.coalesce(func.sum(case((sm2, CardState.correct_reviews))), 0),
+        func.coalesce(func.sum(case((sm2, CardState.interval))), 0),
+        func.coalesce(func.sum(case((fsrs, CardState.total_reviews))), 0),
+        func.coalesce(func.sum(case((fsrs, CardState.correct_reviews))), 0),
+        func.coalesce(func.sum(case((fsrs, CardState.stability))), 0.0)
+    ).filter(*criteria).group_by(CardState.user_id)
+    totals = {}
+    for user_id, *values in rows:
+        stats = totals[user_id] = empty_deck_stats(user_id)
+        for column, value in zip(DECK_STATS_COUNTERS, values):
+            setattr(stats, column, value)
+        stats.fsrs_stability_sum = float(stats.fsrs_stability_sum)
+    return totals
+
+def compute_deck_stats(user_id, *criteria):
+    """One user's deck_stats counters, recomputed from their card states"""
+    return deck_stats_totals(CardState.user_id == user_id, *criteria).get(user_id) or empty_deck_stats(user_id)
+
+def deck_stats_increments(deltas):
+    """UPDATE values adding the non-zero deltas to deck_stats counters and bumping its version"""
+    columns = DeckStats.__table__.c
+    values = {name: columns[name] + delta for name, delta in deltas.items() if delta}
+    if values:
+        values['version'] = columns.version + 1
+    return values
+
+def bump_deck_stats(user_id, **deltas):
+    """Add deltas to a user's deck_stats counters within the current transaction.
+
+    The increments are done in SQL so concurrent reviews never overwrite each
+    other. If the row does not exist yet it is built from the card states,
+    which already reflect the pending changes once flushed. Returns the
+    row's new (version, plan_day), or None when they aren't known.
+
+    The UPDATE is run on the table rather than the model, which skips the
+    ORM's bulk-update bookkeeping on every review.
+    """
+    values = deck_stats_increments(deltas)
+    if not values:
+        return None
+    table = DeckStats.__table__
+    statement = update(table).where(table.c.user_id == user_id).values(**values)
+    if db.engine.dialect.update_returning:
+        row = db.session.execute(statement.returning(table.c.version, table.c.plan_day)).first()
+        found = row is not None
+    else:
+        row = None
+        found = db.session.execute(statement).rowcount > 0
+    if not found:
+        db.session.flush()
+        db.session.merge(compute_deck_stats(user_id))
+    return row
+
+def touch_deck_stats(user_id):
+    """Bump a user's deck_stats version for a write to their card states that changes no counter"""
+    db.session.execute(update(DeckStats).where(DeckStats.user_id == user_id).values(version=DeckStats.version + 1))
+
+def get_deck_stats(user_id):
+    """The user's deck_stats row, built from their card states on first use.
+
+    A user without card states gets an unsaved empty row, so reads such as
+    /statistics never write; enrollment creates the row. A row recomputed
+    for existing states is saved, and if a concurrent request saved it
+    first, that one is read instead.
+    """
+    stats = db.session.get(DeckStats, user_id)
+    if stats is not None:
+        return stats
+    totals = deck_stats_totals(CardState.user_id == user_id)
+    if user_id not in totals:
+        return empty_deck_stats(user_id)
+    stats = totals[user_id]
+    try:
+        db.session.add(stats)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        stats = db.session.get(DeckStats, user_id)
+    return stats
+
+def check_deck_stats(fix=False):
+    """Compare every user's deck_stats against a full recount, returns {(user_id, column): (stored, actual)}"""
+    actual = deck_stats_totals()
+    stored = {stats.user_id: stats for stats in DeckStats.query}
+    mismatches = {}
+    for user_id in actual.keys() | stored.keys():
+        expected = actual.get(user_id) or empty_deck_stats(user_id)
+        for column in DECK_STATS_COUNTERS:
+            value = getattr(expected, column)
+            found = getattr(stored.get(user_id), column, None)
+            if found is None or abs(found - value) > 1e-6 * max(1.0, abs(value)):
+                mismatches[(user_id, column)] = (found, value)
+    if fix and mismatches:
+        for user_id in {user_id for user_id, _ in mismatches}:
+            expected = actual.get(user_id) or empty_deck_stats(user_id)
+            if user_id in stored:
+                expected.enrolled_through = stored[user_id].enrolled_through
+            db.session.merge(expected)
+        db.session.commit()
+    return mismatches
+
+@bp.cli.command('check-stats')
+@click.option('--fix', is_flag=True, help='Overwrite deck_stats with the recomputed values')
+def check_stats_command(fix):
+    """Recompute deck statistics from scratch and report drift"""
+    mismatches = check_deck_stats(fix=fix)
+    for (user_id, column), (stored, actual) in sorted(mismatches.items()):
+        click.echo(f'{user_id} {column}: stored {stored}, actual {actual}')
+    if not mismatches:
+        click.echo('deck_stats is consistent')
+    elif fix:
+        click.echo('deck_stats repaired')
+    else:
+        raise SystemExit(1)
+
+def deck_statistics(user_id):
+    """A user's per-algorithm statistics from their deck_stats counters"""
+    return format_deck_statistics(get_deck_stats(user_id))
+
+def format_deck_statistics(deck):
+    stats = {
+        'sm2': {
+            'total_reviews': deck.sm2_total_reviews,
+            'correct_reviews': deck.sm2_correct_reviews,
+            'accuracy': 0,
+            'average_interval': deck.sm2_interval_sum / deck.card_count if deck.card_count else 0
+        },
+        'fsrs': {
+            'total_reviews': deck.fsrs_total_reviews,
+            'correct_reviews': deck.fsrs_correct_reviews,
+            'accuracy': 0,
+            'average_stability': deck.fsrs_stability_sum / deck.card_count if deck.card_count else 0
+        }
+    }
     
-    if not analytics:
-        analytics = Analytics(
-            date=today,
-            total_reviews=0,
-            unique_sessions=0,
-            daily_stats={'sm2_reviews': 0, 'fsrs_reviews': 0}
+    if stats['sm2']['total_reviews'] > 0:
+        stats['sm2']['accuracy'] = (stats['sm2']['correct_reviews'] / stats['sm2']['total_reviews']) * 100
+        
+    if stats['fsrs']['total_reviews'] > 0:
+        stats['fsrs']['accuracy'] = (stats['fsrs']['correct_reviews'] / stats['fsrs']['total_reviews']) * 100
+    return stats
+
+def get_fsrs(deck=None):
+    """Compiled FSRS scheduler with the newest fitted weights for a deck, cached per worker.
+
+    The compiled scheduler is shared by every deck with the same weights and
+    only rebuilt when a new fit changes them.
+    """
+    now = time.monotonic()
+    cached = _fsrs_cache.get(deck)
+    if cached and now - cached[0] < FSRS_WEIGHTS_TTL:
+        return cached[1]
+    params = (FSRSParameters.query.filter_by(deck=deck)
+              .order_by(FSRSParameters.created_at.desc(), FSRSParameters.id.desc()).first())
+    fsrs = compile_fsrs(tuple(params.weights) if params else None)
+    _fsrs_cache[deck] = (now, fsrs)
+    return fsrs
+
+def parse_review(data):
+    """Validate a single review payload"""
+    try:
+        review = {
+            'card_id': int(data['card_id']),
+            'rating': int(data['rating']),
+            'algorithm': data['algorithm'],
+            'review_time': float(data.get('review_time') or 0)
+        }
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Each review needs card_id, rating and algorithm')
+    if review['algorithm'] not in ('sm2', 'fsrs'):
+        raise ValueError(f"Unknown algorithm: {review['algorithm']}")
+    if not 1 <= review['rating'] <= 4:
+        raise ValueError(f"Rating out of range: {review['rating']}")
+    return review
+
+def parse_review_batch(data):
+    """Validate a /review_cards payload, returns its reviews"""
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+    items = data.get('reviews', [])
+    if not isinstance(items, list):
+        raise ValueError('reviews must be a list')
+    reviews = [parse_review(item) for item in items]
+    if not reviews:
+        raise ValueError('No reviews given')
+    if len(reviews) > MAX_REVIEW_BATCH:
+        raise ValueError(f'At most {MAX_REVIEW_BATCH} reviews per batch')
+    return reviews
+
+def enroll_cards(user_id, limit=None, card_ids=None, now=None):
+    """Create a user's SM2 and FSRS states for cards they haven't studied yet.
+
+    Without card_ids, the next limit cards after the user's enrolled_through
+    mark are enrolled, so new users and newly added cards are picked up
+    lazily a page at a time. Each algorithm is one INSERT ... SELECT. Runs
+    in the caller's transaction and returns the number of cards enrolled.
+    """
+    now = now or datetime.utcnow()
+    
+    def enrolled(algorithm):
+        return exists().where(
+            CardState.user_id == user_id,
+            CardState.card_id == Card.id,
+            CardState.algorithm == algorithm
         )
-        db.session.add(analytics)
     
-    analytics.total_reviews += 1
-    if algorithm:
-        analytics.daily_stats[f'{algorithm}_reviews'] += 1
+    if card_ids is None:
+        mark = get_deck_stats(user_id).enrolled_through
+        candidates = (select(Card.id).where(Card.id > mark, ~enrolled('sm2'))
+                      .order_by(Card.id).limit(limit).subquery())
+        high = db.session.query(func.max(candidates.c.id)).scalar()
+        if high is None:
+            return 0
+        cards = (Card.id > mark, Card.id <= high)
+    else:
+        cards = (Card.id.in_(card_ids),)
     
-    # Update retention rates
-    if rating and rating >= 3:
-        if algorithm == 'sm2':
-            analytics.avg_retention_sm2 = (
-                (analytics.avg_retention_sm2 or 0) * analytics.daily_stats['sm2_reviews'] + 100
-            ) / (analytics.daily_stats['sm2_reviews'] + 1)
-        elif algorithm == 'fsrs':
-            analytics.avg_retention_fsrs = (
-                (analytics.avg_retention_fsrs or 0) * analytics.daily_stats['fsrs_reviews'] + 100
-            ) / (analytics.daily_stats['fsrs_reviews'] + 1)
+    counts = {}
+    for algorithm in ALGORITHMS:
+        result = db.session.execute(insert(CardState).from_select(
+            ['user_id', 'card_id', 'algorithm', 'next_review'],
+            select(literal(user_id), Card.id, literal(algorithm), literal(now)).where(*cards, ~enrolled(algorithm))
+        ))
+        counts[algorithm] = result.rowcount
+    bump_deck_stats(
+        user_id,
+        card_count=counts['sm2'],
+        fsrs_stability_sum=CardState.stability.default.arg * counts['fsrs']
+    )
+    if counts['sm2'] or counts['fsrs']:
+        # The new cards are due now, so today's plans are rebuilt on their next read
+        db.session.execute(update(ReviewPlan).where(ReviewPlan.user_id == user_id).values(day=None))
+    if card_ids is None:
+        db.session.execute(update(DeckStats).where(
+            DeckStats.user_id == user_id,
+            DeckStats.enrolled_through < high
+        ).values(enrolled_through=high))
+    return counts['sm2']
+
+def schedule_reviews(states, reviews, now, fsrs=None):
+    """Run SM2/FSRS for a batch of reviews with the vectorized scheduler.
+
+    states maps (card_id, algorithm) to the user's CardState. Reviews are
+    split into waves holding at most one review per state, so a card rated
+    twice in the same batch is scheduled twice in order. States are updated
+    in memory; returns (previous_interval, new_interval) per review. fsrs
+    defaults to the current fitted weights. FSRS waves of up to
+    SCALAR_FSRS_BATCH reviews go through the compiled scalar scheduler.
+    """
+    results = [None] * len(reviews)
+    waves = []
+    seen = {}
+    for i, review in enumerate(reviews):
+        key = (review['card_id'], review['algorithm'])
+        wave = seen.get(key, 0)
+        seen[key] = wave + 1
+        if wave == len(waves):
+            waves.append([])
+        waves[wave].append(i)
     
+    for wave in waves:
+        sm2_idx = [i for i in wave if reviews[i]['algorithm'] == 'sm2']
+        fsrs_idx = [i for i in wave if reviews[i]['algorithm'] == 'fsrs']
+        
+        if sm2_idx:
+            batch = [states[reviews[i]['card_id'], 'sm2'] for i in sm2_idx]
+            ratings = [reviews[i]['rating'] for i in sm2_idx]
+            intervals, repetitions, ease_factors = scheduler.sm2_next(
+                [state.interval for state in batch],
+                [state.repetitions for state in batch],
+                [state.ease_factor for state in batch],
+                ratings
+            )
+            for i, state, rating, interval, reps, ease in zip(
+                    sm2_idx, batch, ratings, intervals.tolist(), repetitions.tolist(), ease_factors.tolist()):
+                results[i] = (state.interval, interval)
+                state.total_reviews += 1
+                if rating >= 3:
+                    state.correct_reviews += 1
+                state.interval = interval
+                state.repetitions = reps
+                state.ease_factor = ease
+                state.last_review = now
+                state.next_review = now + timedelta(days=interval)
+        
+        if fsrs_idx:
+            batch = [states[reviews[i]['card_id'], 'fsrs'] for i in fsrs_idx]
+            ratings = [reviews[i]['rating'] for i in fsrs_idx]
+            # FSRS is stepped with the whole days since the card was due, not since its last review;
+            # fsrs_optimizer and replay step it the same way, so fitted weights match this path
+            elapsed = [(now - state.next_review).days for state in batch]
+            fsrs = fsrs or get_fsrs()
+            if len(batch) <= SCALAR_FSRS_BATCH:
+                difficulties, stabilities, intervals = zip(*(
+                    fsrs.review(state.difficulty, state.stability, days, rating)
+                    for state, days, rating in zip(batch, elapsed, ratings)
+                ))
+            else:
+                difficulties, stabilities, intervals = (column.tolist() for column in scheduler.fsrs_next(
+                    [state.difficulty for state in batch],
+                    [state.stability for state in batch],
+                    elapsed,
+                    ratings,
+                    fsrs
+                ))
+            for i, state, rating, difficulty, stability, interval in zip(
+                    fsrs_idx, batch, ratings, difficulties, stabilities, intervals):
+                results[i] = (state.stability, interval)
+                state.total_reviews += 1
+                if rating >= 3:
+                    state.correct_reviews += 1
+                state.difficulty = difficulty
+                state.stability = stability
+                state.last_review = now
+                state.next_review = now + timedelta(days=interval)
+    return results
+
+def load_states(user_id, card_ids):
+    """A user's states for some cards, keyed by (card_id, algorithm), from one primary-key range scan.
+
+    The states are detached from the session: apply_reviews writes them
+    back with one executemany UPDATE rather than a flush, which would issue
+    a statement for every distinct set of changed columns.
+    """
+    states = CardState.query.filter(CardState.user_id == user_id, CardState.card_id.in_(card_ids)).all()
+    for state in states:
+        db.session.expunge(state)
+    return {(state.card_id, state.algorithm): state for state in states}
+
+# Every state column by primary key, on the table: for the few rows of a
+# review, the ORM's bulk UPDATE costs several times more per call
+STATE_KEY = tuple(column.key for column in CardState.__table__.primary_key)
+UPDATE_STATES = update(CardState.__table__).where(
+    *(CardState.__table__.c[key] == bindparam(f'key_{key}') for key in STATE_KEY)
+).values({column.key: bindparam(column.key) for column in CardState.__table__.columns if column.key not in STATE_KEY})
+
+def state_params(state_rows):
+    """UPDATE_STATES parameters for state rows from score_reviews"""
+    return [dict(row, **{f'key_{key}': row[key] for key in STATE_KEY}) for row in state_rows]
+
+def start_of_day(now):
+    return datetime.combine(now.date(), datetime.min.time())
+
+def update_plans(user_id, reviews, states, now):
+    """Bring the user's plans for today up to date with a batch of reviews.
+
+    A review of the card at a plan's position advances it; a card reviewed
+    out of order is removed from the rest of the plan. Cards whose new due
+    time is still today are appended again.
+    """
+    for plan in db.session.scalars(plans_to_update(user_id, reviews, now)):
+        patch_plan(plan, reviews, states, now)
+
+def plans_to_update(user_id, reviews, now):
+    """The user's plans for today that a batch of reviews touches, locked for update"""
+    return select(ReviewPlan).where(
+        ReviewPlan.user_id == user_id,
+        ReviewPlan.algorithm.in_({review['algorithm'] for review in reviews}),
+        ReviewPlan.day == now.date()
+    ).with_for_update()
+
+def patch_plan(plan, reviews, states, now):
+    midnight = start_of_day(now) + timedelta(days=1)
+    card_ids = list(plan.card_ids)
+    position = plan.position
+    reviewed = [review['card_id'] for review in reviews if review['algorithm'] == plan.algorithm]
+    for card_id in reviewed:
+        if position < len(card_ids) and card_ids[position] == card_id:
+            position += 1
+        elif card_id in card_ids[position:]:
+            del card_ids[card_ids.index(card_id, position)]
+    for card_id in dict.fromkeys(reviewed):
+        if states[card_id, plan.algorithm].next_review < midnight and card_id not in card_ids[position:]:
+            card_ids.append(card_id)
+    # A new list, so the JSON column is written
+    plan.card_ids = card_ids
+    plan.position = position
+
+def apply_reviews(reviews, user_id):
+    """Apply a batch of validated reviews by one user in one transaction.
+
+    The user's states for all referenced cards are loaded with a single
+    query, enrolling any cards they haven't seen yet, scheduled in memory
+    by the vectorized scheduler and written back together with a bulk
+    insert of the review log. Returns the list of new intervals, or raises
+    LookupError with the ids of cards that do not exist.
+    """
+    now = datetime.utcnow()
+    card_ids = {review['card_id'] for review in reviews}
+    states = load_states(user_id, card_ids)
+    unenrolled = card_ids - {card_id for card_id, _ in states}
+    if unenrolled:
+        existing = {card_id for (card_id,) in db.session.query(Card.id).filter(Card.id.in_(unenrolled))}
+        missing = sorted(unenrolled - existing)
+        if missing:
+            raise LookupError(missing)
+        enroll_cards(user_id, card_ids=existing, now=now)
+        states.update(load_states(user_id, existing))
+    
+    scheduled, state_rows, review_rows, deck_deltas = score_reviews(reviews, states, user_id, now)
+    db.session.execute(UPDATE_STATES, state_params(state_rows))
+    db.session.execute(insert(CardReview.__table__), review_rows)
+    stats = bump_deck_stats(user_id, **deck_deltas)
+    # Most users have no plan today, which the counter update already told us
+    if stats is None or stats.plan_day == now.date():
+        update_plans(user_id, reviews, states, now)
+    update_analytics(user_id, [(review['algorithm'], review['rating']) for review in reviews])
     db.session.commit()
+    snapshots.written(user_id, state_rows, stats.version if stats else None)
+    record_performance(user_id, reviews, scheduled, now)
+    return [new_interval for _, new_interval in scheduled]
 
-@app.route('/')
+def score_reviews(reviews, states, user_id, now, fsrs=None):
+    """Schedule a batch of reviews against the user's loaded states.
+
+    Returns (scheduled, state_rows, review_rows, deck_deltas): the
+    (previous, new) interval of each review, the reviewed states as rows
+    for one bulk UPDATE by primary key, the review log rows and the
+    deck_stats increments.
+    """
+    interval_sum = sum(state.interval for state in states.values() if state.algorithm == 'sm2')
+    stability_sum = sum(state.stability for state in states.values() if state.algorithm == 'fsrs')
+    scheduled = schedule_reviews(states, reviews, now, fsrs)
+    review_rows = [{
+        'session_id': user_id,
+        'card_id': review['card_id'],
+        'timestamp': now,
+        'algorithm': review['algorithm'],
+        'rating': review['rating'],
+        'previous_interval': previous_interval,
+        'new_interval': new_interval,
+        'review_time': review['review_time']
+    } for review, (previous_interval, new_interval) in zip(reviews, scheduled)]
+    
+    columns = [column.key for column in CardState.__table__.columns]
+    reviewed = sorted({(review['card_id'], review['algorithm']) for review in reviews})
+    state_rows = [{column: getattr(states[key], column) for column in columns} for key in reviewed]
+    deck_deltas = {
+        'sm2_total_reviews': sum(1 for review in reviews if review['algorithm'] == 'sm2'),
+        'sm2_correct_reviews': sum(1 for review in reviews if review['algorithm'] == 'sm2' and review['rating'] >= 3),
+        'sm2_interval_sum': sum(state.interval for state in states.values() if state.algorithm == 'sm2') - interval_sum,
+        'fsrs_total_reviews': sum(1 for review in reviews if review['algorithm'] == 'fsrs'),
+        'fsrs_correct_reviews': sum(1 for review in reviews if review['algorithm'] == 'fsrs' and review['rating'] >= 3),
+        'fsrs_stability_sum': sum(state.stability for state in states.values() if state.algorithm == 'fsrs') - stability_sum
+    }
+    return scheduled, state_rows, review_rows, deck_deltas
+
+def record_performance(user_id, reviews, scheduled, now):
+    # Performance rows are telemetry, written in the background after the commit
+    for review, (previous_interval, new_interval) in zip(reviews, scheduled):
+        telemetry.record(
+            AlgorithmPerformance,
+            session_id=user_id,
+            timestamp=now,
+            algorithm=review['algorithm'],
+            metrics={
+                'rating': review['rating'],
+                'interval_change': new_interval - previous_interval,
+                'review_time': review['review_time']
+            }
+        )
+
+@bp.route('/')
 def index():
     try:
-        session_id = track_user_activity('page_view')
-        response = make_response(render_template('index.html'))
-        response.set_cookie('session_id', session_id, max_age=86400)  # 24 hours
-        return response
+        track_user_activity('page_view')
+        # The session_id cookie is set or refreshed by set_user_cookie
+        return make_response(render_template('index.html'))
     except Exception as e:
         logger.error(f"Error rendering template: {str(e)}")
         return f"Error: {str(e)}", 500
 
-@app.route('/add_card', methods=['POST'])
+@bp.route('/add_card', methods=['POST'])
 def add_card():
     data = request.json
     card = Card(
@@ -186,194 +612,544 @@ def add_card():
         back=data['back']
     )
     db.session.add(card)
-    db.session.commit()
+    # Users are enrolled in new cards lazily, by get_due_cards
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        existing = db.session.query(Card.id).filter(Card.front == data['front']).scalar()
+        return jsonify({'error': 'A card with this front already exists', 'id': existing}), 409
     return jsonify({'message': 'Card added successfully', 'id': card.id})
 
-@app.route('/get_due_cards')
+def import_cards(stream, fmt, batch_size=IMPORT_BATCH_SIZE, counts=None):
+    """Stream cards from an uploaded file into the deck.
+
+    Cards are parsed lazily and inserted in batches of batch_size, each with
+    one multi-row INSERT and its own commit, so memory stays flat whatever
+    the file size. Cards whose front already exists are skipped, see
+    insert_new_cards. Returns counts and throughput.
+
+    An import that fails part way through is partial: batches committed
+    before the error stay in the deck. counts, if given, is kept up to date
+    as each batch commits, so the caller can still report them.
+    """
+    start = time.perf_counter()
+    imported = duplicates = invalid = 0
+    counts = {} if counts is None else counts
+    front_length = Card.front.type.length
+    back_length = Card.back.type.length
+    for batch in card_io.batched(card_io.read_cards(stream, fmt), batch_size):
+        cards = {}
+        for front, back in batch:
+            if not isinstance(front, str) or not isinstance(back, str) or not front.strip() or not back.strip():
+                invalid += 1
+                continue
+            front = front.strip()[:front_length]
+            if front in cards:
+                duplicates += 1
+                continue
+            cards[front] = back.strip()[:back_length]
+        inserted = insert_new_cards(cards) if cards else 0
+        duplicates += len(cards) - inserted
+        imported += inserted
+        counts.update(imported=imported, duplicates=duplicates, invalid=invalid)
+
+    seconds = time.perf_counter() - start
+    return {
+        'imported': imported,
+        'duplicates': duplicates,
+        'invalid': invalid,
+        'seconds': round(seconds, 3),
+        'cards_per_sec': round(imported / seconds, 1) if seconds else 0
+    }
+
+def insert_new_cards(cards):
+    """Insert the {front: back} cards whose front isn't in the deck yet and commit, returns how many were inserted.
+
+    card.front is unique, so a concurrent import of the same cards can't
+    add them twice. SQLite and Postgres skip existing fronts with INSERT ...
+    ON CONFLICT DO NOTHING; other databases look them up first, and redo
+    the batch if another import committed one of them in the meantime.
+    """
+    rows = [{'front': front, 'back': back} for front, back in cards.items()]
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        upsert = sqlite_insert if dialect == 'sqlite' else postgresql_insert
+        statement = upsert(Card.__table__).values(rows).on_conflict_do_nothing(index_elements=['front'])
+        inserted = db.session.execute(statement).rowcount
+        db.session.commit()
+        return inserted
+    while True:
+        existing = {front for (front,) in db.session.query(Card.front).filter(Card.front.in_(cards))}
+        new = [row for row in rows if row['front'] not in existing]
+        try:
+            if new:
+                db.session.execute(insert(Card), new)
+            db.session.commit()
+            return len(new)
+        except IntegrityError:
+            db.session.rollback()
+
+def iter_cards(batch_size=EXPORT_BATCH_SIZE):
+    """Yield (front, back) for every card, paging through the table by id"""
+    last_id = 0
+    while True:
+        rows = (db.session.query(Card.id, Card.front, Card.back)
+                .filter(Card.id > last_id).order_by(Card.id).limit(batch_size).all())
+        if not rows:
+            return
+        for row in rows:
+            yield row.front, row.back
+        last_id = rows[-1].id
+
+@bp.route('/import', methods=['POST'])
+def import_route():
+    """Bulk import cards from a CSV, JSON Lines or Anki (.apkg) upload.
+
+    Send the file as multipart field 'file', or as the raw request body with
+    ?format=csv|jsonl|apkg.
+    """
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    fmt = request.args.get('format') or card_io.guess_format(upload.filename if upload else None)
+    if fmt not in card_io.FORMATS:
+        return jsonify({'error': f'Unsupported import format: {fmt or "unknown"}'}), 400
+    counts = {}
+    try:
+        result = import_cards(stream, fmt, counts=counts)
+    except (ValueError, UnicodeDecodeError, zipfile.BadZipFile, sqlite3.DatabaseError, csv.Error) as e:
+        db.session.rollback()
+        logger.error(f"Error importing cards after {counts.get('imported', 0)} were committed: {str(e)}")
+        # Batches before the error were already committed
+        return jsonify({'error': f'Could not import file: {str(e)}', 'imported': counts.get('imported', 0)}), 400
+    logger.info(f"Imported {result['imported']} cards at {result['cards_per_sec']} cards/sec")
+    return jsonify(result)
+
+@bp.route('/export')
+def export_route():
+    """Stream every card as CSV or JSON Lines"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in card_io.EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported export format: {fmt}'}), 400
+    response = Response(stream_with_context(card_io.WRITERS[fmt](iter_cards())), mimetype=card_io.MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=cards.{fmt}'
+    return response
+
+@bp.cli.command('import-cards')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(card_io.FORMATS), help='Defaults to the file extension')
+def import_cards_command(path, fmt):
+    """Bulk import cards from a file"""
+    with open(path, 'rb') as f:
+        result = import_cards(f, fmt or card_io.guess_format(path))
+    click.echo(f"Imported {result['imported']} cards ({result['duplicates']} duplicates, "
+               f"{result['invalid']} invalid) in {result['seconds']}s, {result['cards_per_sec']} cards/sec")
+
+@bp.cli.command('export-cards')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'fmt', type=click.Choice(card_io.EXPORT_FORMATS), help='Defaults to the file extension')
+def export_cards_command(path, fmt):
+    """Export every card to a file"""
+    fmt = fmt or card_io.guess_format(path)
+    if fmt not in card_io.EXPORT_FORMATS:
+        raise click.BadParameter(f'Unsupported export format: {fmt}')
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for chunk in card_io.WRITERS[fmt](iter_cards()):
+            f.write(chunk)
+
+def parse_cursor(cursor):
+    """Split an 'after' cursor of the form '<due isoformat>,<card id>'"""
+    try:
+        due, card_id = cursor.rsplit(',', 1)
+        return datetime.fromisoformat(due), int(card_id)
+    except (AttributeError, ValueError):
+        raise ValueError(f'Invalid cursor: {cursor}')
+
+def make_cursor(due, card_id):
+    return f'{due.isoformat()},{card_id}'
+
+def due_page(user_id, algorithm, now, after=None, limit=DEFAULT_DUE_LIMIT, due=True):
+    """One keyset page of a user's cards ordered by (due time, id), as DueCard rows.
+
+    With due=False the page walks the cards that are not due yet, soonest
+    first. The page is cut from the user's snapshot; without one, both
+    directions are range scans over the user's part of the user_card_state
+    due index.
+    """
+    snapshot = snapshots.get(user_id, algorithm)
+    if snapshot is None:
+        return db.session.execute(due_page_query(user_id, algorithm, now, after, limit, due)).all()
+    page = snapshot.due_page(now, after, limit, due)
+    text = snapshots.card_text([card_id for card_id, _ in page])
+    return [DueCard(card_id, *text[card_id], next_review) for card_id, next_review in page]
+
+def due_page_query(user_id, algorithm, now, after=None, limit=DEFAULT_DUE_LIMIT, due=True):
+    query = (select(Card.id, Card.front, Card.back, CardState.next_review)
+             .select_from(CardState)
+             .join(Card, Card.id == CardState.card_id)
+             .where(CardState.user_id == user_id, CardState.algorithm == algorithm))
+    query = query.where(CardState.next_review <= now if due else CardState.next_review > now)
+    if after:
+        after_due, after_id = after
+        query = query.where(or_(
+            CardState.next_review > after_due,
+            and_(CardState.next_review == after_due, CardState.card_id > after_id)
+        ))
+    return query.order_by(CardState.next_review, CardState.card_id).limit(limit)
+
+def enroll_for_queue(user_id, count, now):
+    """Enroll the user in up to count new cards, due at now, to fill a short due queue"""
+    try:
+        enrolled = enroll_cards(user_id, count, now=now)
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent request from the same user enrolled them first
+        db.session.rollback()
+        return 0
+    if enrolled:
+        logger.info(f"Enrolled user in {enrolled} new cards")
+    return enrolled
+
+@bp.route('/get_due_cards')
 def get_due_cards():
-    algorithm = request.args.get('algorithm', 'sm2')
+    """The user's due cards for an algorithm, one keyset page at a time.
+
+    Query parameters: algorithm (sm2/fsrs), limit, after (cursor from the
+    X-Next-Cursor header) and format=ndjson to stream every due card from
+    the cursor onwards as newline-delimited JSON. When the first page isn't
+    full, the user is enrolled in new cards to fill it.
+    """
+    user_id = current_user_id()
+    algorithm = 'sm2' if request.args.get('algorithm', 'sm2') == 'sm2' else 'fsrs'
     now = datetime.utcnow()
+    try:
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_DUE_LIMIT)), MAX_DUE_LIMIT))
+        after = parse_cursor(request.args['after']) if request.args.get('after') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    if algorithm == 'sm2':
-        cards = Card.query.filter(Card.sm2_next_review <= now).all()
-    else:
-        cards = Card.query.filter(Card.fsrs_next_review <= now).all()
+    rows = due_page(user_id, algorithm, now, after, limit + 1)
+    if len(rows) <= limit and after is None and enroll_for_queue(user_id, limit + 1 - len(rows), now):
+        rows = due_page(user_id, algorithm, now, after, limit + 1)
+    
+    if request.args.get('format') == 'ndjson':
+        def generate(rows):
+            while True:
+                for row in rows[:limit]:
+                    yield json.dumps({'id': row.id, 'front': row.front, 'back': row.back}) + '\n'
+                if len(rows) <= limit:
+                    break
+                rows = due_page(user_id, algorithm, now, (rows[limit - 1][3], rows[limit - 1].id), limit + 1)
+        return Response(stream_with_context(generate(rows)), mimetype='application/x-ndjson')
     
     # Log the number of cards found
-    logger.info(f"Found {len(cards)} cards due for review with {algorithm} algorithm")
+    logger.info(f"Found {min(len(rows), limit)} cards due for review with {algorithm} algorithm")
     
-    # If no cards are due, return all cards
-    if not cards:
-        cards = Card.query.all()
-        logger.info(f"No cards due, returning all {len(cards)} cards")
+    # If no cards are due, return the cards coming up next rather than the whole deck
+    if not rows and after is None:
+        rows = due_page(user_id, algorithm, now, limit=limit, due=False)
+        logger.info(f"No cards due, returning the next {len(rows)} upcoming cards")
     
-    return jsonify([{
-        'id': card.id,
-        'front': card.front,
-        'back': card.back
-    } for card in cards])
+    response = jsonify([{
+        'id': row.id,
+        'front': row.front,
+        'back': row.back
+    } for row in rows[:limit]])
+    if len(rows) > limit:
+        response.headers['X-Next-Cursor'] = make_cursor(rows[limit - 1][3], rows[limit - 1].id)
+    return response
 
-@app.route('/review_card', methods=['POST'])
-def review_card():
-    data = request.json
-    card = Card.query.get(data['card_id'])
-    rating = data['rating']
-    algorithm = data['algorithm']
+def build_plan(user_id, algorithm, now):
+    """Build and commit the user's plan for today: their cards due before midnight UTC, in due order.
+
+    Like the first /get_due_cards page, a short queue is topped up with new
+    cards first.
+    """
+    midnight = start_of_day(now) + timedelta(days=1)
+    
+    def due_today():
+        snapshot = snapshots.get(user_id, algorithm)
+        if snapshot is not None:
+            return snapshot.due_before(midnight, MAX_PLAN_SIZE + 1)
+        return [card_id for (card_id,) in db.session.query(CardState.card_id).filter(
+            CardState.user_id == user_id,
+            CardState.algorithm == algorithm,
+            CardState.next_review < midnight
+        ).order_by(CardState.next_review, CardState.card_id).limit(MAX_PLAN_SIZE + 1)]
+    
+    card_ids = due_today()
+    if len(card_ids) < DEFAULT_DUE_LIMIT and enroll_for_queue(user_id, DEFAULT_DUE_LIMIT - len(card_ids), now):
+        card_ids = due_today()
+    
+    values = {
+        'day': now.date(),
+        'card_ids': card_ids[:MAX_PLAN_SIZE],
+        'position': 0,
+        'truncated': len(card_ids) > MAX_PLAN_SIZE,
+        'built_at': now
+    }
+    # Written before the plan, as reviews lock deck_stats before review_plans
+    get_deck_stats(user_id).plan_day = now.date()
+    db.session.flush()
+    plan = db.session.get(ReviewPlan, (user_id, algorithm))
+    if plan is None:
+        plan = ReviewPlan(user_id=user_id, algorithm=algorithm, **values)
+        db.session.add(plan)
+    else:
+        for name, value in values.items():
+            setattr(plan, name, value)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent request from the same user built it first
+        db.session.rollback()
+        plan = db.session.get(ReviewPlan, (user_id, algorithm))
+    return plan
+
+def has_new_cards(user_id):
+    return db.session.query(Card.id).filter(Card.id > get_deck_stats(user_id).enrolled_through).first() is not None
+
+@bp.route('/next_card')
+def next_card():
+    """The next card in the user's review plan for today.
+
+    The plan is built on the first call of the day, or after new cards were
+    enrolled, and reviews keep it current, so serving a card is two
+    primary-key lookups. When the plan runs out it is rebuilt if more cards
+    were due than it held or new cards can be enrolled; otherwise card is
+    null.
+    """
+    user_id = current_user_id()
+    algorithm = 'sm2' if request.args.get('algorithm', 'sm2') == 'sm2' else 'fsrs'
     now = datetime.utcnow()
-    session_id = request.cookies.get('session_id', str(uuid.uuid4()))
+    plan = db.session.get(ReviewPlan, (user_id, algorithm))
+    if plan is None or plan.day != now.date():
+        plan = build_plan(user_id, algorithm, now)
+    elif plan.position >= len(plan.card_ids) and (plan.truncated or has_new_cards(user_id)):
+        plan = build_plan(user_id, algorithm, now)
     
-    # Track the review
-    review = CardReview(
-        session_id=session_id,
-        card_id=card.id,
-        algorithm=algorithm,
-        rating=rating,
-        previous_interval=card.sm2_interval if algorithm == 'sm2' else card.fsrs_stability,
-        review_time=data.get('review_time', 0)
-    )
+    card = None
+    if plan.position < len(plan.card_ids):
+        card_id = plan.card_ids[plan.position]
+        text = snapshots.card_text([card_id]).get(card_id)
+        card = {'id': card_id, 'front': text[0], 'back': text[1]} if text else None
+    return jsonify({
+        'card': card,
+        'position': plan.position,
+        'remaining': len(plan.card_ids) - plan.position,
+        'total': len(plan.card_ids)
+    })
+
+@bp.route('/forecast')
+def get_forecast():
+    """How many of the user's reviews fall due on each of the next days.
+
+    Query parameters: algorithm (sm2/fsrs) and days. Every review is assumed
+    to be rated Good and projected with the vectorized scheduler; day 0 is
+    today (UTC) and includes overdue cards. Cards the user hasn't been
+    enrolled in yet are not counted.
+    """
+    user_id = current_user_id()
+    algorithm = 'sm2' if request.args.get('algorithm', 'sm2') == 'sm2' else 'fsrs'
+    try:
+        days = max(1, min(int(request.args.get('days', DEFAULT_FORECAST_DAYS)), MAX_FORECAST_DAYS))
+    except ValueError:
+        return jsonify({'error': 'days must be an integer'}), 400
     
-    # Update card and get new intervals
-    if algorithm == 'sm2':
-        card.sm2_total_reviews += 1
-        if rating >= 3:
-            card.sm2_correct_reviews += 1
-        
-        sm2 = SM2()
-        sm2.interval = card.sm2_interval
-        sm2.repetitions = card.sm2_repetitions
-        sm2.ease_factor = card.sm2_ease_factor
-        
-        interval, repetitions, ease_factor = sm2.calculate(rating)
-        
-        card.sm2_interval = interval
-        card.sm2_repetitions = repetitions
-        card.sm2_ease_factor = ease_factor
-        card.sm2_next_review = now + timedelta(days=interval)
-        review.new_interval = interval
+    today = start_of_day(datetime.utcnow())
+    snapshot = snapshots.get(user_id, algorithm)
+    if snapshot is not None:
+        due, state = snapshot.columns_before(today + timedelta(days=days))
+        due_in = (due - np.datetime64(today, 'us')) / np.timedelta64(1, 'D')
     else:
-        card.fsrs_total_reviews += 1
-        if rating >= 3:
-            card.fsrs_correct_reviews += 1
-            
-        fsrs = FSRS()
-        new_d, new_s, next_interval = fsrs.calculate(
-            card.fsrs_difficulty,
-            card.fsrs_stability,
-            card.fsrs_next_review,
-            now,
-            rating
-        )
-        
-        card.fsrs_difficulty = new_d
-        card.fsrs_stability = new_s
-        card.fsrs_next_review = now + timedelta(days=next_interval)
-        review.new_interval = next_interval
-
-    # Save review and update analytics
-    db.session.add(review)
-    update_analytics(session_id, algorithm, rating)
-    db.session.commit()
+        columns = ('interval', 'repetitions', 'ease_factor') if algorithm == 'sm2' else ('difficulty', 'stability')
+        rows = db.session.query(CardState.next_review, *(getattr(CardState, column) for column in columns)).filter(
+            CardState.user_id == user_id,
+            CardState.algorithm == algorithm,
+            CardState.next_review < today + timedelta(days=days)
+        ).all()
+        due_in = np.array([(row[0] - today).total_seconds() / 86400 for row in rows])
+        state = {column: [row[i + 1] for row in rows] for i, column in enumerate(columns)}
+    counts = scheduler.forecast(algorithm, due_in, state, days, fsrs=get_fsrs())
+    return jsonify({
+        'algorithm': algorithm,
+        'start': today.date().isoformat(),
+        'days': days,
+        'due': counts.tolist(),
+        'total': int(counts.sum())
+    })
 
-    # Track algorithm performance
-    perf = AlgorithmPerformance(
-        session_id=session_id,
-        algorithm=algorithm,
-        metrics={
-            'rating': rating,
-            'interval_change': review.new_interval - review.previous_interval,
-            'review_time': review.review_time
-        }
-    )
-    db.session.add(perf)
-    db.session.commit()
+@bp.route('/review_card', methods=['POST'])
+def review_card():
+    try:
+        review = parse_review(request.json or {})
+        apply_reviews([review], current_user_id())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except LookupError as e:
+        return jsonify({'error': 'Card not found', 'card_ids': e.args[0]}), 404
 
     return jsonify({'message': 'Review recorded successfully'})
 
-@app.route('/statistics')
+@bp.route('/review_cards', methods=['POST'])
+def review_cards():
+    """Record a batch of reviews (mixed SM2/FSRS) with a single commit"""
+    try:
+        reviews = parse_review_batch(request.json or {})
+        intervals = apply_reviews(reviews, current_user_id())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except LookupError as e:
+        return jsonify({'error': 'Card not found', 'card_ids': e.args[0]}), 404
+
+    return jsonify({
+        'message': f'{len(reviews)} reviews recorded successfully',
+        'intervals': intervals
+    })
+
+@bp.route('/statistics')
 def get_statistics():
-    cards = Card.query.all()
-    stats = {
-        'sm2': {
-            'total_reviews': sum(card.sm2_total_reviews for card in cards),
-            'correct_reviews': sum(card.sm2_correct_reviews for card in cards),
-            'accuracy': 0,
-            'average_interval': sum(card.sm2_interval for card in cards) / len(cards) if cards else 0
-        },
-        'fsrs': {
-            'total_reviews': sum(card.fsrs_total_reviews for card in cards),
-            'correct_reviews': sum(card.fsrs_correct_reviews for card in cards),
-            'accuracy': 0,
-            'average_stability': sum(card.fsrs_stability for card in cards) / len(cards) if cards else 0
-        }
-    }
-    
-    if stats['sm2']['total_reviews'] > 0:
-        stats['sm2']['accuracy'] = (stats['sm2']['correct_reviews'] / stats['sm2']['total_reviews']) * 100
-        
-    if stats['fsrs']['total_reviews'] > 0:
-        stats['fsrs']['accuracy'] = (stats['fsrs']['correct_reviews'] / stats['fsrs']['total_reviews']) * 100
-    
-    return jsonify(stats)
+    return jsonify(deck_statistics(current_user_id()))
+
+def upgrade_chunk(job, low, high):
+    """Make one chunk of the user's cards due as of when the job was created"""
+    touch_deck_stats(job.scope)
+    return db.session.execute(
+        update(CardState).where(CardState.user_id == job.scope, CardState.card_id > low, CardState.card_id <= high)
+        .values(next_review=job.created_at)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+def reset_chunk(job, low, high):
+    """Delete one chunk of the user's card states"""
+    touch_deck_stats(job.scope)
+    return db.session.execute(
+        delete(CardState).where(CardState.user_id == job.scope, CardState.card_id > low, CardState.card_id <= high)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+def finish_reset(job):
+    # The user starts over: counters are recounted from any states left and
+    # enrollment starts again from the first card. The row is kept, so its
+    # version keeps increasing
+    stats = compute_deck_stats(job.scope)
+    db.session.execute(update(DeckStats).where(DeckStats.user_id == job.scope).values(
+        enrolled_through=0,
+        version=DeckStats.version + 1,
+        **{column: getattr(stats, column) for column in DECK_STATS_COUNTERS}
+    ))
+    db.session.execute(delete(ReviewPlan).where(ReviewPlan.user_id == job.scope))
+    if db.session.query(Card.id).first() is None:
+        create_test_cards()
+
+def finish_upgrade(job):
+    db.session.execute(update(ReviewPlan).where(ReviewPlan.user_id == job.scope).values(day=None))
 
-@app.route('/reset', methods=['POST'])
+def user_scope(user_id):
+    return (CardState.user_id == user_id,)
+
+jobs.register('upgrade_all', CardState.card_id, upgrade_chunk, finish=finish_upgrade, criteria=user_scope)
+jobs.register('reset', CardState.card_id, reset_chunk, finish=finish_reset, criteria=user_scope)
+
+def start_job(kind):
+    """Queue a maintenance job over the user's cards and run it in the background, returns a 202 with its status"""
+    job = jobs.create(kind, scope=current_user_id())
+    if job.status == 'queued':
+        jobs.start(job.id)
+    response = jsonify(job_status(job))
+    response.headers['Location'] = f'/jobs/{job.id}'
+    return response, 202
+
+@bp.route('/reset', methods=['POST'])
 def reset_cards():
+    """Reset the user's progress on every card, as a background job"""
     try:
-        # Delete all existing cards
-        Card.query.delete()
-        db.session.commit()
-        
-        # Create new test cards
-        create_test_cards()
-        
-        return jsonify({'message': 'Cards reset successfully'})
+        return start_job('reset')
     except Exception as e:
         logger.error(f"Error resetting cards: {str(e)}")
         return jsonify({'error': 'Failed to reset cards'}), 500
 
-@app.route('/upgrade_all', methods=['POST'])
+@bp.route('/upgrade_all', methods=['POST'])
 def upgrade_all():
+    """Make every one of the user's cards due now, as a background job"""
     try:
-        cards = Card.query.all()
-        now = datetime.utcnow()
-        
-        for card in cards:
-            # Move all cards to be due now
-            card.sm2_next_review = now
-            card.fsrs_next_review = now
-        
-        db.session.commit()
-        return jsonify({'message': 'All cards upgraded to be due now'})
+        return start_job('upgrade_all')
     except Exception as e:
         logger.error(f"Error upgrading cards: {str(e)}")
         return jsonify({'error': 'Failed to upgrade cards'}), 500
 
-@app.route('/deck_status')
+def get_user_job(job_id):
+    """A job by id, if it belongs to the current user"""
+    job = db.session.get(MaintenanceJob, job_id)
+    if job is None or job.scope not in (None, current_user_id()):
+        return None
+    return job
+
+@bp.route('/jobs/<int:job_id>')
+def get_job(job_id):
+    job = get_user_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_status(job))
+
+@bp.route('/jobs/<int:job_id>/resume', methods=['POST'])
+def resume_job(job_id):
+    """Continue a failed or abandoned job from the last committed chunk"""
+    job = get_user_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not jobs.resumable(job):
+        return jsonify({'error': f'Job is {job.status} and cannot be resumed'}), 409
+    jobs.start(job.id)
+    response = jsonify(job_status(job))
+    response.headers['Location'] = f'/jobs/{job.id}'
+    return response, 202
+
+@bp.cli.command('run-job')
+@click.argument('kind', type=click.Choice(['upgrade_all', 'reset']))
+@click.argument('user_id')
+def run_job_command(kind, user_id):
+    """Run a maintenance job over a user's cards in the foreground, printing progress"""
+    job = jobs.create(kind, scope=user_id)
+    report_job(job.id)
+
+@bp.cli.command('resume-job')
+@click.argument('job_id', type=int)
+def resume_job_command(job_id):
+    """Resume a failed or abandoned maintenance job in the foreground"""
+    report_job(job_id)
+
+def report_job(job_id):
+    start = time.perf_counter()
+    if not jobs.run(job_id, progress=lambda job: click.echo(f"{job.kind}: {job.processed}/{job.total} rows", err=True)):
+        raise click.ClickException(f'Job {job_id} is already running or finished')
+    job = db.session.get(MaintenanceJob, job_id)
+    click.echo(f"Job {job.id} {job.status}: {job.processed} rows in {time.perf_counter() - start:.2f}s"
+               + (f" ({job.error})" if job.error else ''))
+
+@bp.route('/deck_status')
 def deck_status():
+    user_id = current_user_id()
     now = datetime.utcnow()
-    sm2_due = Card.query.filter(Card.sm2_next_review <= now).count()
-    fsrs_due = Card.query.filter(Card.fsrs_next_review <= now).count()
-    
-    cards = Card.query.all()
-    stats = {
-        'sm2': {
-            'total_reviews': sum(card.sm2_total_reviews for card in cards),
-            'correct_reviews': sum(card.sm2_correct_reviews for card in cards),
-            'accuracy': 0,
-            'average_interval': sum(card.sm2_interval for card in cards) / len(cards) if cards else 0
-        },
-        'fsrs': {
-            'total_reviews': sum(card.fsrs_total_reviews for card in cards),
-            'correct_reviews': sum(card.fsrs_correct_reviews for card in cards),
-            'accuracy': 0,
-            'average_stability': sum(card.fsrs_stability for card in cards) / len(cards) if cards else 0
-        }
-    }
-    
-    if stats['sm2']['total_reviews'] > 0:
-        stats['sm2']['accuracy'] = (stats['sm2']['correct_reviews'] / stats['sm2']['total_reviews']) * 100
-    if stats['fsrs']['total_reviews'] > 0:
-        stats['fsrs']['accuracy'] = (stats['fsrs']['correct_reviews'] / stats['fsrs']['total_reviews']) * 100
+    stats = get_deck_stats(user_id)
+    due = {}
+    for algorithm in ALGORITHMS:
+        snapshot = snapshots.get(user_id, algorithm, stats.version)
+        due[algorithm] = snapshot.due_count(now) if snapshot is not None else db.session.query(
+            func.count(CardState.card_id)
+        ).filter(
+            CardState.user_id == user_id,
+            CardState.algorithm == algorithm,
+            CardState.next_review <= now
+        ).scalar()
     
+    return jsonify({
+        'sm2_due': due['sm2'],
+        'fsrs_due': due['fsrs'],
+        'comparison': algorithm_comparison(format_deck_statistics(stats))
+    })
+
+def algorithm_comparison(stats):
     comparison = ""
     if stats['sm2']['total_reviews'] > 0 and stats['fsrs']['total_reviews'] > 0:
         if stats['sm2']['accuracy'] > stats['fsrs']['accuracy']:
@@ -382,12 +1158,7 @@ def deck_status():
             comparison = "FSRS is currently performing better with higher accuracy. It's more adaptive to your learning patterns."
         else:
             comparison = "Both algorithms are performing equally well. Choose based on your preference for review intervals."
-    
-    return jsonify({
-        'sm2_due': sm2_due,
-        'fsrs_due': fsrs_due,
-        'comparison': comparison
-    })
+    return comparison
 
 def create_test_cards():
     test_words = [
@@ -413,76 +1184,74 @@ def create_test_cards():
     logger.info("Test cards created successfully")
 
 # Add a route to serve static files
-@app.route('/static/<path:filename>')
+@bp.route('/static/<path:filename>')
 def serve_static(filename):
     return send_from_directory('static', filename)
 
-@app.route('/analytics')
+@bp.route('/analytics')
 def get_analytics():
-    """Get detailed analytics data"""
+    """Get detailed analytics data from the precomputed daily rollups"""
     try:
         # Get date range
         days = int(request.args.get('days', 7))
         end_date = datetime.utcnow().date()
         start_date = end_date - timedelta(days=days)
         
-        # Get analytics data
-        analytics_data = Analytics.query.filter(
-            Analytics.date >= start_date,
-            Analytics.date <= end_date
-        ).all()
-        
-        # Prepare response data
-        response = {
-            'daily_stats': [],
-            'algorithm_comparison': {
-                'sm2': {'total_reviews': 0, 'avg_retention': 0},
-                'fsrs': {'total_reviews': 0, 'avg_retention': 0}
-            },
-            'user_engagement': {
-                'total_unique_sessions': len(set(UserActivity.query.with_entities(UserActivity.session_id).all())),
-                'total_reviews': sum(a.total_reviews for a in analytics_data)
-            }
-        }
-        
-        # Process daily stats
-        for analytic in analytics_data:
-            response['daily_stats'].append({
-                'date': analytic.date.isoformat(),
-                'total_reviews': analytic.total_reviews,
-                'sm2_reviews': analytic.daily_stats.get('sm2_reviews', 0),
-                'fsrs_reviews': analytic.daily_stats.get('fsrs_reviews', 0),
-                'sm2_retention': analytic.avg_retention_sm2 or 0,
-                'fsrs_retention': analytic.avg_retention_fsrs or 0
-            })
-            
-            # Update algorithm totals
-            response['algorithm_comparison']['sm2']['total_reviews'] += analytic.daily_stats.get('sm2_reviews', 0)
-            response['algorithm_comparison']['fsrs']['total_reviews'] += analytic.daily_stats.get('fsrs_reviews', 0)
+        key = (start_date, end_date)
+        version = analytics.range_version(start_date, end_date)
+        payload = analytics.payload_cache.get(key, version)
+        if payload is None:
+            payload = analytics.analytics_payload(start_date, end_date)
+            analytics.payload_cache.put(key, version, payload)
         
-        # Calculate averages
-        if response['algorithm_comparison']['sm2']['total_reviews'] > 0:
-            response['algorithm_comparison']['sm2']['avg_retention'] = sum(
-                d['sm2_retention'] * d['sm2_reviews'] for d in response['daily_stats']
-            ) / response['algorithm_comparison']['sm2']['total_reviews']
-            
-        if response['algorithm_comparison']['fsrs']['total_reviews'] > 0:
-            response['algorithm_comparison']['fsrs']['avg_retention'] = sum(
-                d['fsrs_retention'] * d['fsrs_reviews'] for d in response['daily_stats']
-            ) / response['algorithm_comparison']['fsrs']['total_reviews']
-        
-        return jsonify(response)
+        response = jsonify(payload)
+        last_modified, rows = version
+        response.set_etag(f'{start_date}:{end_date}:{rows}:{last_modified.isoformat() if last_modified else ""}')
+        if last_modified:
+            response.last_modified = last_modified
+        return response.make_conditional(request)
     except Exception as e:
         logger.error(f"Error getting analytics: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@bp.cli.command('rollup-analytics')
+@click.option('--days', default=2, help='Number of days back from today to roll up')
+def rollup_analytics_command(days):
+    """Recompute daily unique-session rollups from user_activities"""
+    today = datetime.utcnow().date()
+    for offset in range(days):
+        day = today - timedelta(days=offset)
+        click.echo(f'{day}: {analytics.rollup_day(day)} unique sessions')
+
+@bp.cli.command('archive-logs')
+@click.option('--table', 'tables', multiple=True, type=click.Choice(list(archive.ARCHIVED_MODELS)),
+              help='Defaults to every log table')
+@click.option('--older-than', type=int, help="Days rows stay live; defaults to the table's retention")
+@click.option('--vacuum', is_flag=True, help='Return the freed pages of a SQLite database to the filesystem')
+def archive_logs_command(tables, older_than, vacuum):
+    """Move old log rows into compressed archive segments and expire old segments"""
+    for table in tables or archive.ARCHIVED_MODELS:
+        start = time.perf_counter()
+        moved = archive.compact(table, older_than)
+        expired = archive.expire(table)
+        click.echo(f'{table}: archived {moved} rows, expired {expired} segments in {time.perf_counter() - start:.2f}s')
+    if vacuum and db.engine.dialect.name == 'sqlite':
+        with db.engine.connect() as conn:
+            conn.exec_driver_sql('VACUUM')
+
+@bp.cli.command('archive-status')
+def archive_status_command():
+    """Live and archived rows per log table"""
+    click.echo(json.dumps(archive.status(), indent=2))
+
+app = create_app()
+
 def init_db():
+    """Bring the schema up to date and add the sample cards to an empty deck, for local runs"""
+    import migrations
     with app.app_context():
-        db.create_all()
-        # Check if we already have cards
-        card_count = Card.query.count()
-        logger.info(f"Found {card_count} existing cards")
-        if card_count == 0:
+        migrations.migrate()
+        if db.session.query(Card.id).first() is None:
             create_test_cards()
 
 if __name__ == '__main__':
@@ -0,0 +1,252 @@
+"""Rolling archive of the append-only log tables.
+
+card_reviews, user_activities and algorithm_performance only ever grow.
+compact() moves rows older than a table's live retention out of the
+database, segment_rows at a time in id order, into compressed columnar NPZ
+files under ARCHIVE_DIR, recording each file as an ArchiveSegment row in the
+same transaction that deletes its rows. card_reviews rows are sorted by card
+and split into segments of CARD_SEGMENT_ROWS, each recording its card_id
+range, so readers working through a range of cards skip the other segments. Each column is stored as one array:
+integers and floats as int64/float64 (NaN for NULL), timestamps as
+datetime64[us] (NaT for NULL), and strings and JSON dictionary-encoded as
+the distinct values plus an int32 code per row (-1 for NULL).
+
+scan() reads a table's archived columns back as NumPy arrays, so analytics,
+the FSRS optimizer and the replay see the full history. expire() deletes segments
+past the table's archive retention.
+
+    flask --app app archive-logs
+    flask --app app archive-status
+"""
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import JSON, DateTime, Float, Integer, and_, delete, func, or_, select
+
+from models import db, AlgorithmPerformance, ArchiveSegment, CardReview, UserActivity
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', os.path.join(os.path.abspath(os.path.dirname(__file__)), 'archive'))
+SEGMENT_ROWS = int(os.environ.get('ARCHIVE_SEGMENT_ROWS', 100000))
+CARD_SEGMENT_ROWS = int(os.environ.get('ARCHIVE_CARD_SEGMENT_ROWS', 10000))
+
+ARCHIVED_MODELS = {model.__tablename__: model for model in (CardReview, UserActivity, AlgorithmPerformance)}
+# table: (days rows stay in the live table, days archived segments are kept; None keeps them forever).
+# Review history is kept for the FSRS optimizer; telemetry only feeds rollups
+RETENTION = {
+    'card_reviews': (int(os.environ.get('ARCHIVE_REVIEWS_AFTER_DAYS', 90)), None),
+    'user_activities': (int(os.environ.get('ARCHIVE_ACTIVITY_AFTER_DAYS', 30)), int(os.environ.get('ARCHIVE_ACTIVITY_KEEP_DAYS', 365))),
+    'algorithm_performance': (int(os.environ.get('ARCHIVE_PERFORMANCE_AFTER_DAYS', 30)), int(os.environ.get('ARCHIVE_PERFORMANCE_KEEP_DAYS', 180))),
+}
+
+
+def encode_column(column, values):
+    """{array name: array} storing one column's values"""
+    if isinstance(column.type, DateTime):
+        return {column.name: np.array([value or np.datetime64('NaT') for value in values], dtype='datetime64[us]')}
+    if isinstance(column.type, Integer) and not column.nullable:
+        return {column.name: np.array(values, dtype=np.int64)}
+    if isinstance(column.type, (Integer, Float)):
+        return {column.name: np.array([np.nan if value is None else value for value in values], dtype=np.float64)}
+    if isinstance(column.type, JSON):
+        values = [None if value is None else json.dumps(value) for value in values]
+    distinct = sorted({value for value in values if value is not None})
+    codes = {value: i for i, value in enumerate(distinct)}
+    return {
+        f'{column.name}.values': np.array(distinct, dtype=str),
+        f'{column.name}.codes': np.array([-1 if value is None else codes[value] for value in values], dtype=np.int32),
+    }
+
+
+def decode_column(arrays, name):
+    """One column of a loaded segment.
+
+    Dictionary-encoded columns come back as object arrays with None for
+    NULL; JSON columns stay JSON text.
+    """
+    if name in arrays:
+        return arrays[name]
+    codes = arrays[f'{name}.codes']
+    values = np.append(arrays[f'{name}.values'].astype(object), None)
+    # Code -1 indexes the None appended last
+    return values[codes]
+
+
+def segment_path(table, first_id, last_id, min_timestamp):
+    # SQLite can reuse the ids of deleted rows, so the ids alone aren't unique
+    return os.path.join(table, f'{table}-{min_timestamp:%Y%m%d}-{first_id:012d}-{last_id:012d}.npz')
+
+
+def write_segment(table, rows):
+    """Write rows to a new segment file and add its ArchiveSegment, returns the segment"""
+    columns = ARCHIVED_MODELS[table].__table__.columns
+    arrays = {}
+    for column in columns:
+        arrays.update(encode_column(column, [row[column.name] for row in rows]))
+    timestamps = arrays['timestamp'][~np.isnat(arrays['timestamp'])]
+    min_timestamp, max_timestamp = timestamps.min().item(), timestamps.max().item()
+    first_id, last_id = int(arrays['id'].min()), int(arrays['id'].max())
+    path = segment_path(table, first_id, last_id, min_timestamp)
+    full_path = os.path.join(ARCHIVE_DIR, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    # Written under a temporary name, so a segment file is either complete or absent
+    with open(full_path + '.tmp', 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(full_path + '.tmp', full_path)
+    segment = ArchiveSegment(
+        table_name=table,
+        path=path,
+        first_id=first_id,
+        last_id=last_id,
+        min_timestamp=min_timestamp,
+        max_timestamp=max_timestamp,
+        row_count=len(rows),
+        size_bytes=os.path.getsize(full_path)
+    )
+    if 'card_id' in arrays:
+        segment.min_card_id = int(arrays['card_id'].min())
+        segment.max_card_id = int(arrays['card_id'].max())
+    db.session.add(segment)
+    return segment
+
+
+def card_parts(rows):
+    """card_reviews rows sorted by card, user and time, in segments of CARD_SEGMENT_ROWS"""
+    rows = sorted(rows, key=lambda row: (row['card_id'], row['session_id'], row['timestamp'], row['id']))
+    return [rows[i:i + CARD_SEGMENT_ROWS] for i in range(0, len(rows), CARD_SEGMENT_ROWS)]
+
+
+def split_segment(segment):
+    """Rewrite a card_reviews segment archived before they were split by card, returns the new segments"""
+    columns = [column.name for column in CardReview.__table__.columns]
+    with np.load(os.path.join(ARCHIVE_DIR, segment.path)) as arrays:
+        values = [decode_column(arrays, name).tolist() for name in columns]
+    rows = [dict(zip(columns, row)) for row in zip(*values)]
+    # Deleted first, since a part holding all of its rows gets the same path
+    db.session.delete(segment)
+    db.session.flush()
+    segments = [write_segment('card_reviews', part) for part in card_parts(rows)]
+    db.session.commit()
+    if segment.path not in {new.path for new in segments}:
+        os.remove(os.path.join(ARCHIVE_DIR, segment.path))
+    return segments
+
+
+def compact(table, older_than_days=None, segment_rows=None, now=None):
+    """Move the table's rows older than its live retention into segments, returns the number of rows moved.
+
+    Each segment is committed with the deletion of its rows, so an
+    interrupted run leaves every row either live or archived, never both.
+    """
+    model = ARCHIVED_MODELS[table]
+    older_than_days = RETENTION[table][0] if older_than_days is None else older_than_days
+    cutoff = (now or datetime.utcnow()) - timedelta(days=older_than_days)
+    segment_rows = segment_rows or SEGMENT_ROWS
+    moved = 0
+    while True:
+        rows = db.session.execute(
+            select(*model.__table__.columns)
+            .where(model.timestamp < cutoff)
+            .order_by(model.id)
+            .limit(segment_rows)
+        ).mappings().all()
+        if not rows:
+            return moved
+        parts = card_parts(rows) if table == 'card_reviews' else [rows]
+        segments = [write_segment(table, part) for part in parts]
+        # Exactly the rows just read: the first segment_rows ids below the cutoff
+        db.session.execute(delete(model).where(
+            model.id >= rows[0]['id'],
+            model.id <= rows[-1]['id'],
+            model.timestamp < cutoff
+        ))
+        db.session.commit()
+        moved += len(rows)
+        logger.info(f"Archived {len(rows)} {table} rows to {', '.join(segment.path for segment in segments)}")
+
+
+def expire(table, keep_days=None, now=None):
+    """Delete the table's segments whose newest row is past its archive retention, returns how many"""
+    keep_days = RETENTION[table][1] if keep_days is None else keep_days
+    if keep_days is None:
+        return 0
+    cutoff = (now or datetime.utcnow()) - timedelta(days=keep_days)
+    segments = ArchiveSegment.query.filter(
+        ArchiveSegment.table_name == table,
+        ArchiveSegment.max_timestamp < cutoff
+    ).all()
+    for segment in segments:
+        db.session.delete(segment)
+    db.session.commit()
+    # Files go after the commit: a file without a row is only wasted space
+    for segment in segments:
+        try:
+            os.remove(os.path.join(ARCHIVE_DIR, segment.path))
+        except FileNotFoundError:
+            pass
+    return len(segments)
+
+
+def scan(table, columns, start=None, end=None, card_ids=None):
+    """Yield {column: array} for each archived segment of a table, oldest first.
+
+    Only segments overlapping [start, end) are read, and their rows are
+    filtered to that range. card_ids, a (low, high) pair, likewise limits
+    card_reviews to card ids in [low, high), skipping segments outside it.
+    """
+    query = ArchiveSegment.query.filter(ArchiveSegment.table_name == table)
+    if start is not None:
+        query = query.filter(ArchiveSegment.max_timestamp >= start)
+    if end is not None:
+        query = query.filter(ArchiveSegment.min_timestamp < end)
+    if card_ids is not None:
+        query = query.filter(or_(ArchiveSegment.min_card_id.is_(None), and_(
+            ArchiveSegment.max_card_id >= card_ids[0],
+            ArchiveSegment.min_card_id < card_ids[1]
+        )))
+    for segment in query.order_by(ArchiveSegment.id).all():
+        with np.load(os.path.join(ARCHIVE_DIR, segment.path)) as arrays:
+            keep = slice(None)
+            if start is not None or end is not None or card_ids is not None:
+                keep = np.ones(segment.row_count, dtype=bool)
+                if start is not None:
+                    keep &= arrays['timestamp'] >= np.datetime64(start, 'us')
+                if end is not None:
+                    keep &= arrays['timestamp'] < np.datetime64(end, 'us')
+                if card_ids is not None:
+                    keep &= (arrays['card_id'] >= card_ids[0]) & (arrays['card_id'] < card_ids[1])
+            yield {name: decode_column(arrays, name)[keep] for name in columns}
+
+
+def read(table, columns, start=None, end=None):
+    """scan() concatenated into one array per column"""
+    parts = list(scan(table, columns, start, end))
+    if not parts:
+        return {name: np.array([]) for name in columns}
+    return {name: np.concatenate([part[name] for part in parts]) for name in columns}
+
+
+def status():
+    """Live and archived row counts, oldest live row and archive size per table"""
+    result = {}
+    for table, model in ARCHIVED_MODELS.items():
+        live_rows, oldest = db.session.query(func.count(model.id), func.min(model.timestamp)).one()
+        segments, archived_rows, size = db.session.query(
+            func.count(ArchiveSegment.id),
+            func.coalesce(func.sum(ArchiveSegment.row_count), 0),
+            func.coalesce(func.sum(ArchiveSegment.size_bytes), 0)
+        ).filter(ArchiveSegment.table_name == table).one()
+        result[table] = {
+            'live_rows': live_rows,
+            'oldest_live': oldest.isoformat() if oldest else None,
+            'segments': segments,
+            'archived_rows': int(archived_rows),
+            'archive_bytes': int(size),
+            'archive_after_days': RETENTION[table][0],
+            'keep_days': RETENTION[table][1],
+        }
+    return result
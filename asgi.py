@@ -0,0 +1,292 @@
+"""ASGI variant of the review API on SQLAlchemy's asyncio engine.
+
+Serves /get_due_cards, /review_card, /review_cards, /deck_status and
+/statistics with the same parameters, responses and session_id cookie as
+app.py. The views are async and reach the database through aiosqlite or
+asyncpg, so a process keeps serving other users while one waits on a query
+and can hold far more requests in flight than a sync worker. Queries,
+scheduling with the vectorized SM2/FSRS and the review bookkeeping are
+shared with the Flask app; only the I/O around them is async.
+
+The rare writes that go through the Flask app's own helpers, enrolling a
+user in new cards and building a missing deck_stats row, run on the thread
+pool in an app context instead of being duplicated here. Every other route
+is only served by the Flask app.
+
+    pip install -r requirements-async.txt
+    uvicorn asgi:app
+    GUNICORN_PROFILE=asgi gunicorn asgi:app
+"""
+import asyncio
+import contextlib
+import json
+import logging
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+import analytics
+import database
+from app import (app as flask_app, ALGORITHMS, DEFAULT_DUE_LIMIT, MAX_DUE_LIMIT,
+                 USER_COOKIE_MAX_AGE, FSRS_WEIGHTS_TTL, UPDATE_STATES, algorithm_comparison, deck_statistics,
+                 deck_stats_increments, due_page_query, enroll_cards, enroll_for_queue, format_deck_statistics,
+                 make_cursor, parse_cursor, parse_review, parse_review_batch, patch_plan, plans_to_update,
+                 record_performance, score_reviews, state_params)
+from models import db, Card, CardState, CardReview, DeckStats, FSRSParameters
+from scheduler import compile_fsrs
+
+logger = logging.getLogger(__name__)
+
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+_fsrs_cache = {}
+
+
+def async_database_url(url):
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f'No async driver for {url.get_backend_name()}')
+    return url.set(drivername=driver)
+
+
+database_url = flask_app.config['SQLALCHEMY_DATABASE_URI']
+engine = create_async_engine(async_database_url(database_url), **database.engine_options(database_url))
+database.configure_engine(engine.sync_engine)
+Session = async_sessionmaker(engine, expire_on_commit=False)
+# SQLite takes one writer at a time, and a writer that finds the database
+# locked sleeps in its busy handler. Queueing this process's write
+# transactions on the event loop instead keeps them from contending
+write_lock = asyncio.Lock() if engine.dialect.name == 'sqlite' else contextlib.nullcontext()
+
+
+def in_flask(function, *args):
+    """Run one of the Flask app's synchronous helpers on the thread pool, inside an app context"""
+    def call():
+        with flask_app.app_context():
+            return function(*args)
+    return run_in_threadpool(call)
+
+
+def request_user(request):
+    """(user_id, new) from the session_id cookie, as current_user_id does"""
+    user_id = request.cookies.get('session_id')
+    if not user_id or len(user_id) > CardState.user_id.type.length:
+        return str(uuid.uuid4()), True
+    return user_id, False
+
+
+def respond(user, payload, status_code=200, headers=None):
+    response = JSONResponse(payload, status_code=status_code, headers=headers)
+    user_id, new = user
+    if new:
+        response.set_cookie('session_id', user_id, max_age=USER_COOKIE_MAX_AGE)
+    return response
+
+
+async def get_fsrs(session, deck=None):
+    """Compiled FSRS scheduler with the newest fitted weights for a deck, cached like app.get_fsrs"""
+    now = time.monotonic()
+    cached = _fsrs_cache.get(deck)
+    if cached and now - cached[0] < FSRS_WEIGHTS_TTL:
+        return cached[1]
+    params = await session.scalar(
+        select(FSRSParameters).filter_by(deck=deck)
+        .order_by(FSRSParameters.created_at.desc(), FSRSParameters.id.desc()).limit(1)
+    )
+    fsrs = compile_fsrs(tuple(params.weights) if params else None)
+    _fsrs_cache[deck] = (now, fsrs)
+    return fsrs
+
+
+async def load_states(session, user_id, card_ids):
+    states = (await session.scalars(
+        select(CardState).where(CardState.user_id == user_id, CardState.card_id.in_(card_ids))
+    )).all()
+    for state in states:
+        session.expunge(state)
+    return {(state.card_id, state.algorithm): state for state in states}
+
+
+def enroll_existing(user_id, card_ids, now):
+    try:
+        enroll_cards(user_id, card_ids=card_ids, now=now)
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent request from the same user enrolled them first
+        db.session.rollback()
+
+
+async def apply_reviews(session, reviews, user_id):
+    """app.apply_reviews on the async session: one transaction for the batch"""
+    now = datetime.utcnow()
+    card_ids = {review['card_id'] for review in reviews}
+    states = await load_states(session, user_id, card_ids)
+    unenrolled = card_ids - {card_id for card_id, _ in states}
+    if unenrolled:
+        existing = set(await session.scalars(select(Card.id).where(Card.id.in_(unenrolled))))
+        missing = sorted(unenrolled - existing)
+        if missing:
+            raise LookupError(missing)
+        await in_flask(enroll_existing, user_id, existing, now)
+        states.update(await load_states(session, user_id, existing))
+
+    fsrs = await get_fsrs(session)
+    scheduled, state_rows, review_rows, deck_deltas = score_reviews(reviews, states, user_id, now, fsrs)
+    increments = deck_stats_increments(deck_deltas)
+    pairs = [(review['algorithm'], review['rating']) for review in reviews]
+    missing_stats = False
+    stats = None
+    async with write_lock:
+        await session.execute(UPDATE_STATES, state_params(state_rows))
+        await session.execute(insert(CardReview.__table__), review_rows)
+        if increments:
+            statement = update(DeckStats).where(DeckStats.user_id == user_id).values(**increments)
+            if engine.dialect.update_returning:
+                stats = (await session.execute(statement.returning(DeckStats.plan_day))).first()
+                missing_stats = stats is None
+            else:
+                missing_stats = (await session.execute(statement)).rowcount == 0
+        if stats is None or stats.plan_day == now.date():
+            for plan in await session.scalars(plans_to_update(user_id, reviews, now)):
+                patch_plan(plan, reviews, states, now)
+        await session.execute(analytics.review_upsert(engine.dialect.name), analytics.review_params(pairs, now))
+        await session.commit()
+    if missing_stats:
+        # Built from the committed states, so it already includes this batch
+        await in_flask(deck_statistics, user_id)
+    record_performance(user_id, reviews, scheduled, now)
+    return [new_interval for _, new_interval in scheduled]
+
+
+async def statistics_for(session, user_id):
+    deck = await session.get(DeckStats, user_id)
+    if deck is None:
+        return await in_flask(deck_statistics, user_id)
+    return format_deck_statistics(deck)
+
+
+async def get_due_cards(request):
+    user = request_user(request)
+    user_id = user[0]
+    algorithm = 'sm2' if request.query_params.get('algorithm', 'sm2') == 'sm2' else 'fsrs'
+    now = datetime.utcnow()
+    try:
+        limit = max(1, min(int(request.query_params.get('limit', DEFAULT_DUE_LIMIT)), MAX_DUE_LIMIT))
+        after = parse_cursor(request.query_params['after']) if request.query_params.get('after') else None
+    except ValueError as e:
+        return respond(user, {'error': str(e)}, 400)
+
+    async with Session() as session:
+        rows = (await session.execute(due_page_query(user_id, algorithm, now, after, limit + 1))).all()
+        if len(rows) <= limit and after is None and await in_flask(enroll_for_queue, user_id, limit + 1 - len(rows), now):
+            rows = (await session.execute(due_page_query(user_id, algorithm, now, after, limit + 1))).all()
+
+        if request.query_params.get('format') == 'ndjson':
+            async def generate(rows):
+                async with Session() as session:
+                    while True:
+                        for row in rows[:limit]:
+                            yield json.dumps({'id': row.id, 'front': row.front, 'back': row.back}) + '\n'
+                        if len(rows) <= limit:
+                            break
+                        after = (rows[limit - 1][3], rows[limit - 1].id)
+                        rows = (await session.execute(due_page_query(user_id, algorithm, now, after, limit + 1))).all()
+            response = StreamingResponse(generate(rows), media_type='application/x-ndjson')
+            if user[1]:
+                response.set_cookie('session_id', user_id, max_age=USER_COOKIE_MAX_AGE)
+            return response
+
+        # If no cards are due, return the cards coming up next rather than the whole deck
+        if not rows and after is None:
+            rows = (await session.execute(due_page_query(user_id, algorithm, now, limit=limit, due=False))).all()
+
+    headers = {}
+    if len(rows) > limit:
+        headers['X-Next-Cursor'] = make_cursor(rows[limit - 1][3], rows[limit - 1].id)
+    return respond(user, [{'id': row.id, 'front': row.front, 'back': row.back} for row in rows[:limit]], headers=headers)
+
+
+async def review_card(request):
+    user = request_user(request)
+    try:
+        review = parse_review(await request_json(request))
+        async with Session() as session:
+            await apply_reviews(session, [review], user[0])
+    except ValueError as e:
+        return respond(user, {'error': str(e)}, 400)
+    except LookupError as e:
+        return respond(user, {'error': 'Card not found', 'card_ids': e.args[0]}, 404)
+    return respond(user, {'message': 'Review recorded successfully'})
+
+
+async def review_cards(request):
+    """Record a batch of reviews (mixed SM2/FSRS) with a single commit"""
+    user = request_user(request)
+    try:
+        reviews = parse_review_batch(await request_json(request))
+        async with Session() as session:
+            intervals = await apply_reviews(session, reviews, user[0])
+    except ValueError as e:
+        return respond(user, {'error': str(e)}, 400)
+    except LookupError as e:
+        return respond(user, {'error': 'Card not found', 'card_ids': e.args[0]}, 404)
+    return respond(user, {
+        'message': f'{len(reviews)} reviews recorded successfully',
+        'intervals': intervals
+    })
+
+
+async def request_json(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        raise ValueError('Request body must be JSON')
+    return data or {}
+
+
+async def get_statistics(request):
+    user = request_user(request)
+    async with Session() as session:
+        return respond(user, await statistics_for(session, user[0]))
+
+
+async def deck_status(request):
+    user = request_user(request)
+    user_id = user[0]
+    now = datetime.utcnow()
+    async with Session() as session:
+        sm2_due, fsrs_due = [await session.scalar(select(func.count(CardState.card_id)).where(
+            CardState.user_id == user_id,
+            CardState.algorithm == algorithm,
+            CardState.next_review <= now
+        )) for algorithm in ALGORITHMS]
+        stats = await statistics_for(session, user_id)
+    return respond(user, {
+        'sm2_due': sm2_due,
+        'fsrs_due': fsrs_due,
+        'comparison': algorithm_comparison(stats)
+    })
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    await engine.dispose()
+
+
+app = Starlette(routes=[
+    Route('/get_due_cards', get_due_cards),
+    Route('/review_card', review_card, methods=['POST']),
+    Route('/review_cards', review_cards, methods=['POST']),
+    Route('/deck_status', deck_status),
+    Route('/statistics', get_statistics),
+], lifespan=lifespan)
@@ -0,0 +1,4 @@
+"""Benchmarks for the scheduling algorithms and the Flask endpoints.
+
+Run them from the repository root, e.g. ``python -m benchmarks.review_throughput``.
+"""
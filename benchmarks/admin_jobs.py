@@ -0,0 +1,122 @@
+"""Time the chunked /upgrade_all and /reset jobs against the old ORM loop.
+
+Both run over one user enrolled in every card, so --cards 1000000 means
+2M user_card_state rows. The legacy upgrade loads every state, sets its
+due date in Python and commits once. The jobs update or delete
+chunk_size rows per statement and per transaction. For each run the
+longest transaction is reported, which is how long other writers can be
+blocked, along with how much the process's peak RSS grew.
+
+    python -m benchmarks.admin_jobs --cards 1000000
+    python -m benchmarks.admin_jobs --cards 1000000 --chunk-size 50000 --skip-legacy
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+USER_ID = 'bench'
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def timed_job(kind):
+    from app import db, jobs
+    from models import MaintenanceJob
+
+    job_id = jobs.create(kind, scope=USER_ID).id
+    chunk_times = []
+    last = [time.perf_counter()]
+
+    def progress(job):
+        now = time.perf_counter()
+        chunk_times.append(now - last[0])
+        last[0] = now
+
+    rss = peak_rss_mb()
+    start = time.perf_counter()
+    jobs.run(job_id, progress=progress)
+    seconds = time.perf_counter() - start
+    job = db.session.get(MaintenanceJob, job_id)
+    assert job.status == 'completed', job.error
+    return {
+        'rows': job.processed,
+        'seconds': seconds,
+        'longest_transaction': max(chunk_times, default=0.0),
+        'rss_growth_mb': peak_rss_mb() - rss
+    }
+
+
+def legacy_upgrade():
+    from app import db
+    from models import CardState
+
+    rss = peak_rss_mb()
+    start = time.perf_counter()
+    states = CardState.query.filter_by(user_id=USER_ID).all()
+    now = datetime.utcnow()
+    for state in states:
+        state.next_review = now
+    db.session.commit()
+    seconds = time.perf_counter() - start
+    rows = len(states)
+    del states
+    db.session.expunge_all()
+    return {'rows': rows, 'seconds': seconds, 'longest_transaction': seconds, 'rss_growth_mb': peak_rss_mb() - rss}
+
+
+def run(card_count, skip_legacy):
+    from app import app, db, Card, enroll_cards
+    from benchmarks.synthetic import seed_deck
+
+    results = {}
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        start = time.perf_counter()
+        seed_deck(db, Card, card_count, batch_size=50000)
+        enroll_cards(USER_ID)
+        db.session.commit()
+        print(f'seeded and enrolled {card_count} cards in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+
+        # The jobs run first so the legacy loop's peak RSS can't hide their growth
+        results['upgrade_all job'] = timed_job('upgrade_all')
+        if not skip_legacy:
+            results['upgrade_all legacy'] = legacy_upgrade()
+        results['reset job'] = timed_job('reset')
+        db.session.remove()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='database to benchmark (defaults to a temporary SQLite file)')
+    parser.add_argument('--cards', type=int, default=1000000)
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--skip-legacy', action='store_true', help="don't run the ORM loop, which needs GBs of memory at 1M cards")
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        tmp = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        os.environ['DATABASE_URL'] = 'sqlite:///' + tmp.name
+    os.environ['MAINTENANCE_CHUNK_SIZE'] = str(args.chunk_size)
+
+    results = run(args.cards, args.skip_legacy)
+    print(f"database: {os.environ['DATABASE_URL'].split('://')[0]}, chunk size {args.chunk_size}")
+    for name, result in results.items():
+        print(f"{name:>20}: {result['rows']:>9} rows in {result['seconds']:7.2f}s "
+              f"({result['rows'] / result['seconds']:10.0f} rows/sec), "
+              f"longest transaction {result['longest_transaction'] * 1000:8.1f} ms, "
+              f"peak RSS +{result['rss_growth_mb']:.0f} MB")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
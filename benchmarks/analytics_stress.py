@@ -0,0 +1,135 @@
+"""Concurrency stress test for the analytics counters.
+
+Several processes (standing in for gunicorn workers) each run threads that
+commit update_analytics increments against the same database, then the
+totals are compared with the number of committed transactions. Exits
+non-zero if any increment was lost.
+
+    python -m benchmarks.analytics_stress --processes 4 --threads 4 --iterations 200
+    python -m benchmarks.analytics_stress --legacy   # the old read-modify-write, for comparison
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+
+def legacy_update(reviews):
+    """The previous read-modify-write version of update_analytics"""
+    from app import db
+    from models import Analytics
+
+    today = datetime.utcnow().date()
+    analytics = Analytics.query.filter_by(date=today).first()
+    if not analytics:
+        analytics = Analytics(date=today, total_reviews=0, unique_sessions=0)
+        db.session.add(analytics)
+    for algorithm, rating in reviews:
+        analytics.total_reviews = (analytics.total_reviews or 0) + 1
+        name = f'{algorithm}_reviews'
+        setattr(analytics, name, (getattr(analytics, name) or 0) + 1)
+        if rating >= 3:
+            name = f'{algorithm}_correct'
+            setattr(analytics, name, (getattr(analytics, name) or 0) + 1)
+
+
+def worker(threads, iterations, legacy, seed, results):
+    from app import app, db, update_analytics
+
+    committed = {'total_reviews': 0, 'sm2_reviews': 0, 'fsrs_reviews': 0, 'sm2_correct': 0, 'fsrs_correct': 0}
+    failed = 0
+    lock = threading.Lock()
+
+    def run(thread_seed):
+        nonlocal failed
+        rng = random.Random(thread_seed)
+        with app.app_context():
+            for _ in range(iterations):
+                reviews = [(rng.choice(('sm2', 'fsrs')), rng.randint(1, 4)) for _ in range(rng.randint(1, 5))]
+                try:
+                    if legacy:
+                        legacy_update(reviews)
+                    else:
+                        update_analytics('stress', reviews)
+                    db.session.commit()
+                except (IntegrityError, OperationalError):
+                    db.session.rollback()
+                    with lock:
+                        failed += 1
+                    continue
+                with lock:
+                    committed['total_reviews'] += len(reviews)
+                    for algorithm, rating in reviews:
+                        committed[f'{algorithm}_reviews'] += 1
+                        committed[f'{algorithm}_correct'] += rating >= 3
+            db.session.remove()
+
+    pool = [threading.Thread(target=run, args=(seed * 1000 + i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put((committed, failed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='database to test (defaults to a temporary SQLite file)')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--legacy', action='store_true', help='use the old read-modify-write update')
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + tempfile.NamedTemporaryFile(suffix='.db', delete=False).name
+
+    from app import app, db
+    from models import Analytics
+    with app.app_context():
+        db.create_all()
+        Analytics.query.delete()
+        db.session.commit()
+        db.session.remove()
+
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    start = time.perf_counter()
+    processes = [ctx.Process(target=worker, args=(args.threads, args.iterations, args.legacy, seed, results))
+                 for seed in range(args.processes)]
+    for process in processes:
+        process.start()
+    expected = {}
+    failed = 0
+    for _ in processes:
+        committed, worker_failed = results.get()
+        failed += worker_failed
+        for name, value in committed.items():
+            expected[name] = expected.get(name, 0) + value
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        stored = {name: sum(getattr(row, name) or 0 for row in Analytics.query.all()) for name in expected}
+    transactions = args.processes * args.threads * args.iterations
+    print(f'{transactions - failed} transactions committed, {failed} rolled back, {elapsed:.1f}s')
+    lost = False
+    for name in expected:
+        print(f'{name:>14}: expected {expected[name]:7d}, stored {stored[name]:7d}')
+        lost = lost or stored[name] != expected[name]
+    print('LOST INCREMENTS' if lost else 'no increments lost')
+    return 1 if lost else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""Compare the ASGI review API (asgi.py) with the Flask app under gunicorn.
+
+Each deployment serves a fresh copy of a seeded SQLite database (or
+--database-url) while --clients simulated users, multiplexed on one asyncio
+event loop, loop over /get_due_cards?limit=1, /review_card with a random
+rating and now and then /statistics for --duration seconds. Deployments:
+
+- sync: gunicorn sync workers running app.py (the Procfile setup)
+- gthread: gunicorn threaded workers running app.py
+- asgi: gunicorn uvicorn workers running asgi.py
+
+    python -m benchmarks.async_vs_sync
+    python -m benchmarks.async_vs_sync --workers 1 --clients 256 --deployments sync asgi
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.suite import percentiles
+from benchmarks.worker_profiles import ROOT, free_port, seed_database, wait_for
+
+DEPLOYMENTS = {
+    'sync': ('app:app', 'sync'),
+    'gthread': ('app:app', 'gthread'),
+    'asgi': ('asgi:app', 'asgi'),
+}
+
+
+class Connection:
+    """A minimal HTTP/1.1 keep-alive client, reconnecting when the server closes"""
+
+    def __init__(self, port, user_id):
+        self.port = port
+        self.user_id = user_id
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+        data = json.dumps(body).encode() if body is not None else b''
+        self.writer.write((
+            f'{method} {path} HTTP/1.1\r\nHost: localhost\r\nCookie: session_id={self.user_id}\r\n'
+            f'Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n'
+        ).encode() + data)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, value = line.decode().split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        payload = await self.reader.readexactly(int(headers.get('content-length', 0)))
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, payload
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def user(port, user_id, deadline, seed, results):
+    rng = random.Random(seed)
+    conn = Connection(port, user_id)
+
+    async def call(method, path, body=None):
+        start = time.perf_counter()
+        try:
+            status, payload = await conn.request(method, path, body)
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+            conn.close()
+            results['errors'] += 1
+            return None
+        results['latencies'].append(time.perf_counter() - start)
+        if status >= 500:
+            results['errors'] += 1
+            return None
+        return json.loads(payload) if payload else None
+
+    while time.time() < deadline:
+        algorithm = rng.choice(('sm2', 'fsrs'))
+        cards = await call('GET', f'/get_due_cards?limit=1&algorithm={algorithm}')
+        if cards:
+            review = {'card_id': cards[0]['id'], 'algorithm': algorithm, 'rating': rng.randint(1, 4), 'review_time': 0}
+            if await call('POST', '/review_card', review) is not None:
+                results['reviews'] += 1
+        if rng.random() < 0.1:
+            await call('GET', '/statistics')
+    conn.close()
+
+
+async def load(port, clients, duration, prefix):
+    results = {'latencies': [], 'reviews': 0, 'errors': 0}
+    deadline = time.time() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*(user(port, f'{prefix}-{i}', deadline, i, results) for i in range(clients)))
+    results['elapsed'] = time.perf_counter() - start
+    return results
+
+
+def run_deployment(name, database_url, workers, clients, duration):
+    target, profile = DEPLOYMENTS[name]
+    port = free_port()
+    env = dict(os.environ, GUNICORN_PROFILE=profile, DATABASE_URL=database_url)
+    log = tempfile.TemporaryFile()
+    server = subprocess.Popen(
+        ['gunicorn', target, '--bind', f'127.0.0.1:{port}', '--workers', str(workers)],
+        cwd=ROOT, env=env, stdout=log, stderr=log
+    )
+    try:
+        wait_for(port)
+        results = asyncio.run(load(port, clients, duration, f'{name}-{clients}'))
+    finally:
+        server.terminate()
+        server.wait()
+    return dict(
+        percentiles(results['latencies']) if results['latencies'] else {},
+        requests_per_sec=len(results['latencies']) / results['elapsed'],
+        reviews_per_sec=results['reviews'] / results['elapsed'],
+        errors=results['errors']
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='database to load (defaults to a fresh SQLite copy per run)')
+    parser.add_argument('--deployments', nargs='+', choices=DEPLOYMENTS, default=list(DEPLOYMENTS))
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--clients', type=int, nargs='+', default=[16, 128])
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--cards', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp()
+    results = {}
+    try:
+        template = os.path.join(workdir, 'template.db')
+        if not args.database_url:
+            seed_database(template, args.cards)
+        for clients in args.clients:
+            for name in args.deployments:
+                database_url = args.database_url
+                if not database_url:
+                    path = os.path.join(workdir, f'{name}-{clients}.db')
+                    shutil.copy(template, path)
+                    database_url = 'sqlite:///' + path
+                results[name, clients] = run_deployment(name, database_url, args.workers, clients, args.duration)
+                print(f'{name} with {clients} clients: done', file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir)
+
+    print(f"{args.workers} worker(s), {args.duration:.0f}s per run")
+    for (name, clients), result in results.items():
+        print(f"{name:>8} {clients:>5} clients: {result['requests_per_sec']:7.1f} req/s "
+              f"{result['reviews_per_sec']:7.1f} reviews/s  p50 {result.get('p50_ms', 0):7.1f} ms  "
+              f"p95 {result.get('p95_ms', 0):7.1f} ms  p99 {result.get('p99_ms', 0):7.1f} ms  {result['errors']} errors")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
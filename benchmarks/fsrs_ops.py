@@ -0,0 +1,64 @@
+"""Single-review FSRS scheduling: ops/sec of each way the app has scheduled one card.
+
+- per-request: FSRS().calculate, with a fresh scheduler per review as the
+  old review_card did
+- scalar: FSRS.review on a reused scheduler
+- vectorized-1: scheduler.fsrs_next on one-element arrays
+- compiled: CompiledFSRS.review, what schedule_reviews uses for small batches
+
+Exits non-zero if the compiled scheduler doesn't reproduce FSRS exactly.
+
+    python -m benchmarks.fsrs_ops --reviews 200000
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+
+import scheduler
+from benchmarks.scheduler_parity import random_states
+from scheduler import FSRS
+
+
+def ops_per_sec(function, reviews, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for args in reviews:
+            function(*args)
+        best = min(best, time.perf_counter() - start)
+    return len(reviews) / best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reviews', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    states = random_states(args.reviews, args.seed)
+    reviews = list(zip(states['difficulty'].tolist(), states['stability'].tolist(),
+                       states['elapsed'].tolist(), states['rating'].tolist()))
+    now = datetime(2024, 1, 1)
+
+    fsrs = FSRS()
+    compiled = scheduler.compile_fsrs()
+    few = reviews[:max(1, args.reviews // 20)]
+    candidates = [
+        ('per-request', lambda d, s, elapsed, rating: FSRS().calculate(d, s, now - timedelta(days=elapsed), now, rating), reviews),
+        ('scalar', fsrs.review, reviews),
+        # NumPy's overhead per call makes this ~20x slower, so it's timed on fewer reviews
+        ('vectorized-1', lambda d, s, elapsed, rating: scheduler.fsrs_next([d], [s], [elapsed], [rating], fsrs), few),
+        ('compiled', compiled.review, reviews),
+    ]
+    for name, function, sample in candidates:
+        rate = ops_per_sec(function, sample)
+        print(f'{name:>12}: {rate:12.0f} reviews/sec, {1e6 / rate:6.2f} us/review')
+
+    expected = [fsrs.review(*review) for review in reviews]
+    mismatches = sum(compiled.review(*review) != result for review, result in zip(reviews, expected))
+    print(f'compiled mismatches: {mismatches}')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
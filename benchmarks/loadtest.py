@@ -0,0 +1,250 @@
+"""Load test the app under gunicorn with a mixed traffic profile and gate on regressions.
+
+gunicorn serves the app, with INSTRUMENTATION=1, from a temporary SQLite
+database seeded with --cards cards, or from --database-url (SQLite or
+Postgres; migrated and seeded if it has no cards). --clients simulated
+users then run for --duration seconds. Each action a user takes is drawn
+from MIX:
+
+- a page view of /
+- fetching their due cards with /get_due_cards
+- reviewing the next of those cards with /review_card, rated as in
+  RATINGS under SM2 or FSRS
+- polling /statistics or /deck_status
+
+Reported per endpoint: latency percentiles, requests, errors (status 400
+or more, or no response) and the time the server spent in writing
+statements, from the Server-Timing header. Writers wait for database
+locks inside those statements, so write time is mostly lock wait. The
+number of "database is locked" errors logged by the workers is reported
+too.
+
+--save-baseline writes the results to --baseline. Otherwise, if the
+baseline exists, every result is diffed against it and the run fails
+(exit status 1) when an endpoint's p95 or p99 latency or p95 write time
+grows by more than --tolerance plus --slack-ms, when throughput drops by
+more than --tolerance, or when the error rate exceeds --max-error-rate:
+
+    python -m benchmarks.loadtest --save-baseline
+    python -m benchmarks.loadtest
+    python -m benchmarks.loadtest --database-url postgresql://localhost/loadtest --profile gthread:tuned
+"""
+import argparse
+import http.client
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from benchmarks.suite import compare, metadata, percentiles
+from benchmarks.worker_profiles import ROOT, Client, free_port, wait_for
+
+# Relative frequency of each action
+MIX = {'page_view': 0.05, 'due_cards': 0.15, 'review': 0.6, 'statistics': 0.15, 'deck_status': 0.05}
+# Probability of each rating, about 85% recall
+RATINGS = {1: 0.1, 2: 0.05, 3: 0.65, 4: 0.2}
+GATED = ('p95_ms', 'p99_ms', 'write_p95_ms')
+SERVER_TIMING_RE = re.compile(r'(\w+);dur=([\d.]+)')
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'loadtest_baseline.json')
+
+
+def prepare_database(database_url, card_count):
+    """Migrate the database and seed card_count cards if it has none"""
+    env = dict(os.environ, DATABASE_URL=database_url)
+    subprocess.run([sys.executable, 'migrations.py'], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    subprocess.run([sys.executable, '-c', (
+        'from app import app, db, Card\n'
+        'from benchmarks.synthetic import seed_deck\n'
+        'with app.app_context():\n'
+        '    if db.session.query(Card.id).first() is None:\n'
+        f'        seed_deck(db, Card, {card_count})\n'
+    )], cwd=ROOT, env=env, check=True, stderr=subprocess.DEVNULL)
+
+
+class MixedClient(Client):
+    """One user drawing actions from MIX, recording each request by endpoint"""
+
+    def __init__(self, port, user_id, deadline, seed):
+        super().__init__(port, user_id, deadline, seed)
+        self.samples = defaultdict(list)
+        self.write_times = defaultdict(list)
+        self.failures = defaultdict(int)
+        self.unanswered = defaultdict(int)
+        self.due = []
+
+    def request(self, method, path, body=None):
+        endpoint = f'{method} {path.split("?")[0]}'
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        start = time.perf_counter()
+        try:
+            self.conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=self.headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = None
+            self.failures[endpoint] += 1
+            self.unanswered[endpoint] += 1
+            return None
+        self.samples[endpoint].append(time.perf_counter() - start)
+        timing = dict(SERVER_TIMING_RE.findall(response.getheader('Server-Timing') or ''))
+        self.write_times[endpoint].append(float(timing.get('write', 0)) / 1000)
+        if response.status >= 400:
+            self.failures[endpoint] += 1
+            return None
+        return data
+
+    def run(self):
+        actions = list(MIX)
+        weights = list(MIX.values())
+        while time.time() < self.deadline:
+            action = self.rng.choices(actions, weights)[0]
+            if action == 'review' and not self.due:
+                action = 'due_cards'
+            if action == 'page_view':
+                self.request('GET', '/')
+            elif action == 'due_cards':
+                algorithm = self.rng.choice(('sm2', 'fsrs'))
+                data = self.request('GET', f'/get_due_cards?algorithm={algorithm}&limit=20')
+                self.due = [(card['id'], algorithm) for card in json.loads(data)] if data else []
+            elif action == 'review':
+                card_id, algorithm = self.due.pop(0)
+                rating = self.rng.choices(list(RATINGS), list(RATINGS.values()))[0]
+                if self.request('POST', '/review_card', {'card_id': card_id, 'algorithm': algorithm,
+                                                         'rating': rating, 'review_time': 0}) is not None:
+                    self.reviews += 1
+            else:
+                self.request('GET', f'/{action}')
+
+
+def run_load(database_url, profile, workers, clients, duration):
+    worker_profile, db_profile = profile.split(':')
+    port = free_port()
+    env = dict(os.environ, GUNICORN_PROFILE=worker_profile, DB_PROFILE=db_profile, DATABASE_URL=database_url,
+               INSTRUMENTATION='1')
+    log = tempfile.TemporaryFile()
+    server = subprocess.Popen(
+        ['gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}', '--workers', str(workers)],
+        cwd=ROOT, env=env, stdout=log, stderr=log
+    )
+    try:
+        wait_for(port)
+        deadline = time.time() + duration
+        # User ids are unique per run, so every run starts from newly enrolled users
+        run_id = time.time_ns()
+        threads = [MixedClient(port, f'load-{run_id}-{i}', deadline, seed=i) for i in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+    log.seek(0)
+    locked = log.read().count(b'database is locked')
+
+    endpoints = {}
+    for endpoint in sorted({endpoint for thread in threads for endpoint in (*thread.samples, *thread.failures)}):
+        samples = [sample for thread in threads for sample in thread.samples[endpoint]]
+        write_times = [write for thread in threads for write in thread.write_times[endpoint]]
+        errors = sum(thread.failures[endpoint] for thread in threads)
+        requests = len(samples) + sum(thread.unanswered[endpoint] for thread in threads)
+        result = percentiles(samples) if samples else {}
+        write = percentiles(write_times) if write_times else {}
+        endpoints[endpoint] = dict(
+            result,
+            requests=requests,
+            errors=errors,
+            error_rate=errors / max(1, requests),
+            write_p95_ms=write.get('p95_ms', 0.0),
+            write_seconds=sum(write_times)
+        )
+    total = sum(result['requests'] for result in endpoints.values())
+    return {
+        'endpoints': endpoints,
+        'requests_per_sec': total / elapsed,
+        'reviews_per_sec': sum(thread.reviews for thread in threads) / elapsed,
+        'locked': locked,
+    }
+
+
+def regressions(baseline, results, tolerance, slack_ms, max_error_rate):
+    """Descriptions of every gate the results fail"""
+    failures = []
+    for endpoint, result in results['endpoints'].items():
+        if result['error_rate'] > max_error_rate:
+            failures.append(f"{endpoint}: {result['errors']} errors in {result['requests']} requests")
+        old = baseline['endpoints'].get(endpoint) if baseline else None
+        if not old:
+            continue
+        for metric in GATED:
+            limit = old.get(metric, 0.0) * (1 + tolerance) + slack_ms
+            if result.get(metric, 0.0) > limit:
+                failures.append(f'{endpoint}: {metric} {result[metric]:.1f} ms, baseline {old[metric]:.1f} ms '
+                                f'(limit {limit:.1f} ms)')
+    if baseline and results['requests_per_sec'] < baseline['requests_per_sec'] * (1 - tolerance):
+        failures.append(f"throughput {results['requests_per_sec']:.1f} req/s, "
+                        f"baseline {baseline['requests_per_sec']:.1f} req/s")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='database to load (defaults to a fresh temporary SQLite file)')
+    parser.add_argument('--profile', default='sync:tuned', help='WORKER_PROFILE:DB_PROFILE, as in worker_profiles')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--cards', type=int, default=2000)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline results file')
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline instead of checking it')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative regression')
+    parser.add_argument('--slack-ms', type=float, default=5.0, help='allowed absolute latency regression on top of --tolerance')
+    parser.add_argument('--max-error-rate', type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp()
+    try:
+        database_url = args.database_url or 'sqlite:///' + os.path.join(workdir, 'loadtest.db')
+        prepare_database(database_url, args.cards)
+        results = run_load(database_url, args.profile, args.workers, args.clients, args.duration)
+    finally:
+        shutil.rmtree(workdir)
+
+    print(f"{args.profile}, {args.workers} workers, {args.clients} clients, {args.duration:.0f}s: "
+          f"{results['requests_per_sec']:.1f} req/s, {results['reviews_per_sec']:.1f} reviews/s, "
+          f"{results['locked']} 'database is locked' errors logged")
+    for endpoint, result in results['endpoints'].items():
+        print(f"{endpoint:>20}: {result['requests']:7} requests  p50 {result.get('p50_ms', 0):6.1f} ms  "
+              f"p95 {result.get('p95_ms', 0):7.1f} ms  p99 {result.get('p99_ms', 0):7.1f} ms  "
+              f"write p95 {result['write_p95_ms']:6.1f} ms  {result['errors']} errors")
+
+    report = {'metadata': metadata(), 'config': vars(args), 'results': results}
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f'Baseline written to {args.baseline}')
+        return 0
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        compare(stored, report)
+        baseline = stored['results']
+    failures = regressions(baseline, results, args.tolerance, args.slack_ms, args.max_error_rate)
+    for failure in failures:
+        print(f'FAIL: {failure}', file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
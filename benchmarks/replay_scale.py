@@ -0,0 +1,112 @@
+"""Time replay.py on a synthetic review log and check its report is deterministic.
+
+--reviews reviews are written to card_reviews as --users users' histories
+over --cards cards, with ratings drawn from a forgetting curve as in
+synthetic.review_stream. The log is replayed with one process and with
+--processes processes, then its older half is moved to the archive and it
+is replayed again. Exits non-zero unless all three reports are identical.
+
+    python -m benchmarks.replay_scale --reviews 1000000 --processes 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import insert
+
+
+def seed_log(db, card_review_model, cards, users, reviews, curve, seed, batch_size=50000):
+    """Write synthetic review histories, returns the median review time"""
+    from benchmarks.synthetic import FORGETTING_CURVES
+
+    forgetting = FORGETTING_CURVES[curve]
+    rng = np.random.default_rng(seed)
+    history = rng.integers(0, cards * users, reviews)
+    order = np.argsort(history, kind='stable')
+    history = history[order]
+    gaps = rng.exponential(3.0, reviews)
+    first = np.r_[True, np.diff(history) != 0]
+    gaps[first] = rng.uniform(0, 60, first.sum())
+    # Days since the start of the log, cumulative within each history
+    start = np.flatnonzero(first)
+    offsets = np.cumsum(gaps)
+    offsets -= np.repeat(offsets[start] - gaps[start], np.diff(np.r_[start, reviews]))
+    memory = rng.exponential(5.0, reviews) + 0.1
+    recalled = rng.random(reviews) < forgetting(gaps, memory)
+    ratings = np.where(recalled, np.where(rng.random(reviews) < 0.2, 4, 3), 1)
+    algorithms = np.where(rng.random(reviews) < 0.5, 'sm2', 'fsrs')
+    origin = datetime(2024, 1, 1)
+    timestamps = np.datetime64(origin, 'us') + (offsets * 86400e6).astype('timedelta64[us]')
+
+    # Rows go in in time order, as the app writes them
+    by_time = np.argsort(timestamps, kind='stable')
+    for begin in range(0, reviews, batch_size):
+        rows = by_time[begin:begin + batch_size]
+        db.session.execute(insert(card_review_model), [{
+            'session_id': f'user-{history[i] // cards}',
+            'card_id': int(history[i] % cards) + 1,
+            'timestamp': timestamps[i].item(),
+            'algorithm': algorithms[i],
+            'rating': int(ratings[i]),
+        } for i in rows.tolist()])
+    db.session.commit()
+    return np.sort(timestamps)[reviews // 2].item()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reviews', type=int, default=1000000)
+    parser.add_argument('--cards', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--shards', type=int, default=64)
+    parser.add_argument('--curve', choices=('exponential', 'power'), default='power')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmp, 'replay.db')
+    os.environ['ARCHIVE_DIR'] = os.path.join(tmp, 'archive')
+
+    import archive
+    import replay
+    from app import app, db
+    from benchmarks.synthetic import seed_deck
+    from models import Card, CardReview
+
+    with app.app_context():
+        db.create_all()
+        seed_deck(db, Card, args.cards)
+        median = seed_log(db, CardReview, args.cards, args.users, args.reviews, args.curve, args.seed)
+        db.session.remove()
+
+    reports = {}
+    for name, processes in (('1 process', 1), (f'{args.processes} processes', args.processes)):
+        start = time.perf_counter()
+        reports[name] = replay.run(args.shards, processes)
+        seconds = time.perf_counter() - start
+        print(f'{name:>22}: {seconds:6.2f}s, {args.reviews / seconds:9.0f} reviews/sec')
+    with app.app_context():
+        moved = archive.compact('card_reviews', older_than_days=0, now=median)
+        db.session.remove()
+    start = time.perf_counter()
+    reports['half archived'] = replay.run(args.shards, args.processes)
+    seconds = time.perf_counter() - start
+    print(f"{'half archived':>22}: {seconds:6.2f}s, {args.reviews / seconds:9.0f} reviews/sec ({moved} rows archived)")
+
+    for algorithm, metrics in reports['1 process']['algorithms'].items():
+        print(f"{algorithm:>5}: log-loss {metrics['log_loss']:.4f}, calibration error {metrics['calibration_error']:.4f}, "
+              f"{metrics['workload']['predicted_reviews']} due vs {metrics['workload']['actual_reviews']} done")
+    expected = reports['1 process']
+    mismatches = [name for name, report in reports.items() if report != expected]
+    for name in mismatches:
+        print(f'FAIL: the report with {name} differs from the single-process one', file=sys.stderr)
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""Compare reviews/sec of the original /review_card against the current endpoints.
+
+The baseline is the real pre-series code: the tree at --baseline-rev is
+exported with git archive and its app.py runs on its own freshly created
+database, with its own schema and update_analytics. The current tree runs
+/review_card one review per request and /review_cards in batches. Both go
+through the Flask test client in a fresh interpreter, so neither side pays
+for HTTP or a server. Telemetry queued by the current app is flushed inside
+the timed section; run with TELEMETRY_ASYNC=0 to write it on the request.
+
+    python -m benchmarks.review_throughput --cards 2000 --reviews 2000
+    TELEMETRY_ASYNC=0 python -m benchmarks.review_throughput
+    python -m benchmarks.review_throughput --database-url postgresql://localhost/bench \\
+        --baseline-database-url postgresql://localhost/bench_baseline
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from benchmarks.worker_profiles import ROOT
+
+BASELINE_REV = 'caaee20'
+
+BASELINE = '''
+import json, sys, time
+from sqlalchemy import insert
+from app import app, db, Card
+reviews = json.load(sys.stdin)
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+    db.session.execute(insert(Card), [{'front': f'front {i}', 'back': f'back {i}'} for i in range(%(cards)d)])
+    db.session.commit()
+    card_ids = [card_id for (card_id,) in db.session.query(Card.id)]
+    db.session.remove()
+client = app.test_client()
+start = time.perf_counter()
+for review in reviews:
+    review = dict(review, card_id=card_ids[review['card_id']])
+    assert client.post('/review_card', json=review).status_code == 200
+print(json.dumps({'review_card': len(reviews) / (time.perf_counter() - start)}))
+'''
+
+CURRENT = '''
+import json, sys, time
+from sqlalchemy import insert
+from app import app, db, Card, enroll_cards
+reviews = json.load(sys.stdin)
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+    db.session.execute(insert(Card), [{'front': f'front {i}', 'back': f'back {i}'} for i in range(%(cards)d)])
+    enroll_cards('bench')
+    db.session.commit()
+    card_ids = [card_id for (card_id,) in db.session.query(Card.id)]
+    db.session.remove()
+reviews = [dict(review, card_id=card_ids[review['card_id']]) for review in reviews]
+client = app.test_client()
+headers = {'Cookie': 'session_id=bench'}
+results = {}
+start = time.perf_counter()
+for review in reviews:
+    assert client.post('/review_card', json=review, headers=headers).status_code == 200
+app.extensions['telemetry'].stop()
+results['review_card'] = len(reviews) / (time.perf_counter() - start)
+start = time.perf_counter()
+for i in range(0, len(reviews), %(batch_size)d):
+    batch = {'reviews': reviews[i:i + %(batch_size)d]}
+    assert client.post('/review_cards', json=batch, headers=headers).status_code == 200
+app.extensions['telemetry'].stop()
+results['review_cards_%(batch_size)d'] = len(reviews) / (time.perf_counter() - start)
+print(json.dumps(results))
+'''
+
+
+def make_reviews(card_count, count, seed):
+    """Reviews referring to cards by position, so both schemas can map them to their own ids.
+
+    Each card is reviewed at most once per algorithm: the baseline crashes on
+    an FSRS review before the card's due date.
+    """
+    rng = random.Random(seed)
+    pairs = rng.sample(range(2 * card_count), count)
+    return [{
+        'card_id': pair // 2,
+        'rating': rng.choice((1, 2, 3, 4)),
+        'algorithm': ('sm2', 'fsrs')[pair % 2],
+        'review_time': 0.0
+    } for pair in pairs]
+
+
+def export_tree(rev, directory):
+    """Extract the files of rev into directory"""
+    archive = subprocess.run(['git', 'archive', rev], cwd=ROOT, check=True, capture_output=True).stdout
+    subprocess.run(['tar', '-x', '-C', directory], input=archive, check=True)
+
+
+def measure(script, tree, database_url, reviews, **params):
+    env = dict(os.environ, DATABASE_URL=database_url)
+    output = subprocess.run([sys.executable, '-c', script % params], cwd=tree, env=env, check=True,
+                            input=json.dumps(reviews), capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def temporary_database():
+    tmp = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    return 'sqlite:///' + tmp.name
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='database for the current tree (defaults to a temporary SQLite file)')
+    parser.add_argument('--baseline-database-url',
+                        help='database for the baseline, which has its own schema (defaults to a temporary SQLite file)')
+    parser.add_argument('--baseline-rev', default=BASELINE_REV, help='git revision of the baseline')
+    parser.add_argument('--cards', type=int, default=1000)
+    parser.add_argument('--reviews', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.database_url and not args.baseline_database_url:
+        parser.error('--database-url needs a separate --baseline-database-url')
+    if args.reviews > 2 * args.cards:
+        parser.error('--reviews can be at most twice --cards')
+
+    reviews = make_reviews(args.cards, args.reviews, args.seed)
+    runs = {}
+    with tempfile.TemporaryDirectory() as tree:
+        export_tree(args.baseline_rev, tree)
+        for _ in range(args.repeat):
+            baseline = measure(BASELINE, tree, args.baseline_database_url or temporary_database(), reviews,
+                               cards=args.cards)
+            current = measure(CURRENT, ROOT, args.database_url or temporary_database(), reviews,
+                              cards=args.cards, batch_size=args.batch_size)
+            for name, rate in baseline.items():
+                runs.setdefault(f'{args.baseline_rev} {name}', []).append(rate)
+            for name, rate in current.items():
+                runs.setdefault(name, []).append(rate)
+
+    print(f"database: {(args.database_url or 'sqlite').split('://')[0]}, "
+          f"telemetry: {'sync' if os.environ.get('TELEMETRY_ASYNC', '1') == '0' else 'async'}")
+    reference = float(np.median(runs[f'{args.baseline_rev} review_card']))
+    for name, rates in runs.items():
+        rate = float(np.median(rates))
+        print(f'{name:>20}: {rate:10.1f} reviews/sec ({rate / reference:.2f}x), '
+              f'runs {min(rates):.0f}-{max(rates):.0f}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Check the vectorized scheduler against the scalar SM2/FSRS classes.
+
+Exits non-zero if any SM2 result differs or any FSRS result falls outside
+scheduler.FSRS_RTOL, and reports cards/sec for both implementations.
+
+    python -m benchmarks.scheduler_parity --cards 100000
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import scheduler
+from scheduler import SM2, FSRS
+
+
+def random_states(n, seed):
+    rng = np.random.default_rng(seed)
+    return {
+        'interval': rng.integers(0, 400, n),
+        'repetitions': rng.integers(0, 8, n),
+        'ease_factor': rng.uniform(1.3, 2.5, n),
+        'difficulty': rng.uniform(1, 10, n),
+        'stability': rng.uniform(0.1, 365, n),
+        'elapsed': rng.integers(-10, 500, n),
+        'rating': rng.integers(1, 5, n),
+    }
+
+
+def scalar_sm2(states):
+    out = []
+    for interval, repetitions, ease, rating in zip(
+            states['interval'].tolist(), states['repetitions'].tolist(),
+            states['ease_factor'].tolist(), states['rating'].tolist()):
+        sm2 = SM2()
+        sm2.interval, sm2.repetitions, sm2.ease_factor = interval, repetitions, ease
+        out.append(sm2.calculate(rating))
+    return out
+
+
+def scalar_fsrs(states):
+    fsrs = FSRS()
+    out = []
+    for d, s, elapsed, rating in zip(
+            states['difficulty'].tolist(), states['stability'].tolist(),
+            states['elapsed'].tolist(), states['rating'].tolist()):
+        r = fsrs.retrievability(max(0, elapsed), s)
+        new_s = fsrs.stability(s, d, r, rating)
+        out.append((fsrs.difficulty(d, rating), new_s, fsrs.next_interval(new_s)))
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cards', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    states = random_states(args.cards, args.seed)
+
+    start = time.perf_counter()
+    expected_sm2 = scalar_sm2(states)
+    scalar_sm2_time = time.perf_counter() - start
+    start = time.perf_counter()
+    got_sm2 = scheduler.sm2_next(states['interval'], states['repetitions'], states['ease_factor'], states['rating'])
+    vector_sm2_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected_fsrs = scalar_fsrs(states)
+    scalar_fsrs_time = time.perf_counter() - start
+    start = time.perf_counter()
+    got_fsrs = scheduler.fsrs_next(states['difficulty'], states['stability'], states['elapsed'], states['rating'])
+    vector_fsrs_time = time.perf_counter() - start
+
+    sm2_mismatches = sum(
+        expected != got for expected, got in zip(expected_sm2, zip(*(column.tolist() for column in got_sm2))))
+    expected_d, expected_s, expected_i = (np.array(column) for column in zip(*expected_fsrs))
+    fsrs_mismatches = int(np.count_nonzero(
+        (expected_d != got_fsrs[0]) |
+        ~np.isclose(expected_s, got_fsrs[1], rtol=scheduler.FSRS_RTOL, atol=0) |
+        (expected_i != got_fsrs[2])))
+
+    for name, scalar_time, vector_time, mismatches in (
+            ('sm2', scalar_sm2_time, vector_sm2_time, sm2_mismatches),
+            ('fsrs', scalar_fsrs_time, vector_fsrs_time, fsrs_mismatches)):
+        print(f'{name:>4}: scalar {args.cards / scalar_time:12.0f} cards/sec, '
+              f'vectorized {args.cards / vector_time:12.0f} cards/sec, mismatches {mismatches}')
+    return 1 if sm2_mismatches or fsrs_mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""Latency of the read endpoints with and without per-worker state snapshots.
+
+One user is enrolled in --cards cards due a whole number of days from
+now, spread over the past month and the next year, so no card becomes due
+while the benchmark runs. /deck_status, /get_due_cards (first and a later
+keyset page) and /forecast are then timed through the Flask test client,
+first with SNAPSHOT_CACHE_MB=0 (every read queries user_card_state) and
+then with snapshots on, after one warm-up request has loaded them. The
+snapshot's size per card is reported too.
+
+Exits non-zero if any endpoint answers differently with snapshots on.
+
+    python -m benchmarks.snapshot_reads --cards 100000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+USER_ID = 'bench'
+ENDPOINTS = ('/deck_status', '/get_due_cards?limit=50', '/get_due_cards?limit=50&after={cursor}',
+             '/forecast?days=30', '/forecast?algorithm=fsrs&days=365')
+
+
+def seed(card_count, seed):
+    from app import app, db, Card, CardState, enroll_cards
+    from benchmarks.synthetic import seed_deck
+    from sqlalchemy import update
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed_deck(db, Card, card_count, batch_size=50000)
+        enroll_cards(USER_ID)
+        db.session.commit()
+        rng = np.random.default_rng(seed)
+        now = datetime.utcnow()
+        for algorithm in ('sm2', 'fsrs'):
+            days = rng.integers(-30, 366, card_count)
+            db.session.execute(update(CardState), [
+                {'user_id': USER_ID, 'card_id': card_id, 'algorithm': algorithm,
+                 'next_review': now + timedelta(days=offset)}
+                for card_id, offset in zip(range(1, card_count + 1), days.tolist())
+            ])
+        db.session.commit()
+        db.session.remove()
+
+
+def time_endpoints(client, repeat):
+    """({endpoint: latency percentiles}, {endpoint: response body})"""
+    from benchmarks.suite import percentiles
+
+    cursor = client.get('/get_due_cards?limit=50').headers.get('X-Next-Cursor', '')
+    results, bodies = {}, {}
+    for endpoint in ENDPOINTS:
+        url = endpoint.format(cursor=cursor)
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = client.get(url)
+            samples.append(time.perf_counter() - start)
+        results[endpoint] = percentiles(samples)
+        bodies[endpoint] = response.get_data()
+    return results, bodies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='database to benchmark (defaults to a temporary SQLite file)')
+    parser.add_argument('--cards', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        tmp = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        os.environ['DATABASE_URL'] = 'sqlite:///' + tmp.name
+    seed(args.cards, args.seed)
+
+    from app import app
+    from snapshot import snapshots
+
+    client = app.test_client()
+    client.set_cookie('session_id', USER_ID)
+    app.config['SNAPSHOT_CACHE_MB'] = 0
+    direct, expected = time_endpoints(client, args.repeat)
+    # Large enough for both of the user's snapshots
+    app.config['SNAPSHOT_CACHE_MB'] = max(64, args.cards * 100 / 2 ** 20)
+    client.get('/deck_status')
+    cached, bodies = time_endpoints(client, args.repeat)
+
+    stats = snapshots.stats()
+    print(f"{args.cards} cards: snapshots {stats['bytes'] / 2 ** 20:.1f} MB for both algorithms, "
+          f"{stats['bytes'] / (2 * args.cards):.0f} bytes per card, {stats['loads']} loads")
+    for endpoint in ENDPOINTS:
+        before, after = direct[endpoint], cached[endpoint]
+        print(f"{endpoint:>42}: p50 {before['p50_ms']:8.2f} -> {after['p50_ms']:7.2f} ms, "
+              f"p99 {before['p99_ms']:8.2f} -> {after['p99_ms']:7.2f} ms")
+
+    mismatches = [endpoint for endpoint in ENDPOINTS if bodies[endpoint] != expected[endpoint]]
+    for endpoint in mismatches:
+        print(f'FAIL: {endpoint} answers differently from a snapshot', file=sys.stderr)
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""Measure cold start: app import, first request and gunicorn worker boot.
+
+In a fresh interpreter per run: the time to import app.py (which builds the
+app with create_app), the number of database connections opened while doing
+so, and the number of SQL statements run by the first page view. Then
+gunicorn is started with --workers workers, with and without preload_app,
+and the time from launch until every worker logged that it was ready is
+recorded, along with how long after the master was listening the last one
+came up.
+
+The run fails (exit status 1) if a budget is exceeded, so it doubles as a
+startup regression check:
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --workers 8 --max-worker-boot 0.5
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.worker_profiles import ROOT, free_port
+
+PROBE = '''
+import json, time
+start = time.perf_counter()
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+connections = []
+statements = []
+event.listen(Pool, 'connect', lambda *args: connections.append(1))
+event.listen(Engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+import app
+imported = time.perf_counter() - start
+at_import = len(connections)
+start = time.perf_counter()
+status = app.app.test_client().get('/').status_code
+print(json.dumps({
+    'import_seconds': imported,
+    'connections_at_import': at_import,
+    'first_request_seconds': time.perf_counter() - start,
+    'first_request_status': status,
+    'first_request_statements': len(statements),
+}))
+'''
+
+
+def probe(database_url):
+    env = dict(os.environ, DATABASE_URL=database_url)
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def boot_gunicorn(database_url, workers, preload):
+    """(seconds until the master listens, seconds until every worker is ready)"""
+    env = dict(os.environ, DATABASE_URL=database_url, GUNICORN_PRELOAD='1' if preload else '0')
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        ['gunicorn', 'app:app', '--bind', f'127.0.0.1:{free_port()}', '--workers', str(workers)],
+        cwd=ROOT, env=env, stderr=subprocess.PIPE, text=True
+    )
+    listening = None
+    ready = set()
+    try:
+        for line in server.stderr:
+            if listening is None and 'Listening at' in line:
+                listening = time.perf_counter() - start
+            match = re.search(r'Worker (\d+) ready', line)
+            if match:
+                ready.add(match.group(1))
+                if len(ready) == workers:
+                    return listening, time.perf_counter() - start
+        raise RuntimeError('gunicorn exited before all workers were ready')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='database to start against (defaults to a temporary SQLite file)')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-import', type=float, default=1.5, help='budget for importing app.py, in seconds')
+    parser.add_argument('--max-worker-boot', type=float, default=0.25,
+                        help='budget, in seconds, from the master listening until every preloaded worker is ready')
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        database_url = args.database_url
+    else:
+        tmp = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        database_url = 'sqlite:///' + tmp.name
+        subprocess.run([sys.executable, 'migrations.py'], cwd=ROOT, check=True, stdout=subprocess.DEVNULL,
+                       env=dict(os.environ, DATABASE_URL=database_url))
+
+    probes = [probe(database_url) for _ in range(args.repeat)]
+    boots = {preload: [boot_gunicorn(database_url, args.workers, preload) for _ in range(args.repeat)]
+             for preload in (False, True)}
+
+    import_seconds = float(np.median([p['import_seconds'] for p in probes]))
+    first_request = float(np.median([p['first_request_seconds'] for p in probes]))
+    print(f"import app.py:        {import_seconds * 1000:7.1f} ms (median of {args.repeat})")
+    print(f"connections opened:   {max(p['connections_at_import'] for p in probes)} while importing")
+    print(f"first page view:      {first_request * 1000:7.1f} ms, {max(p['first_request_statements'] for p in probes)} SQL statements")
+    worker_boot = {}
+    for preload, runs in boots.items():
+        listening = float(np.median([run[0] for run in runs]))
+        all_ready = float(np.median([run[1] for run in runs]))
+        worker_boot[preload] = all_ready - listening
+        print(f"{args.workers} workers, preload {'on ' if preload else 'off'}: listening after {listening * 1000:6.0f} ms, "
+              f"all ready after {all_ready * 1000:6.0f} ms ({worker_boot[preload] * 1000:6.0f} ms after listening)")
+
+    failures = []
+    if import_seconds > args.max_import:
+        failures.append(f'importing app.py took {import_seconds:.2f}s, budget {args.max_import:.2f}s')
+    if any(p['connections_at_import'] for p in probes):
+        failures.append('importing app.py opened a database connection')
+    if any(p['first_request_statements'] for p in probes):
+        failures.append('the first page view ran SQL')
+    if worker_boot[True] > args.max_worker_boot:
+        failures.append(f'preloaded workers took {worker_boot[True]:.2f}s to boot, budget {args.max_worker_boot:.2f}s')
+    for failure in failures:
+        print(f'FAIL: {failure}', file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""Benchmark suite: scheduler throughput, endpoint latency and query counts.
+
+Results are written as JSON so runs from different commits can be diffed:
+
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --output after.json --compare before.json
+
+Scheduler throughput is measured on synthetic decks of --scheduler-sizes
+cards (10^3 to 10^6 by default; add 10000000 for 10^7). Endpoint latency and
+the number of SQL statements per request are measured through the Flask test
+client against a temporary SQLite database (or --database-url) seeded with
+--deck-size cards.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+import scheduler
+from benchmarks import synthetic
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1000
+    return {
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'p99_ms': float(np.percentile(samples, 99)),
+        'mean_ms': float(samples.mean()),
+    }
+
+
+def bench_scheduler(sizes, repeat=3):
+    results = {}
+    for n in sizes:
+        states = synthetic.scheduler_states(n)
+        timings = {}
+        for name, call in (
+                ('sm2', lambda: scheduler.sm2_next(
+                    states['interval'], states['repetitions'], states['ease_factor'], states['rating'])),
+                ('fsrs', lambda: scheduler.fsrs_next(
+                    states['difficulty'], states['stability'], states['elapsed'], states['rating']))):
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                call()
+                best = min(best, time.perf_counter() - start)
+            timings[f'{name}_cards_per_sec'] = n / best
+        results[str(n)] = timings
+        del states
+    return results
+
+
+def bench_simulation(n_cards, days, curve):
+    results = {}
+    for algorithm in ('sm2', 'fsrs'):
+        start = time.perf_counter()
+        outcome = scheduler.simulate(algorithm, n_cards, days, forgetting_curve=synthetic.FORGETTING_CURVES[curve])
+        elapsed = time.perf_counter() - start
+        results[algorithm] = {
+            'seconds': elapsed,
+            'reviews': int(outcome['reviews'].sum()),
+            'lapse_rate': float(outcome['lapses'].sum() / max(1, outcome['reviews'].sum())),
+        }
+    return results
+
+
+class QueryCounter:
+    """Counts SQL statements sent to an engine from the benchmarking thread.
+
+    Background telemetry flushes run on their own thread and aren't part of
+    any request's cost, so they're left out.
+    """
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        self.thread = threading.get_ident()
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        if threading.get_ident() == self.thread:
+            self.count += 1
+
+
+def bench_endpoints(deck_size, requests, curve):
+    from app import app, db, Card, enroll_cards
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        card_ids = synthetic.seed_deck(db, Card, deck_size)
+        enroll_cards('bench')
+        db.session.commit()
+        counter = QueryCounter(db.engine)
+        db.session.remove()
+
+    reviews = synthetic.review_stream(card_ids, requests + 100, curve)
+    batch = [next(reviews) for _ in range(100)]
+    endpoints = {
+        'GET /': lambda client: client.get('/'),
+        'GET /get_due_cards': lambda client: client.get('/get_due_cards?algorithm=sm2'),
+        'GET /get_due_cards ndjson': lambda client: client.get('/get_due_cards?format=ndjson&limit=1000'),
+        'POST /review_card': lambda client: client.post('/review_card', json=next(reviews)),
+        'POST /review_cards x100': lambda client: client.post('/review_cards', json={'reviews': batch}),
+        'GET /statistics': lambda client: client.get('/statistics'),
+        'GET /deck_status': lambda client: client.get('/deck_status'),
+        'GET /analytics': lambda client: client.get('/analytics?days=30'),
+    }
+    results = {}
+    client = app.test_client()
+    client.set_cookie('session_id', 'bench')
+    for name, call in endpoints.items():
+        samples = []
+        queries = []
+        errors = 0
+        for _ in range(requests if not name.endswith('ndjson') else max(1, requests // 10)):
+            before = counter.count
+            start = time.perf_counter()
+            response = call(client)
+            response.get_data()
+            samples.append(time.perf_counter() - start)
+            queries.append(counter.count - before)
+            errors += response.status_code >= 400
+        results[name] = dict(percentiles(samples), queries_per_request=float(np.mean(queries)), errors=errors)
+    return results
+
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+    }
+
+
+def flatten(results, prefix=''):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f'{prefix}{key}.')
+        elif isinstance(value, (int, float)):
+            yield f'{prefix}{key}', value
+
+
+def compare(baseline, current):
+    """Print every numeric result that changed between two runs"""
+    old = dict(flatten(baseline['results']))
+    for key, value in flatten(current['results']):
+        if key in old and old[key]:
+            change = (value - old[key]) / abs(old[key]) * 100
+            print(f'{key:70} {old[key]:14.3f} -> {value:14.3f} ({change:+.1f}%)')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url')
+    parser.add_argument('--scheduler-sizes', default='1000,10000,100000,1000000')
+    parser.add_argument('--deck-size', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--simulate-cards', type=int, default=100000)
+    parser.add_argument('--simulate-days', type=int, default=90)
+    parser.add_argument('--curve', choices=sorted(synthetic.FORGETTING_CURVES), default='exponential')
+    parser.add_argument('--skip-endpoints', action='store_true')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='a previous results file to diff against')
+    args = parser.parse_args(argv)
+
+    os.environ['DATABASE_URL'] = args.database_url or (
+        'sqlite:///' + tempfile.NamedTemporaryFile(suffix='.db', delete=False).name)
+
+    results = {
+        'scheduler': bench_scheduler([int(size) for size in args.scheduler_sizes.split(',')]),
+        'simulation': bench_simulation(args.simulate_cards, args.simulate_days, args.curve),
+    }
+    if not args.skip_endpoints:
+        results['endpoints'] = bench_endpoints(args.deck_size, args.requests, args.curve)
+    report = {'metadata': metadata(), 'config': vars(args), 'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+"""Synthetic decks, scheduler states and review streams for the benchmarks."""
+import numpy as np
+from sqlalchemy import insert
+
+import scheduler
+
+FORGETTING_CURVES = {
+    'exponential': scheduler.exponential_forgetting,
+    # FSRS-style power law, also 90% recall after memory_stability days
+    'power': lambda elapsed, memory_stability: np.power(1 + 19 / 81 * elapsed / memory_stability, -0.5),
+}
+
+
+def scheduler_states(n, seed=0):
+    """Columnar SM2/FSRS states for n cards, as stored on the card table"""
+    rng = np.random.default_rng(seed)
+    return {
+        'interval': rng.integers(0, 365, n),
+        'repetitions': rng.integers(0, 10, n),
+        'ease_factor': rng.uniform(1.3, 2.5, n),
+        'difficulty': rng.uniform(1, 10, n),
+        'stability': rng.uniform(0.1, 365, n),
+        'elapsed': rng.integers(0, 400, n),
+        'rating': rng.integers(1, 5, n),
+    }
+
+
+def seed_deck(db, card_model, n, batch_size=10000):
+    """Bulk insert n synthetic cards, returns their ids"""
+    for start in range(0, n, batch_size):
+        db.session.execute(insert(card_model), [
+            {'front': f'term {i}', 'back': f'definition of term {i}'}
+            for i in range(start, min(n, start + batch_size))
+        ])
+    db.session.commit()
+    return [card_id for (card_id,) in db.session.query(card_model.id).order_by(card_model.id)]
+
+
+def review_stream(card_ids, count, curve='exponential', seed=0, mean_stability=5.0):
+    """Yield review payloads whose ratings follow a forgetting curve.
+
+    Each review picks a card, draws how many days have passed and a hidden
+    memory stability, and rates it 1 (forgotten) or 3/4 (recalled) with the
+    curve's recall probability. Algorithms alternate at random.
+    """
+    forgetting = FORGETTING_CURVES[curve]
+    rng = np.random.default_rng(seed)
+    cards = rng.choice(card_ids, count)
+    elapsed = rng.exponential(mean_stability, count)
+    memory = rng.exponential(mean_stability, count) + 0.1
+    recalled = rng.random(count) < forgetting(elapsed, memory)
+    ratings = np.where(recalled, np.where(rng.random(count) < 0.2, 4, 3), 1)
+    algorithms = np.where(rng.random(count) < 0.5, 'sm2', 'fsrs')
+    for card_id, rating, algorithm in zip(cards.tolist(), ratings.tolist(), algorithms.tolist()):
+        yield {'card_id': card_id, 'rating': rating, 'algorithm': algorithm, 'review_time': 0}
@@ -0,0 +1,179 @@
+"""Throughput of gunicorn worker and engine profiles under concurrent users.
+
+Each profile, written WORKER_PROFILE:DB_PROFILE (see gunicorn.conf.py and
+database.py), starts gunicorn on a fresh copy of a seeded SQLite database
+(or uses --database-url) and runs --clients simulated users for --duration
+seconds. Every user loops over /next_card, /review_card with a random
+rating and now and then /statistics. Reported per profile: requests and
+reviews per second, latency percentiles, failed requests and how many
+"database is locked" errors the workers logged.
+
+    python -m benchmarks.worker_profiles
+    python -m benchmarks.worker_profiles --workers 4 --clients 32 --profiles sync:default gthread:tuned
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.suite import percentiles
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_PROFILES = ('sync:default', 'sync:tuned', 'gthread:tuned', 'gevent:tuned')
+
+
+def seed_database(path, card_count):
+    """Create a SQLite database with card_count cards, using SQLAlchemy's defaults"""
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + path, DB_PROFILE='default')
+    subprocess.run([sys.executable, '-c', (
+        'from app import app, db, Card\n'
+        'from benchmarks.synthetic import seed_deck\n'
+        'with app.app_context():\n'
+        '    db.create_all()\n'
+        f'    seed_deck(db, Card, {card_count})\n'
+    )], cwd=ROOT, env=env, check=True, stderr=subprocess.DEVNULL)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/statistics')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'gunicorn did not start on port {port}')
+
+
+class Client(threading.Thread):
+    """One user reviewing cards over a keep-alive connection"""
+
+    def __init__(self, port, user_id, deadline, seed):
+        super().__init__(daemon=True)
+        self.port = port
+        self.headers = {'Cookie': f'session_id={user_id}', 'Content-Type': 'application/json'}
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.latencies = []
+        self.reviews = 0
+        self.errors = 0
+        self.conn = None
+
+    def request(self, method, path, body=None):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        start = time.perf_counter()
+        try:
+            self.conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=self.headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = None
+            self.errors += 1
+            return None
+        self.latencies.append(time.perf_counter() - start)
+        if response.status >= 500:
+            self.errors += 1
+            return None
+        return json.loads(data) if data else None
+
+    def run(self):
+        while time.time() < self.deadline:
+            algorithm = self.rng.choice(('sm2', 'fsrs'))
+            plan = self.request('GET', f'/next_card?algorithm={algorithm}')
+            if plan and plan.get('card'):
+                review = {'card_id': plan['card']['id'], 'algorithm': algorithm,
+                          'rating': self.rng.randint(1, 4), 'review_time': 0}
+                if self.request('POST', '/review_card', review) is not None:
+                    self.reviews += 1
+            if self.rng.random() < 0.1:
+                self.request('GET', '/statistics')
+
+
+def run_profile(profile, database_url, workers, clients, duration):
+    worker_profile, db_profile = profile.split(':')
+    port = free_port()
+    env = dict(os.environ, GUNICORN_PROFILE=worker_profile, DB_PROFILE=db_profile, DATABASE_URL=database_url)
+    log = tempfile.TemporaryFile()
+    server = subprocess.Popen(
+        ['gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}', '--workers', str(workers)],
+        cwd=ROOT, env=env, stdout=log, stderr=log
+    )
+    try:
+        wait_for(port)
+        deadline = time.time() + duration
+        threads = [Client(port, f'load-{profile}-{i}', deadline, seed=i) for i in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+    log.seek(0)
+    locked = log.read().count(b'database is locked')
+    latencies = [latency for thread in threads for latency in thread.latencies]
+    return dict(
+        percentiles(latencies),
+        requests_per_sec=len(latencies) / elapsed,
+        reviews_per_sec=sum(thread.reviews for thread in threads) / elapsed,
+        errors=sum(thread.errors for thread in threads),
+        locked=locked
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='database to load (defaults to a fresh SQLite copy per profile)')
+    parser.add_argument('--profiles', nargs='+', default=DEFAULT_PROFILES)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--cards', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp()
+    try:
+        template = os.path.join(workdir, 'template.db')
+        if not args.database_url:
+            seed_database(template, args.cards)
+        results = {}
+        for profile in args.profiles:
+            database_url = args.database_url
+            if not database_url:
+                path = os.path.join(workdir, profile.replace(':', '-') + '.db')
+                shutil.copy(template, path)
+                database_url = 'sqlite:///' + path
+            results[profile] = run_profile(profile, database_url, args.workers, args.clients, args.duration)
+            print(f'{profile}: done', file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir)
+
+    print(f"{args.workers} workers, {args.clients} clients, {args.duration:.0f}s per profile")
+    for profile, result in results.items():
+        print(f"{profile:>15}: {result['requests_per_sec']:7.1f} req/s {result['reviews_per_sec']:7.1f} reviews/s  "
+              f"p50 {result['p50_ms']:6.1f} ms  p95 {result['p95_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms  "
+              f"{result['errors']} errors, {result['locked']} locked")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
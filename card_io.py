@@ -0,0 +1,134 @@
+"""Streaming readers and writers for bulk card import/export.
+
+Readers take a binary file object and yield (front, back) pairs one at a
+time, so an upload is never held in memory. Supported formats:
+
+- csv: two columns, front and back, with an optional header row
+- jsonl: one {"front": ..., "back": ...} object per line; other JSON
+  values are read as a card with neither side, which importers count as
+  invalid
+- apkg: Anki package; the first two fields of every note are used
+
+Writers take an iterable of cards and yield encoded chunks for a
+streaming response.
+"""
+import csv
+import html
+import io
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import zipfile
+
+FORMATS = ('csv', 'jsonl', 'apkg')
+EXPORT_FORMATS = ('csv', 'jsonl')
+MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+# Anki separates note fields with the unit separator
+ANKI_FIELD_SEPARATOR = '\x1f'
+TAG_RE = re.compile(r'<[^>]+>')
+
+
+def guess_format(filename):
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    return {'ndjson': 'jsonl', 'json': 'jsonl', 'txt': 'csv', 'tsv': 'csv'}.get(extension, extension)
+
+
+def read_csv(stream):
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    for i, row in enumerate(reader):
+        if len(row) < 2:
+            continue
+        if i == 0 and [cell.strip().lower() for cell in row[:2]] == ['front', 'back']:
+            continue
+        yield row[0], row[1]
+
+
+def read_jsonl(stream):
+    for line in io.TextIOWrapper(stream, encoding='utf-8-sig'):
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            yield None, None
+            continue
+        yield record.get('front'), record.get('back')
+
+
+def read_apkg(stream, fetch_size=1000):
+    """Read notes from an Anki package, spooling it through temporary files"""
+    with tempfile.TemporaryDirectory() as workdir:
+        package_path = os.path.join(workdir, 'upload.apkg')
+        with open(package_path, 'wb') as package:
+            shutil.copyfileobj(stream, package)
+        with zipfile.ZipFile(package_path) as package:
+            names = package.namelist()
+            # Prefer the newer schema when both are present
+            member = next((name for name in ('collection.anki21', 'collection.anki2') if name in names), None)
+            if member is None:
+                raise ValueError('Unsupported Anki package: no collection.anki2 or collection.anki21 inside')
+            collection_path = os.path.join(workdir, 'collection.db')
+            with package.open(member) as source, open(collection_path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+        conn = sqlite3.connect(collection_path)
+        try:
+            cursor = conn.execute('SELECT flds FROM notes ORDER BY id')
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                for (fields,) in rows:
+                    fields = fields.split(ANKI_FIELD_SEPARATOR)
+                    if len(fields) >= 2:
+                        yield strip_html(fields[0]), strip_html(fields[1])
+        finally:
+            conn.close()
+
+
+def strip_html(text):
+    return html.unescape(TAG_RE.sub('', text.replace('<br>', '\n'))).strip()
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl, 'apkg': read_apkg}
+
+
+def read_cards(stream, fmt):
+    if fmt not in READERS:
+        raise ValueError(f'Unsupported import format: {fmt}')
+    return READERS[fmt](stream)
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['front', 'back'])
+    for front, back in rows:
+        writer.writerow([front, back])
+        if buffer.tell() > 65536:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def write_jsonl(rows, lines_per_chunk=1000):
+    for batch in batched(rows, lines_per_chunk):
+        yield ''.join(json.dumps({'front': front, 'back': back}) + '\n' for front, back in batch)
+
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl}
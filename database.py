@@ -0,0 +1,99 @@
+"""Engine profiles for running under several gunicorn workers.
+
+DB_PROFILE picks how engine_options() and configure_engine() set up the
+SQLAlchemy engine:
+
+- tuned (the default): SQLite connections switch to WAL, so readers don't
+  block the writer or each other, with synchronous=NORMAL (no fsync per
+  commit in WAL mode, still safe against application crashes), a busy
+  timeout so a writer waits for the lock instead of failing with "database
+  is locked", and memory-mapped reads. Postgres gets a pool sized to the
+  worker's concurrency, checked with a ping before use and recycled before
+  idle connections are dropped by the server.
+- default: SQLAlchemy's own defaults, for comparison.
+
+Every setting can be overridden through the environment; gunicorn.conf.py
+sizes DB_POOL_SIZE to the worker profile.
+
+init_app() only configures Flask-SQLAlchemy: the engine connects on first
+use, and the schema is managed by migrations.py, never by the app.
+"""
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from models import db
+
+DB_PROFILES = ('tuned', 'default')
+
+
+def database_url():
+    """DATABASE_URL, or the bundled flashcards.db"""
+    url = os.environ.get('DATABASE_URL', 'sqlite:///' + os.path.join(os.path.abspath(os.path.dirname(__file__)), 'flashcards.db'))
+    # Heroku and Render still hand out postgres:// URLs, which SQLAlchemy no longer accepts
+    if url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+
+def init_app(app):
+    """Configure db for app with the active profile, without connecting"""
+    url = app.config.setdefault('SQLALCHEMY_DATABASE_URI', database_url())
+    app.config.setdefault('SQLALCHEMY_TRACK_MODIFICATIONS', False)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(url))
+    db.init_app(app)
+    with app.app_context():
+        configure_engine(db.engine)
+
+
+def sqlite_pragmas():
+    return {
+        'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 10000)),
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    }
+
+
+def db_profile():
+    profile = os.environ.get('DB_PROFILE', 'tuned')
+    if profile not in DB_PROFILES:
+        raise ValueError(f'Unknown DB_PROFILE: {profile}')
+    return profile
+
+
+def engine_options(database_url):
+    """SQLALCHEMY_ENGINE_OPTIONS for the active profile"""
+    if db_profile() == 'default':
+        return {}
+    options = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+    }
+    url = make_url(database_url)
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            # An in-memory database lives in a single connection
+            return {}
+        # sqlite3's own busy handler, used until the pragma replaces it
+        options['connect_args'] = {'timeout': sqlite_pragmas()['busy_timeout'] / 1000}
+    else:
+        options['pool_pre_ping'] = True
+        options['pool_recycle'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    return options
+
+
+def configure_engine(engine):
+    """Apply the profile's per-connection settings to an engine"""
+    if db_profile() == 'default' or engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas()
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
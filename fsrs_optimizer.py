@@ -0,0 +1,319 @@
+"""Fit FSRS weights to the card_reviews log.
+
+Every user's FSRS review history of each card is replayed from the
+default starting state (difficulty 5, stability 2). At each review after the first, the
+model's retrievability for the time since the previous review is scored
+against whether the card was recalled (rating >= 3), and the weights are
+fitted by minimizing the mean log-loss.
+
+The state is stepped exactly as the app steps it, so the fitted weights
+are scored on the trajectories production produces: each review advances
+difficulty and stability with the whole days since the card was due
+(clamped at 0, as in app.schedule_reviews), the due date being carried
+forward from the previous review's interval. Only the scored prediction
+uses the time since the previous review.
+
+The log is streamed in chunks of whole card histories, so memory stays
+bounded by --chunk-rows regardless of table size. Reviews moved out by
+archive.py are merged back into each card's history: fit() first spills
+the archived FSRS reviews to temporary files, one per card_id range of
+about --chunk-rows reviews, and every pass then reads and sorts one range
+at a time. Within a chunk the histories are padded into (cards x reviews)
+arrays and advanced one review at a time for all cards at once. The
+gradient is computed by central differences, evaluating every perturbed
+weight vector in the same vectorized pass. Weights are updated with Adam
+after every chunk.
+
+Only w[0]..w[6] take part in this scheduler's FSRS formulas, so only those
+are fitted; the rest are stored unchanged.
+
+    python fsrs_optimizer.py --epochs 5
+"""
+import argparse
+import heapq
+import itertools
+import logging
+import math
+import os
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy import select
+
+import archive
+from models import db, CardReview, FSRSParameters
+from scheduler import FSRS
+
+logger = logging.getLogger(__name__)
+
+FITTED = 7
+# (low, high) bounds that keep each fitted weight in a sensible range
+BOUNDS = np.array([(0.0, 3.0), (-5.0, 5.0), (0.0, 5.0), (0.0, 30.0), (0.0, 20.0), (0.0, 5.0), (0.0, 5.0)])
+EPSILON = 1e-7
+# One archived review in a spill file
+SPILL_DTYPE = np.dtype([('card_id', np.int64), ('session', np.int64), ('timestamp', 'datetime64[us]'),
+                        ('id', np.int64), ('rating', np.int64)])
+
+
+def spill_archive(workdir, chunk_rows):
+    """Write the archived FSRS reviews to workdir, in files of whole cards and about chunk_rows reviews each.
+
+    One pass over the segments counts each card's reviews and collects the
+    session ids; a second appends every segment's reviews to the file of
+    their card_id range. Memory is bounded by one segment, a count per card
+    and the distinct session ids. Returns (session ids, file paths), the
+    files in card_id order.
+    """
+    counts = np.zeros(0, dtype=np.int64)
+    sessions = set()
+    for part in archive.scan('card_reviews', ['card_id', 'session_id', 'algorithm']):
+        fsrs = part['algorithm'] == 'fsrs'
+        card_counts = np.bincount(part['card_id'][fsrs], minlength=len(counts))
+        counts = np.pad(counts, (0, len(card_counts) - len(counts))) + card_counts
+        sessions.update(part['session_id'][fsrs])
+    sessions = np.array(sorted(sessions), dtype=object)
+    # A card's file is set by the number of reviews of lower card ids
+    file_of = (np.cumsum(counts) - counts) // chunk_rows
+    paths = [os.path.join(workdir, f'reviews-{i:06d}.bin') for i in range(int(file_of[-1]) + 1 if len(counts) else 0)]
+
+    for part in archive.scan('card_reviews', ['id', 'session_id', 'card_id', 'timestamp', 'rating', 'algorithm']):
+        fsrs = part['algorithm'] == 'fsrs'
+        if not fsrs.any():
+            continue
+        records = np.empty(int(fsrs.sum()), dtype=SPILL_DTYPE)
+        for name in ('card_id', 'timestamp', 'id', 'rating'):
+            records[name] = part[name][fsrs]
+        distinct, codes = np.unique(part['session_id'][fsrs], return_inverse=True)
+        records['session'] = np.searchsorted(sessions, distinct)[codes]
+        files = file_of[records['card_id']]
+        order = np.argsort(files, kind='stable')
+        records, files = records[order], files[order]
+        bounds = np.flatnonzero(np.diff(files)) + 1
+        for start, end in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(files)]])):
+            with open(paths[files[start]], 'ab') as f:
+                records[start:end].tofile(f)
+    return sessions, paths
+
+
+def archived_histories(spill):
+    """Yield (card_id, session_id, timestamps, ratings) per user and card from spill_archive's files, by card_id"""
+    sessions, paths = spill
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        records = np.fromfile(path, dtype=SPILL_DTYPE)
+        records = records[np.lexsort((records['id'], records['timestamp'], records['session'], records['card_id']))]
+        card_ids, session_codes = records['card_id'], records['session']
+        bounds = np.flatnonzero((np.diff(card_ids) != 0) | (np.diff(session_codes) != 0)) + 1
+        for start, end in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(records)]])):
+            yield (int(card_ids[start]), str(sessions[session_codes[start]]),
+                   records['timestamp'][start:end], records['rating'][start:end])
+
+
+def live_histories(chunk_rows):
+    """Yield (card_id, session_id, timestamps, ratings) per user and card from card_reviews, by card_id"""
+    query = (
+        select(CardReview.card_id, CardReview.session_id, CardReview.timestamp, CardReview.rating)
+        .where(CardReview.algorithm == 'fsrs')
+        .order_by(CardReview.card_id, CardReview.session_id, CardReview.timestamp, CardReview.id)
+        .execution_options(yield_per=min(chunk_rows, 10000))
+    )
+    for (card_id, session_id), reviews in itertools.groupby(
+            db.session.execute(query), key=lambda row: (row.card_id, row.session_id)):
+        reviews = list(reviews)
+        yield (card_id, session_id, np.array([review.timestamp for review in reviews], dtype='datetime64[us]'),
+               np.array([review.rating for review in reviews], dtype=np.int64))
+
+
+def card_histories(spill, chunk_rows):
+    """Every user's full FSRS history of each card: their archived reviews, which are all older, then their live ones.
+
+    The two sources are merged on card_id alone and split by user here, so
+    the database's collation of session ids doesn't have to match Python's.
+    """
+    merged = heapq.merge(archived_histories(spill), live_histories(chunk_rows), key=lambda history: history[0])
+    for card_id, parts in itertools.groupby(merged, key=lambda history: history[0]):
+        by_session = {}
+        # merge() yields a card's archived histories before its live ones
+        for _, session_id, timestamps, ratings in parts:
+            by_session.setdefault(session_id, []).append((timestamps, ratings))
+        for session_id in sorted(by_session):
+            parts = by_session[session_id]
+            if len(parts) == 1:
+                yield parts[0]
+            else:
+                yield np.concatenate([part[0] for part in parts]), np.concatenate([part[1] for part in parts])
+
+
+def stream_histories(spill, chunk_rows=200000, deck=None):
+    """Yield lists of (elapsed_days, ratings) arrays, one per card, about chunk_rows reviews at a time.
+
+    spill is the archive as written by spill_archive().
+    """
+    # Decks aren't modelled on card_reviews yet, so deck only selects where the result is stored
+    chunk = []
+    rows = 0
+    for timestamps, ratings in card_histories(spill, chunk_rows):
+        # Fractional days since the previous review; the first review starts the history
+        elapsed = np.diff(timestamps, prepend=timestamps[:1]) / np.timedelta64(1, 'D')
+        chunk.append((elapsed, ratings))
+        rows += len(ratings)
+        if rows >= chunk_rows:
+            yield chunk
+            chunk = []
+            rows = 0
+    if chunk:
+        yield chunk
+
+
+def pad(histories, max_cells=2000000):
+    """Group histories of similar length into padded (elapsed, ratings, mask) batches"""
+    histories = sorted(histories, key=lambda history: len(history[1]))
+    start = 0
+    while start < len(histories):
+        end = start + 1
+        while end < len(histories) and (end - start + 1) * len(histories[end][1]) <= max_cells:
+            end += 1
+        batch = histories[start:end]
+        length = len(batch[-1][1])
+        elapsed = np.zeros((len(batch), length))
+        ratings = np.full((len(batch), length), 3, dtype=np.int64)
+        mask = np.zeros((len(batch), length), dtype=bool)
+        for i, (history_elapsed, history_ratings) in enumerate(batch):
+            elapsed[i, :len(history_ratings)] = history_elapsed
+            ratings[i, :len(history_ratings)] = history_ratings
+            mask[i, :len(history_ratings)] = True
+        yield elapsed, ratings, mask
+        start = end
+
+
+def batch_loss(weights, elapsed, ratings, mask, fsrs):
+    """Summed log-loss for each row of weights (P x FITTED), and the number of scored reviews"""
+    w = [weights[:, i:i + 1] for i in range(FITTED)]
+    exp_w1 = np.power(2.718281828, w[1])
+    n_weights, n_cards = weights.shape[0], elapsed.shape[0]
+    d = np.full((n_weights, n_cards), 5.0)
+    s = np.full((n_weights, n_cards), 2.0)
+    # Days from each review to the card's next due date; a new card is due at its first review
+    interval = np.zeros((n_weights, n_cards))
+    loss = np.zeros(n_weights)
+    scored = 0
+    for step in range(elapsed.shape[1]):
+        active = mask[:, step]
+        rating = ratings[:, step]
+        if step > 0:
+            r = np.power(1 + fsrs.factor * elapsed[:, step] / s, fsrs.decay)
+            p = np.clip(r, EPSILON, 1 - EPSILON)
+            recalled = rating >= 3
+            step_loss = -np.where(recalled, np.log(p), np.log(1 - p))
+            loss += np.where(active, step_loss, 0.0).sum(axis=1)
+            scored += int(active.sum())
+        # The app's elapsed time: whole days since the card was due, never negative
+        overdue = np.maximum(0.0, np.floor(elapsed[:, step] - interval))
+        r = np.power(1 + fsrs.factor * overdue / s, fsrs.decay)
+        hard = rating == 2
+        easy = rating == 4
+        new_s = s * (1 + exp_w1 * (11 - d) * np.power(s, -w[2]) *
+                     (np.power(2.718281828, (1 - r) * w[3]) - 1) * w[4] / (1 + w[5] * hard) * (1 + w[6] * easy))
+        new_d = np.clip(d + w[0] * (3 - rating), fsrs.min_difficulty, fsrs.max_difficulty)
+        s = np.where(active, np.maximum(0.1, new_s), s)
+        d = np.where(active, new_d, d)
+        interval = np.where(active, np.trunc(s * 9 / fsrs.factor), interval)
+    return loss, scored
+
+
+def evaluate(weights, spill, chunk_rows, deck):
+    """Mean log-loss of one weight vector over the whole log"""
+    fsrs = FSRS()
+    total, scored = 0.0, 0
+    for histories in stream_histories(spill, chunk_rows, deck):
+        for elapsed, ratings, mask in pad(histories):
+            loss, count = batch_loss(weights[None, :], elapsed, ratings, mask, fsrs)
+            total += loss[0]
+            scored += count
+    return total / scored if scored else float('nan'), scored
+
+
+def fit(epochs=5, chunk_rows=200000, learning_rate=0.05, deck=None, step=1e-4):
+    """Fit the FSRS weights and store them, returns the FSRSParameters row"""
+    start = time.perf_counter()
+    # The archive is spilled once and read back by every pass
+    with tempfile.TemporaryDirectory() as workdir:
+        spill = spill_archive(workdir, chunk_rows)
+        weights, loss_before, loss_after, scored = fit_weights(spill, epochs, chunk_rows, learning_rate, deck, step)
+    default = FSRS()
+    fitted = [default.w[i] for i in range(len(default.w))]
+    fitted[:FITTED] = weights.tolist()
+    params = FSRSParameters(
+        deck=deck,
+        weights=fitted,
+        review_count=scored,
+        loss_before=loss_before,
+        loss_after=loss_after,
+        fit_seconds=time.perf_counter() - start
+    )
+    db.session.add(params)
+    db.session.commit()
+    return params
+
+
+def fit_weights(spill, epochs, chunk_rows, learning_rate, deck, step):
+    """Adam over the log, returns (weights, loss before, loss after, scored reviews)"""
+    default = FSRS()
+    weights = np.array([default.w[i] for i in range(FITTED)], dtype=np.float64)
+    loss_before, scored = evaluate(weights, spill, chunk_rows, deck)
+    if not scored:
+        raise ValueError('No FSRS reviews to fit')
+
+    # Row 0 is the current weights, then +step and -step for each weight
+    offsets = np.vstack([np.zeros(FITTED), np.eye(FITTED) * step, -np.eye(FITTED) * step])
+    m = np.zeros(FITTED)
+    v = np.zeros(FITTED)
+    t = 0
+    for epoch in range(epochs):
+        for histories in stream_histories(spill, chunk_rows, deck):
+            gradient = np.zeros(FITTED)
+            count = 0
+            for elapsed, ratings, mask in pad(histories):
+                loss, scored_batch = batch_loss(weights + offsets, elapsed, ratings, mask, default)
+                gradient += (loss[1:FITTED + 1] - loss[FITTED + 1:]) / (2 * step)
+                count += scored_batch
+            if not count:
+                continue
+            gradient /= count
+            t += 1
+            m = 0.9 * m + 0.1 * gradient
+            v = 0.999 * v + 0.001 * gradient ** 2
+            update = learning_rate * (m / (1 - 0.9 ** t)) / (np.sqrt(v / (1 - 0.999 ** t)) + 1e-8)
+            weights = np.clip(weights - update, BOUNDS[:, 0], BOUNDS[:, 1])
+        logger.info(f"Epoch {epoch + 1}/{epochs}: weights {np.round(weights, 4).tolist()}")
+
+    loss_after, _ = evaluate(weights, spill, chunk_rows, deck)
+    if loss_after > loss_before:
+        # Never store parameters that fit worse than the defaults
+        weights = np.array([default.w[i] for i in range(FITTED)])
+        loss_after = loss_before
+    return weights, loss_before, loss_after, scored
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fit FSRS weights to the card_reviews log')
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--chunk-rows', type=int, default=200000, help='reviews held in memory at once')
+    parser.add_argument('--learning-rate', type=float, default=0.05)
+    parser.add_argument('--deck', help='store the weights for this deck instead of globally')
+    args = parser.parse_args(argv)
+
+    from app import app
+    with app.app_context():
+        params = fit(args.epochs, args.chunk_rows, args.learning_rate, args.deck)
+        improvement = (params.loss_before - params.loss_after) / params.loss_before * 100 if params.loss_before else 0
+        print(f"Fitted on {params.review_count} reviews in {params.fit_seconds:.1f}s")
+        print(f"Log-loss {params.loss_before:.4f} -> {params.loss_after:.4f} ({improvement:.1f}% better)")
+        print(f"Weights: {[round(w, 4) for w in params.weights[:FITTED]]}")
+        return 0 if math.isfinite(params.loss_after) else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
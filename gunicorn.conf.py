@@ -0,0 +1,57 @@
+# Picked up automatically by gunicorn when started from the project root
+import os
+
+# Worker profile, chosen with GUNICORN_PROFILE (see "Worker profiles" in the README):
+#   sync     one request at a time per worker process (gunicorn's default)
+#   gthread  GUNICORN_THREADS requests at a time per worker, on a thread pool
+#   gevent   up to GUNICORN_WORKER_CONNECTIONS requests per worker on greenlets;
+#            needs `pip install gevent` and suits Postgres better than SQLite
+#   asgi     uvicorn workers for asgi.py (`gunicorn asgi:app`), many requests
+#            per worker on the event loop; needs requirements-async.txt
+# The number of workers comes from WEB_CONCURRENCY or --workers as usual.
+profile = os.environ.get('GUNICORN_PROFILE', 'sync')
+
+if profile == 'gthread':
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', 4))
+    # One connection per thread, so no request waits for the pool
+    os.environ.setdefault('DB_POOL_SIZE', str(threads))
+elif profile == 'gevent':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+    # Greenlets beyond the pool and its overflow queue for a connection
+    os.environ.setdefault('DB_POOL_SIZE', '10')
+    os.environ.setdefault('DB_MAX_OVERFLOW', '20')
+elif profile == 'asgi':
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    os.environ.setdefault('DB_POOL_SIZE', '10')
+    os.environ.setdefault('DB_MAX_OVERFLOW', '20')
+elif profile == 'sync':
+    os.environ.setdefault('DB_POOL_SIZE', '1')
+else:
+    raise ValueError(f'Unknown GUNICORN_PROFILE: {profile}')
+
+# Import the app once in the master and fork the workers from it, so a
+# worker boots in milliseconds instead of importing Flask, SQLAlchemy and
+# numpy itself. Code changes then need a restart rather than a HUP.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+
+def post_fork(server, worker):
+    # The app does no database work at import, but never let a pooled
+    # connection from the master be shared with a worker
+    if preload_app:
+        from app import app
+        from models import db
+        with app.app_context():
+            db.engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    worker.log.info(f"Worker {worker.pid} ready")
+
+
+def worker_exit(server, worker):
+    # Write out any telemetry still buffered in this worker
+    from telemetry import telemetry
+    telemetry.stop()
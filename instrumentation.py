@@ -0,0 +1,277 @@
+"""Opt-in request and SQL instrumentation, exposed at /metrics.
+
+Enabled with INSTRUMENTATION=1. Every request then records:
+
+- its latency, into a per-endpoint histogram
+- the number and total time of its SQL statements and commits, from
+  SQLAlchemy engine events
+- the time spent in its INSERT, UPDATE and DELETE statements. A writer
+  waits for SQLite's write lock, or Postgres's row locks, inside the
+  writing statement, so this is mostly lock wait under contention
+- suspected N+1 patterns: the same statement text executed
+  N_PLUS_ONE_THRESHOLD or more times in one request, which is logged
+  once per endpoint and statement
+
+/metrics serves these in the Prometheus text format. The numbers are per
+process, so with several gunicorn workers each scrape sees one worker.
+Responses also carry a Server-Timing header with the app, db and write time.
+
+With PROFILE_SAMPLE_RATE > 0, that fraction of requests runs under
+cProfile while a sampler thread records the request thread's stack every
+PROFILE_INTERVAL seconds. Sampled requests slower than PROFILE_SLOW_MS
+are written to PROFILE_DIR as <endpoint>-<time>-<ms>.prof (for pstats or
+snakeviz) and .folded (one "frame;frame;frame count" line per stack, for
+flamegraph.pl or speedscope). Streamed response bodies are not included
+in latency or profiles.
+"""
+import cProfile
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+# Literal values are replaced so statements differing only in them are grouped together
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+WRITE_RE = re.compile(r'\s*(INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+
+class RequestStats:
+    """Counters for the request being served, kept on flask.g"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.write_time = 0.0
+        self.commits = 0
+        self.statements = Counter()
+        self.profiler = None
+        self.sampler = None
+
+
+class StackSampler:
+    """Records one thread's stack every interval seconds as folded stack counts"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+
+class Instrumentation:
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.queries_per_request = defaultdict(lambda: Histogram(QUERY_COUNT_BUCKETS))
+        self.counters = defaultdict(float)
+        self._reported = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('INSTRUMENTATION', os.environ.get('INSTRUMENTATION', '0') == '1')
+        app.config.setdefault('N_PLUS_ONE_THRESHOLD', int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5)))
+        app.config.setdefault('PROFILE_SAMPLE_RATE', float(os.environ.get('PROFILE_SAMPLE_RATE', 0)))
+        app.config.setdefault('PROFILE_SLOW_MS', float(os.environ.get('PROFILE_SLOW_MS', 200)))
+        app.config.setdefault('PROFILE_INTERVAL', float(os.environ.get('PROFILE_INTERVAL', 0.002)))
+        app.config.setdefault('PROFILE_DIR', os.environ.get('PROFILE_DIR', 'profiles'))
+        self.app = app
+        app.extensions['instrumentation'] = self
+        if not app.config['INSTRUMENTATION']:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        # On the app's own engines rather than every Engine, so building
+        # another app doesn't count each statement twice
+        with app.app_context():
+            for engine in db.engines.values():
+                for name, listener in (('before_cursor_execute', self._before_execute),
+                                       ('after_cursor_execute', self._after_execute),
+                                       ('commit', self._on_commit)):
+                    if not event.contains(engine, name, listener):
+                        event.listen(engine, name, listener)
+
+    def _current(self):
+        if has_request_context():
+            return g.get('_request_stats')
+        return None
+
+    def _before_request(self):
+        stats = g._request_stats = RequestStats()
+        rate = self.app.config['PROFILE_SAMPLE_RATE']
+        if rate and random.random() < rate:
+            stats.sampler = StackSampler(threading.get_ident(), self.app.config['PROFILE_INTERVAL'])
+            stats.profiler = cProfile.Profile()
+            # Another profiler may already be active in this thread
+            try:
+                stats.profiler.enable()
+            except ValueError:
+                stats.profiler = None
+
+    def _after_request(self, response):
+        stats = g.pop('_request_stats', None)
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - stats.start
+        if stats.profiler:
+            stats.profiler.disable()
+        if stats.sampler:
+            stats.sampler.stop()
+            if elapsed * 1000 >= self.app.config['PROFILE_SLOW_MS']:
+                self._dump_profile(stats, elapsed)
+
+        endpoint = request.endpoint or 'unmatched'
+        repeated = [(statement, count) for statement, count in stats.statements.items()
+                    if count >= self.app.config['N_PLUS_ONE_THRESHOLD']]
+        with self._lock:
+            self.latency[endpoint, request.method].observe(elapsed)
+            self.queries_per_request[endpoint].observe(stats.queries)
+            self.counters['requests', endpoint, request.method, str(response.status_code)] += 1
+            self.counters['queries', endpoint] += stats.queries
+            self.counters['query_seconds', endpoint] += stats.query_time
+            self.counters['write_seconds', endpoint] += stats.write_time
+            self.counters['commits', endpoint] += stats.commits
+            self.counters['n_plus_one', endpoint] += len(repeated)
+            new = [(statement, count) for statement, count in repeated if (endpoint, statement) not in self._reported]
+            self._reported.update((endpoint, statement) for statement, _ in new)
+        for statement, count in new:
+            logger.warning(f"Possible N+1 in {endpoint}: {count} executions of {statement[:200]}")
+
+        response.headers.add('Server-Timing', f'app;dur={elapsed * 1000:.2f}')
+        response.headers.add('Server-Timing', f'db;dur={stats.query_time * 1000:.2f};desc="{stats.queries} queries"')
+        response.headers.add('Server-Timing', f'write;dur={stats.write_time * 1000:.2f}')
+        return response
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = self._current()
+        if stats is not None:
+            conn.info.setdefault('_query_start', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = self._current()
+        starts = conn.info.get('_query_start')
+        if stats is None or not starts:
+            return
+        duration = time.perf_counter() - starts.pop()
+        stats.queries += 1
+        stats.query_time += duration
+        if WRITE_RE.match(statement):
+            stats.write_time += duration
+        if not executemany:
+            stats.statements[LITERAL_RE.sub('?', statement)] += 1
+
+    def _on_commit(self, conn):
+        stats = self._current()
+        if stats is not None:
+            stats.commits += 1
+
+    def _dump_profile(self, stats, elapsed):
+        directory = self.app.config['PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        stamp = f"{time.strftime('%Y%m%dT%H%M%S')}.{time.time_ns() % 10 ** 9:09d}"
+        name = os.path.join(directory, f"{request.endpoint or 'unmatched'}-{stamp}-{int(elapsed * 1000)}ms")
+        if stats.profiler:
+            stats.profiler.dump_stats(name + '.prof')
+        with open(name + '.folded', 'w') as f:
+            for stack, count in stats.sampler.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        logger.info(f"Profiled slow request {request.method} {request.path} ({elapsed * 1000:.0f} ms): {name}")
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            latency = {key: (list(h.counts), h.total, h.sum) for key, h in self.latency.items()}
+            queries = {key: (list(h.counts), h.total, h.sum) for key, h in self.queries_per_request.items()}
+            counters = dict(self.counters)
+
+        lines = [
+            '# HELP http_request_duration_seconds Request latency, excluding streamed bodies',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for (endpoint, method), histogram in sorted(latency.items()):
+            lines += histogram_lines('http_request_duration_seconds', f'endpoint="{endpoint}",method="{method}"',
+                                     LATENCY_BUCKETS, *histogram)
+        lines += [
+            '# HELP db_queries_per_request SQL statements executed per request',
+            '# TYPE db_queries_per_request histogram',
+        ]
+        for endpoint, histogram in sorted(queries.items()):
+            lines += histogram_lines('db_queries_per_request', f'endpoint="{endpoint}"', QUERY_COUNT_BUCKETS, *histogram)
+
+        lines += ['# HELP http_requests_total Requests by endpoint, method and status', '# TYPE http_requests_total counter']
+        for key, value in sorted(counters.items()):
+            if key[0] == 'requests':
+                lines.append(f'http_requests_total{{endpoint="{key[1]}",method="{key[2]}",status="{key[3]}"}} {value:g}')
+        for name, metric, help_text in (
+                ('queries', 'db_queries_total', 'SQL statements executed'),
+                ('query_seconds', 'db_query_duration_seconds_total', 'Time spent executing SQL'),
+                ('write_seconds', 'db_write_duration_seconds_total', 'Time spent in INSERT, UPDATE and DELETE statements, including lock waits'),
+                ('commits', 'db_commits_total', 'Transactions committed'),
+                ('n_plus_one', 'db_n_plus_one_total', 'Statements repeated N_PLUS_ONE_THRESHOLD or more times in one request')):
+            lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+            for key, value in sorted(counters.items()):
+                if key[0] == name:
+                    lines.append(f'{metric}{{endpoint="{key[1]}"}} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+def histogram_lines(name, labels, buckets, counts, total, total_sum):
+    lines = [f'{name}_bucket{{{labels},le="{bound:g}"}} {count}' for bound, count in zip(buckets, counts)]
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {total}')
+    lines.append(f'{name}_sum{{{labels}}} {total_sum:g}')
+    lines.append(f'{name}_count{{{labels}}} {total}')
+    return lines
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,167 @@
+"""Chunked, resumable admin operations over whole tables.
+
+Operations like making every card due, or deleting the deck, used to load or
+touch every row in one transaction. Here they run on a background thread
+as a series of set-based statements, each covering the next chunk_size rows
+by primary key and committed on its own. That keeps every transaction and
+the session's memory bounded and lets other requests write between chunks.
+
+Progress is stored on a MaintenanceJob row after every chunk, in the same
+transaction as the chunk itself, so the row always says exactly which ids
+are done. A job that failed, or whose worker died (no progress for
+stale_seconds), can be resumed from there.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_, update
+
+from models import db, MaintenanceJob
+
+logger = logging.getLogger(__name__)
+
+
+class JobRunner:
+    def __init__(self, app=None):
+        self.app = None
+        self._kinds = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAINTENANCE_CHUNK_SIZE', int(os.environ.get('MAINTENANCE_CHUNK_SIZE', 10000)))
+        app.config.setdefault('MAINTENANCE_STALE_SECONDS', float(os.environ.get('MAINTENANCE_STALE_SECONDS', 60)))
+        self.app = app
+        app.extensions['jobs'] = self
+
+    def register(self, kind, id_column, step, finish=None, criteria=None):
+        """Register a job kind.
+
+        step(job, low, high) processes the rows with low < id <= high and
+        returns how many it touched; finish(job) runs once after the last
+        chunk, before the job is marked completed. criteria(scope) returns
+        filters limiting a scoped job, e.g. to one user's rows.
+        """
+        self._kinds[kind] = (id_column, step, finish, criteria or (lambda scope: ()))
+
+    def create(self, kind, scope=None):
+        """Queue a job over the rows that exist now, or return the one already active"""
+        if kind not in self._kinds:
+            raise ValueError(f'Unknown job kind: {kind}')
+        active = self.active(kind, scope)
+        if active is not None:
+            return active
+        id_column, _, _, criteria = self._kinds[kind]
+        max_id, total = db.session.query(func.max(id_column), func.count(id_column)).filter(*criteria(scope)).one()
+        job = MaintenanceJob(kind=kind, scope=scope, status='queued', max_id=max_id or 0, total=total)
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    def active(self, kind, scope=None):
+        """The queued or running job of this kind that is still making progress, if any"""
+        return MaintenanceJob.query.filter(
+            MaintenanceJob.kind == kind,
+            MaintenanceJob.scope.is_(None) if scope is None else MaintenanceJob.scope == scope,
+            self._live()
+        ).order_by(MaintenanceJob.id.desc()).first()
+
+    def resumable(self, job):
+        if job.status == 'failed':
+            return True
+        return job.status in ('queued', 'running') and (job.updated_at or job.created_at) < self._stale_cutoff()
+
+    def start(self, job_id):
+        """Run the job on a background thread"""
+        thread = threading.Thread(target=self._run_in_context, args=(job_id,), name=f'job-{job_id}', daemon=True)
+        thread.start()
+        return thread
+
+    def run(self, job_id, progress=None):
+        """Run or resume the job in this thread, returns False if another worker holds it"""
+        if not self._claim(job_id):
+            return False
+        job = db.session.get(MaintenanceJob, job_id)
+        id_column, step, finish, criteria = self._kinds[job.kind]
+        chunk_size = self.app.config['MAINTENANCE_CHUNK_SIZE']
+        try:
+            while job.last_id < job.max_id:
+                # The id chunk_size rows on, found with an index-only scan of the primary key
+                high = db.session.query(id_column).filter(
+                    *criteria(job.scope),
+                    id_column > job.last_id,
+                    id_column <= job.max_id
+                ).order_by(id_column).offset(chunk_size - 1).limit(1).scalar()
+                high = job.max_id if high is None else high
+                job.processed += step(job, job.last_id, high)
+                job.last_id = high
+                job.updated_at = datetime.utcnow()
+                db.session.commit()
+                if progress:
+                    progress(job)
+            if finish:
+                finish(job)
+            job.status = 'completed'
+            job.finished_at = job.updated_at = datetime.utcnow()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Job {job_id} ({job.kind}) failed after id {job.last_id}: {str(e)}")
+            job.status = 'failed'
+            job.error = str(e)
+            job.updated_at = datetime.utcnow()
+            db.session.commit()
+        return True
+
+    def _run_in_context(self, job_id):
+        with self.app.app_context():
+            self.run(job_id)
+
+    def _claim(self, job_id):
+        # A single conditional UPDATE, so only one worker can take the job
+        now = datetime.utcnow()
+        result = db.session.execute(update(MaintenanceJob).where(
+            MaintenanceJob.id == job_id,
+            or_(MaintenanceJob.status.in_(('queued', 'failed')), and_(MaintenanceJob.status == 'running', ~self._live()))
+        ).values(
+            status='running',
+            started_at=func.coalesce(MaintenanceJob.started_at, now),
+            updated_at=now,
+            error=None
+        ))
+        db.session.commit()
+        return result.rowcount == 1
+
+    def _live(self):
+        cutoff = self._stale_cutoff()
+        return or_(
+            and_(MaintenanceJob.status == 'queued', MaintenanceJob.created_at >= cutoff),
+            and_(MaintenanceJob.status == 'running', MaintenanceJob.updated_at >= cutoff)
+        )
+
+    def _stale_cutoff(self):
+        return datetime.utcnow() - timedelta(seconds=self.app.config['MAINTENANCE_STALE_SECONDS'])
+
+
+def job_status(job):
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'scope': job.scope,
+        'status': job.status,
+        'processed': job.processed,
+        'total': job.total,
+        'progress': round(min(job.processed / job.total, 1.0) * 100, 1) if job.total else 100.0,
+        'last_id': job.last_id,
+        'max_id': job.max_id,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'updated_at': job.updated_at.isoformat() if job.updated_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+jobs = JobRunner()
@@ -1,20 +1,173 @@
+"""Versioned schema migrations, run once per deploy instead of by every worker.
+
+    python migrations.py            # apply pending migrations
+    python migrations.py --status   # list applied and pending versions
+
+Applied versions are recorded in schema_version. Version 1 creates every
+table the models declare, so the later steps, which upgrade databases
+created by older releases, are no-ops on a fresh database; each step must
+therefore be idempotent. New schema changes are appended to MIGRATIONS.
+
+Only the database is configured here; app.py is imported just by the step
+that needs its deck statistics helpers.
+"""
+import argparse
+from datetime import date
+
 from flask import Flask
-from models import db, UserActivity, CardReview, AlgorithmPerformance, Analytics
-from app import app
-
-def upgrade_database():
-    """Create new tables for tracking and analytics"""
-    with app.app_context():
-        # Create all tables
-        db.create_all()
-        
-        print("Created the following tables:")
-        print("- user_activities: Track user interactions")
-        print("- card_reviews: Track individual card reviews")
-        print("- algorithm_performance: Track algorithm metrics")
-        print("- analytics: Store daily statistics")
+from sqlalchemy import inspect, select, text, func, update, delete
+
+import archive
+import database
+from models import db, Card, CardState, CardReview, UserActivity, AlgorithmPerformance, Analytics, DeckStats, MaintenanceJob, ArchiveSegment, ReviewPlan, SchemaVersion
+from analytics import rollup_day
+
+def create_migration_app():
+    app = Flask(__name__)
+    database.init_app(app)
+    return app
+
+def create_missing_indexes(table):
+    """Create any index declared on the model but missing from the database"""
+    for index in table.indexes:
+        index.create(db.engine, checkfirst=True)
+
+def add_missing_columns(table):
+    """ALTER TABLE ADD COLUMN for model columns missing from an existing table"""
+    existing = {column['name'] for column in inspect(db.engine).get_columns(table.name)}
+    with db.engine.begin() as conn:
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            default = f" DEFAULT {column.server_default.arg}" if column.server_default is not None else ""
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}'))
+
+def backfill_analytics_counters():
+    """Move the per-algorithm counts of old analytics rows out of daily_stats"""
+    add_missing_columns(Analytics.__table__)
+    for analytics in Analytics.query.filter(Analytics.daily_stats.isnot(None)):
+        stats = analytics.daily_stats or {}
+        if analytics.sm2_reviews or analytics.fsrs_reviews:
+            continue
+        analytics.sm2_reviews = stats.get('sm2_reviews', 0)
+        analytics.fsrs_reviews = stats.get('fsrs_reviews', 0)
+        analytics.sm2_correct = round((analytics.avg_retention_sm2 or 0) / 100 * analytics.sm2_reviews)
+        analytics.fsrs_correct = round((analytics.avg_retention_fsrs or 0) / 100 * analytics.fsrs_reviews)
+    db.session.commit()
+
+def backfill_session_rollups():
+    """Roll up unique sessions for every day with activity but no sketch yet"""
+    rolled_up = {a.date for a in Analytics.query.filter(Analytics.session_sketch.isnot(None))}
+    # SQLite returns DATE() as a string, Postgres as a date
+    active_days = {date.fromisoformat(str(day)) for (day,) in
+                   db.session.query(func.date(UserActivity.timestamp)).distinct() if day}
+    for day in sorted(active_days - rolled_up):
+        rollup_day(day)
+
+def create_indexes():
+    # create_all skips indexes on tables that already exist
+    create_missing_indexes(Card.__table__)
+    create_missing_indexes(UserActivity.__table__)
+
+def index_logs():
+    """Archive table, and the indexes the append-only logs are queried and archived by"""
+    ArchiveSegment.__table__.create(db.engine, checkfirst=True)
+    # Superseded by ix_user_activities_timestamp_session
+    with db.engine.begin() as conn:
+        conn.execute(text('DROP INDEX IF EXISTS ix_user_activities_timestamp'))
+    for model in (CardReview, UserActivity, AlgorithmPerformance):
+        create_missing_indexes(model.__table__)
+
+def rebuild_deck_stats():
+    """Build the per-user deck_stats counters from their card states"""
+    from app import check_deck_stats
+    check_deck_stats(fix=True)
+
+def backfill_plan_days():
+    """Record the day of each user's newest review plan on their deck_stats row"""
+    ReviewPlan.__table__.create(db.engine, checkfirst=True)
+    add_missing_columns(DeckStats.__table__)
+    newest = select(func.max(ReviewPlan.day)).where(ReviewPlan.user_id == DeckStats.user_id).scalar_subquery()
+    db.session.execute(update(DeckStats).values(plan_day=newest))
+    db.session.commit()
+
+def split_archived_reviews():
+    """Record card_id ranges on archive segments, splitting older card_reviews segments by card"""
+    add_missing_columns(ArchiveSegment.__table__)
+    for segment in ArchiveSegment.query.filter(ArchiveSegment.table_name == 'card_reviews',
+                                               ArchiveSegment.min_card_id.is_(None)).all():
+        archive.split_segment(segment)
+
+def unique_card_fronts():
+    """Merge cards sharing a front into the oldest one, then make card.front unique.
+
+    The newer copies' user states are dropped, today's review plans are
+    rebuilt and deck statistics are recomputed. Their review logs keep the
+    old card ids.
+    """
+    from app import check_deck_stats
+    keep = {front: card_id for front, card_id in
+            db.session.query(Card.front, func.min(Card.id)).group_by(Card.front).having(func.count(Card.id) > 1)}
+    if keep:
+        copies = [card_id for card_id, front in db.session.query(Card.id, Card.front).filter(Card.front.in_(keep))
+                  if card_id != keep[front]]
+        for start in range(0, len(copies), 1000):
+            chunk = copies[start:start + 1000]
+            db.session.execute(delete(CardState).where(CardState.card_id.in_(chunk)))
+            db.session.execute(delete(Card).where(Card.id.in_(chunk)))
+        db.session.execute(update(ReviewPlan).values(day=None))
+        db.session.commit()
+        check_deck_stats(fix=True)
+    with db.engine.begin() as conn:
+        conn.execute(text('DROP INDEX IF EXISTS ix_card_front'))
+    create_missing_indexes(Card.__table__)
+
+MIGRATIONS = [
+    (1, 'Create tables', db.create_all),
+    (2, 'Indexes on card.front and user_activities', create_indexes),
+    (3, 'Per-algorithm analytics counters', backfill_analytics_counters),
+    (4, 'Unique-session rollups', backfill_session_rollups),
+    (5, 'Per-user maintenance jobs', lambda: add_missing_columns(MaintenanceJob.__table__)),
+    (6, 'Per-user deck statistics', rebuild_deck_stats),
+    (7, 'Log archive and log indexes', index_logs),
+    (8, 'Card state versions', lambda: add_missing_columns(DeckStats.__table__)),
+    (9, 'Review plan days', backfill_plan_days),
+    (10, 'Archived reviews split by card', split_archived_reviews),
+    (11, 'Unique card fronts', unique_card_fronts),
+]
+
+def applied_versions():
+    SchemaVersion.__table__.create(db.engine, checkfirst=True)
+    return {version for (version,) in db.session.query(SchemaVersion.version)}
+
+def migrate():
+    """Apply the pending migrations in order, returns their versions"""
+    applied = applied_versions()
+    done = []
+    for version, description, step in MIGRATIONS:
+        if version in applied:
+            continue
+        print(f"Applying migration {version}: {description}")
+        step()
+        db.session.add(SchemaVersion(version=version, description=description))
+        db.session.commit()
+        done.append(version)
+    return done
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Apply pending schema migrations')
+    parser.add_argument('--status', action='store_true', help='list applied and pending migrations without applying any')
+    args = parser.parse_args(argv)
+
+    with create_migration_app().app_context():
+        if args.status:
+            applied = applied_versions()
+            for version, description, _ in MIGRATIONS:
+                print(f"{version:>3} {'applied' if version in applied else 'pending'}  {description}")
+            return
+        done = migrate()
+        print(f"Applied {len(done)} migrations" if done else "Schema is up to date")
 
 if __name__ == '__main__':
-    print("Starting database migration...")
-    upgrade_database()
-    print("Database migration completed successfully!") 
\ No newline at end of file
+    main()
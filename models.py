@@ -4,6 +4,46 @@ from sqlalchemy.dialects.postgresql import JSON
 
 db = SQLAlchemy()
 
+class Card(db.Model):
+    # Card content only, shared by every user; scheduling state is per user
+    # in user_card_state
+    id = db.Column(db.Integer, primary_key=True)
+    # Unique, so concurrent imports can't add the same card twice
+    front = db.Column(db.String(500), nullable=False, index=True, unique=True)
+    back = db.Column(db.String(500), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CardState(db.Model):
+    __tablename__ = 'user_card_state'
+    
+    # One user's schedule for one card under one algorithm. The primary key
+    # leads with user_id, so a user's rows are contiguous in the index and
+    # the table can be hash-partitioned by user_id on Postgres
+    user_id = db.Column(db.String(50), primary_key=True)  # the session_id cookie
+    card_id = db.Column(db.Integer, db.ForeignKey('card.id'), primary_key=True)
+    algorithm = db.Column(db.String(10), primary_key=True)  # 'sm2' or 'fsrs'
+    next_review = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_review = db.Column(db.DateTime)
+    total_reviews = db.Column(db.Integer, nullable=False, default=0)
+    correct_reviews = db.Column(db.Integer, nullable=False, default=0)
+    
+    # SM2 fields
+    interval = db.Column(db.Integer, nullable=False, default=0)
+    repetitions = db.Column(db.Integer, nullable=False, default=0)
+    ease_factor = db.Column(db.Float, nullable=False, default=2.5)
+    
+    # FSRS fields
+    difficulty = db.Column(db.Float, nullable=False, default=5.0)
+    stability = db.Column(db.Float, nullable=False, default=2.0)
+    
+    # A user's due queue is a range scan of this index, in get_due_cards' keyset order
+    __table_args__ = (
+        db.Index('ix_user_card_state_due', 'user_id', 'algorithm', 'next_review', 'card_id'),
+    )
+    
+    def __repr__(self):
+        return f'<CardState {self.user_id} card:{self.card_id} {self.algorithm}>'
+
 class UserActivity(db.Model):
     __tablename__ = 'user_activities'
     
@@ -14,6 +54,13 @@ class UserActivity(db.Model):
     ip_address = db.Column(db.String(50))
     user_agent = db.Column(db.String(200))
     
+    # Session rollups read a day's session ids from the first index alone; it
+    # replaces the former single-column ix_user_activities_timestamp
+    __table_args__ = (
+        db.Index('ix_user_activities_timestamp_session', 'timestamp', 'session_id'),
+        db.Index('ix_user_activities_session', 'session_id', 'timestamp'),
+    )
+    
     def __repr__(self):
         return f'<UserActivity {self.action} at {self.timestamp}>'
 
@@ -30,6 +77,14 @@ class CardReview(db.Model):
     new_interval = db.Column(db.Float)
     review_time = db.Column(db.Float)  # Time taken for review in seconds
     
+    # The optimizer reads each card's history in (card_id, timestamp) order;
+    # archiving and per-user queries range over timestamp and session_id
+    __table_args__ = (
+        db.Index('ix_card_reviews_history', 'algorithm', 'card_id', 'timestamp'),
+        db.Index('ix_card_reviews_timestamp', 'timestamp'),
+        db.Index('ix_card_reviews_session', 'session_id', 'timestamp'),
+    )
+    
     def __repr__(self):
         return f'<CardReview {self.algorithm} card:{self.card_id} rating:{self.rating}>'
 
@@ -42,6 +97,11 @@ class AlgorithmPerformance(db.Model):
     algorithm = db.Column(db.String(10), nullable=False)
     metrics = db.Column(JSON)  # Stores retention rate, average review time, etc.
     
+    __table_args__ = (
+        db.Index('ix_algorithm_performance_timestamp', 'timestamp'),
+        db.Index('ix_algorithm_performance_session', 'session_id', 'timestamp'),
+    )
+    
     def __repr__(self):
         return f'<AlgorithmPerformance {self.algorithm} at {self.timestamp}>'
 
@@ -56,5 +116,148 @@ class Analytics(db.Model):
     avg_retention_fsrs = db.Column(db.Float)
     daily_stats = db.Column(JSON)  # Detailed daily statistics
     
+    # Per-algorithm counters, incremented with atomic upserts
+    sm2_reviews = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    sm2_correct = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    fsrs_reviews = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    fsrs_correct = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    # Daily session rollup: HyperLogLog registers of the day's session ids
+    session_sketch = db.Column(db.LargeBinary)
+    updated_at = db.Column(db.DateTime)
+    
+    @property
+    def sm2_retention(self):
+        if self.sm2_reviews:
+            return self.sm2_correct / self.sm2_reviews * 100
+        return self.avg_retention_sm2 or 0
+    
+    @property
+    def fsrs_retention(self):
+        if self.fsrs_reviews:
+            return self.fsrs_correct / self.fsrs_reviews * 100
+        return self.avg_retention_fsrs or 0
+    
+    def __repr__(self):
+        return f'<Analytics {self.date} reviews:{self.total_reviews}>' 
+
+class DeckStats(db.Model):
+    __tablename__ = 'user_deck_stats'
+    
+    # Running totals over one user's card states, updated in the same
+    # transaction as every review so /statistics and /deck_status never scan
+    user_id = db.Column(db.String(50), primary_key=True)
+    card_count = db.Column(db.Integer, nullable=False, default=0)
+    # Every card with id <= enrolled_through has state rows for this user
+    enrolled_through = db.Column(db.Integer, nullable=False, default=0)
+    sm2_total_reviews = db.Column(db.Integer, nullable=False, default=0)
+    sm2_correct_reviews = db.Column(db.Integer, nullable=False, default=0)
+    sm2_interval_sum = db.Column(db.Integer, nullable=False, default=0)
+    fsrs_total_reviews = db.Column(db.Integer, nullable=False, default=0)
+    fsrs_correct_reviews = db.Column(db.Integer, nullable=False, default=0)
+    fsrs_stability_sum = db.Column(db.Float, nullable=False, default=0.0)
+    # Incremented by every write to the user's card states, so workers know
+    # when their in-memory snapshot of them (snapshot.py) is stale
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Day of the user's newest review plan, returned by the review counter
+    # update so reviews only look for plans to patch on days one was built
+    plan_day = db.Column(db.Date)
+    
+    def __repr__(self):
+        return f'<DeckStats {self.user_id} cards:{self.card_count}>'
+
+class ReviewPlan(db.Model):
+    __tablename__ = 'review_plans'
+    
+    # One user's ordered review queue for one day, built once by /next_card.
+    # card_ids[position:] are still to be reviewed; reviews advance position
+    # or remove cards, and cards rescheduled for later the same day are
+    # appended. day is None when the plan must be rebuilt
+    user_id = db.Column(db.String(50), primary_key=True)
+    algorithm = db.Column(db.String(10), primary_key=True)
+    day = db.Column(db.Date)
+    card_ids = db.Column(JSON, nullable=False, default=list)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    # True when more cards were due than the plan holds
+    truncated = db.Column(db.Boolean, nullable=False, default=False)
+    built_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ReviewPlan {self.user_id} {self.algorithm} {self.day} {self.position}/{len(self.card_ids)}>'
+
+class FSRSParameters(db.Model):
+    __tablename__ = 'fsrs_parameters'
+    
+    # One row per optimizer run; the newest row for a deck is the active one
+    id = db.Column(db.Integer, primary_key=True)
+    deck = db.Column(db.String(50), index=True)  # None for the global parameters
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    weights = db.Column(JSON, nullable=False)  # All 19 FSRS weights
+    review_count = db.Column(db.Integer)
+    loss_before = db.Column(db.Float)
+    loss_after = db.Column(db.Float)
+    fit_seconds = db.Column(db.Float)
+    
+    def __repr__(self):
+        return f'<FSRSParameters {self.deck or "global"} loss:{self.loss_after}>'
+
+class MaintenanceJob(db.Model):
+    __tablename__ = 'maintenance_jobs'
+    
+    # Progress of a chunked admin operation over a table, e.g. 'upgrade_all'.
+    # Rows with id <= last_id are done, so a failed or abandoned job resumes
+    # from there; max_id bounds the job to the rows that existed when it began
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    scope = db.Column(db.String(50))  # user_id of a per-user job
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, completed, failed
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    max_id = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<MaintenanceJob {self.kind} {self.status} {self.processed}/{self.total}>'
+
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+    
+    # One row per migration applied by migrations.py
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SchemaVersion {self.version}>'
+
+class ArchiveSegment(db.Model):
+    __tablename__ = 'archive_segments'
+    
+    # One compressed columnar file of rows moved out of an append-only log
+    # table by archive.py; the rows had ids first_id..last_id, timestamps
+    # min_timestamp..max_timestamp and, for card_reviews, card ids
+    # min_card_id..max_card_id. path is relative to ARCHIVE_DIR
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    path = db.Column(db.String(500), nullable=False, unique=True)
+    first_id = db.Column(db.Integer, nullable=False)
+    last_id = db.Column(db.Integer, nullable=False)
+    min_timestamp = db.Column(db.DateTime, nullable=False)
+    max_timestamp = db.Column(db.DateTime, nullable=False)
+    row_count = db.Column(db.Integer, nullable=False)
+    size_bytes = db.Column(db.Integer, nullable=False)
+    min_card_id = db.Column(db.Integer)
+    max_card_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_archive_segments_table_time', 'table_name', 'max_timestamp'),
+    )
+    
     def __repr__(self):
-        return f'<Analytics {self.date} reviews:{self.total_reviews}>' 
\ No newline at end of file
+        return f'<ArchiveSegment {self.table_name} {self.first_id}-{self.last_id} rows:{self.row_count}>'
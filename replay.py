@@ -0,0 +1,271 @@
+"""Replay the card_reviews log through SM2 and FSRS and compare their predictions.
+
+Each user's reviews of a card form one history, whichever algorithm
+scheduled them, and both schedulers are run over every history from a
+new card's state, in timestamp order, exactly as the app would have
+scheduled it. Before each review after the first, each algorithm predicts
+the probability of recall for the time since the previous review, and the
+prediction is scored against whether the card was recalled (rating >= 3):
+
+- log-loss and Brier score
+- calibration: predicted vs observed recall in CALIBRATION_BINS bins, and
+  the expected calibration error (the bins' mean gap, weighted by size)
+- workload: reviews per day the algorithm would have made due, against
+  the reviews actually done
+
+FSRS predicts with its retrievability curve and the current fitted
+weights. SM2 has no memory model; its intervals are taken to aim at 90%
+recall when the card comes due, with exponential forgetting in between
+(scheduler.exponential_forgetting with the interval as the stability).
+
+Histories are independent, so the log is split into --shards contiguous
+card_id ranges replayed in a process pool. Each shard loads only its own
+reviews, archived and live: archived card_reviews segments record their
+card_id range, so a shard only opens the segments overlapping its own and
+keeps just its rows from each, and memory is bounded by the largest shard
+plus one segment. Shards are combined in order and the report doesn't
+depend on how many processes ran them.
+
+    python replay.py --processes 8 --output replay.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import func, select
+
+import archive
+from models import db, Card, CardReview
+from scheduler import SM2, compile_fsrs, exponential_forgetting
+
+ALGORITHMS = ('sm2', 'fsrs')
+CALIBRATION_BINS = 10
+EPSILON = 1e-7
+COLUMNS = ('id', 'session_id', 'card_id', 'timestamp', 'algorithm', 'rating')
+
+
+def shard_bounds(max_card_id, shards):
+    """[(low, high)) card_id ranges covering ids 1..max_card_id"""
+    edges = np.linspace(1, max_card_id + 1, shards + 1).round().astype(np.int64).tolist()
+    return [(low, high) for low, high in zip(edges, edges[1:]) if high > low]
+
+
+def load_shard(low, high, source=None):
+    """{column: array} of the archived and live reviews of cards in [low, high), in history order"""
+    parts = []
+    for part in archive.scan('card_reviews', COLUMNS, card_ids=(low, high)):
+        keep = ~np.isnat(part['timestamp'])
+        if source:
+            keep &= part['algorithm'] == source
+        parts.append({name: part[name][keep] for name in COLUMNS})
+    query = select(*(getattr(CardReview, name) for name in COLUMNS)).where(
+        CardReview.card_id >= low, CardReview.card_id < high, CardReview.timestamp.isnot(None)
+    )
+    if source:
+        query = query.where(CardReview.algorithm == source)
+    rows = db.session.execute(query).all()
+    if rows:
+        values = dict(zip(COLUMNS, zip(*rows)))
+        parts.append({
+            'id': np.array(values['id'], dtype=np.int64),
+            'session_id': np.array(values['session_id'], dtype=object),
+            'card_id': np.array(values['card_id'], dtype=np.int64),
+            'timestamp': np.array(values['timestamp'], dtype='datetime64[us]'),
+            'algorithm': np.array(values['algorithm'], dtype=object),
+            'rating': np.array(values['rating'], dtype=np.int64),
+        })
+    if not parts:
+        return {'card_id': np.array([], dtype=np.int64), 'session': np.array([], dtype=np.int64),
+                'timestamp': np.array([], dtype='datetime64[us]'), 'rating': np.array([], dtype=np.int64)}
+    reviews = {name: np.concatenate([part[name] for part in parts]) for name in COLUMNS}
+    # Sessions as codes in sorted order, so histories come out in the same order however the rows were stored
+    _, session = np.unique(reviews['session_id'].astype(str), return_inverse=True)
+    order = np.lexsort((reviews['id'], reviews['timestamp'], session, reviews['card_id']))
+    return {
+        'card_id': reviews['card_id'][order],
+        'session': session[order],
+        'timestamp': reviews['timestamp'][order],
+        'rating': reviews['rating'][order].astype(np.int64),
+    }
+
+
+def score(predicted, recalled):
+    """Sums for the metrics of one algorithm's predictions"""
+    clipped = np.clip(predicted, EPSILON, 1 - EPSILON)
+    bins = np.minimum((predicted * CALIBRATION_BINS).astype(np.int64), CALIBRATION_BINS - 1)
+    return {
+        'scored': len(predicted),
+        'log_loss': float(-np.where(recalled, np.log(clipped), np.log(1 - clipped)).sum()),
+        'brier': float(((predicted - recalled) ** 2).sum()),
+        'bin_count': np.bincount(bins, minlength=CALIBRATION_BINS),
+        'bin_predicted': np.bincount(bins, weights=predicted, minlength=CALIBRATION_BINS),
+        'bin_recalled': np.bincount(bins, weights=recalled, minlength=CALIBRATION_BINS),
+    }
+
+
+def replay(reviews, fsrs):
+    """Replay reviews sorted into histories, returns the shard's metric sums and daily workload"""
+    elapsed, sm2_interval, fsrs_stability, recalled = [], [], [], []
+    actual = Counter()
+    due = {algorithm: Counter() for algorithm in ALGORITHMS}
+    histories = 0
+    history = None
+    for card_id, session, timestamp, rating in zip(reviews['card_id'].tolist(), reviews['session'].tolist(),
+                                                   reviews['timestamp'].tolist(), reviews['rating'].tolist()):
+        if (card_id, session) != history:
+            history = (card_id, session)
+            histories += 1
+            # A newly enrolled card's state, due straight away
+            sm2 = SM2()
+            difficulty, stability = 5.0, 2.0
+            fsrs_due = timestamp
+        else:
+            elapsed.append((timestamp - last_review).total_seconds() / 86400)
+            sm2_interval.append(sm2.interval)
+            fsrs_stability.append(stability)
+            recalled.append(rating >= 3)
+        sm2.calculate(rating)
+        # The app gives FSRS the whole days since the card was due
+        difficulty, stability, interval = fsrs.review(difficulty, stability, (timestamp - fsrs_due).days, rating)
+        fsrs_due = timestamp + timedelta(days=interval)
+        last_review = timestamp
+        actual[timestamp.toordinal()] += 1
+        due['sm2'][timestamp.toordinal() + sm2.interval] += 1
+        due['fsrs'][fsrs_due.toordinal()] += 1
+
+    elapsed = np.array(elapsed, dtype=np.float64)
+    recalled = np.array(recalled, dtype=bool)
+    predicted = {
+        'sm2': exponential_forgetting(elapsed, np.array(sm2_interval, dtype=np.float64)),
+        'fsrs': np.power(1 + fsrs.factor * elapsed / np.array(fsrs_stability, dtype=np.float64), fsrs.decay),
+    }
+    return {
+        'reviews': len(reviews['rating']),
+        'histories': histories,
+        'scores': {algorithm: score(predicted[algorithm], recalled) for algorithm in ALGORITHMS},
+        'actual': actual,
+        'due': due,
+    }
+
+
+def replay_shard(task):
+    """Load and replay one card_id range, in a pool process"""
+    low, high, source, weights = task
+    from app import app
+    with app.app_context():
+        reviews = load_shard(low, high, source)
+        db.session.remove()
+    return replay(reviews, compile_fsrs(weights))
+
+
+def combine(results):
+    """Add up shard results, in shard order"""
+    nothing = score(np.array([]), np.array([], dtype=bool))
+    total = {'reviews': 0, 'histories': 0, 'actual': Counter(), 'due': {algorithm: Counter() for algorithm in ALGORITHMS},
+             'scores': {algorithm: nothing for algorithm in ALGORITHMS}}
+    for result in results:
+        total['reviews'] += result['reviews']
+        total['histories'] += result['histories']
+        total['actual'].update(result['actual'])
+        for algorithm in ALGORITHMS:
+            total['due'][algorithm].update(result['due'][algorithm])
+            sums = total['scores'][algorithm]
+            total['scores'][algorithm] = {name: sums[name] + value for name, value in result['scores'][algorithm].items()}
+    return total
+
+
+def build_report(total, source, weights):
+    days = range(min(total['actual']), max(total['actual']) + 1) if total['actual'] else range(0)
+    actual = np.array([total['actual'][day] for day in days], dtype=np.int64)
+    report = {
+        'source': source or 'all',
+        'reviews': total['reviews'],
+        'histories': total['histories'],
+        'fsrs_weights': list(weights),
+        'algorithms': {},
+        'daily': [],
+    }
+    for algorithm in ALGORITHMS:
+        sums = total['scores'][algorithm]
+        scored = sums['scored']
+        count = sums['bin_count']
+        observed = np.divide(sums['bin_recalled'], count, out=np.zeros(CALIBRATION_BINS), where=count > 0)
+        predicted_bin = np.divide(sums['bin_predicted'], count, out=np.zeros(CALIBRATION_BINS), where=count > 0)
+        predicted = np.array([total['due'][algorithm][day] for day in days], dtype=np.int64)
+        report['algorithms'][algorithm] = {
+            'scored': scored,
+            'log_loss': sums['log_loss'] / scored if scored else None,
+            'brier': sums['brier'] / scored if scored else None,
+            'mean_predicted': float(sums['bin_predicted'].sum() / scored) if scored else None,
+            'recall_rate': float(sums['bin_recalled'].sum() / scored) if scored else None,
+            'calibration_error': float(np.abs(predicted_bin - observed) @ count / scored) if scored else None,
+            'calibration': [{
+                'bin': f'{i / CALIBRATION_BINS:.1f}-{(i + 1) / CALIBRATION_BINS:.1f}',
+                'count': int(count[i]),
+                'predicted': float(predicted_bin[i]) if count[i] else None,
+                'observed': float(observed[i]) if count[i] else None,
+            } for i in range(CALIBRATION_BINS)],
+            'workload': {
+                'actual_reviews': int(actual.sum()),
+                'predicted_reviews': int(predicted.sum()),
+                'daily_mean_abs_error': float(np.abs(predicted - actual).mean()) if len(days) else None,
+            },
+        }
+    report['daily'] = [dict({'date': date.fromordinal(day).isoformat(), 'actual': total['actual'][day]},
+                            **{algorithm: total['due'][algorithm][day] for algorithm in ALGORITHMS})
+                       for day in days]
+    return report
+
+
+def run(shards=64, processes=None, source=None):
+    """Replay the whole log, returns the report"""
+    from app import app, get_fsrs
+    with app.app_context():
+        max_card_id = db.session.scalar(select(func.max(Card.id))) or 0
+        fsrs = get_fsrs()
+        weights = tuple(fsrs.w[i] for i in range(len(fsrs.w)))
+        db.session.remove()
+    tasks = [(low, high, source, weights) for low, high in shard_bounds(max_card_id, shards)]
+    processes = processes or os.cpu_count()
+    if processes == 1:
+        return build_report(combine(map(replay_shard, tasks)), source, weights)
+    # Spawned rather than forked, so no process inherits the parent's database connections
+    with multiprocessing.get_context('spawn').Pool(processes) as pool:
+        return build_report(combine(pool.imap(replay_shard, tasks)), source, weights)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay the card_reviews log through SM2 and FSRS')
+    parser.add_argument('--shards', type=int, default=64, help='card_id ranges the log is split into')
+    parser.add_argument('--processes', type=int, help='defaults to the number of CPUs')
+    parser.add_argument('--source', choices=ALGORITHMS, help='replay only the reviews scheduled by one algorithm')
+    parser.add_argument('--output', default='replay.json', help='where to write the JSON report')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    report = run(args.shards, args.processes, args.source)
+    seconds = time.perf_counter() - start
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Replayed {report['reviews']} reviews in {report['histories']} histories in {seconds:.1f}s "
+          f"({report['reviews'] / seconds:.0f} reviews/sec)")
+    for algorithm, metrics in report['algorithms'].items():
+        if not metrics['scored']:
+            continue
+        workload = metrics['workload']
+        print(f"{algorithm:>5}: log-loss {metrics['log_loss']:.4f}, Brier {metrics['brier']:.4f}, "
+              f"calibration error {metrics['calibration_error']:.4f} "
+              f"(predicted {metrics['mean_predicted']:.3f} vs recalled {metrics['recall_rate']:.3f}), "
+              f"workload {workload['predicted_reviews']} due vs {workload['actual_reviews']} done")
+    print(f"Report written to {args.output}")
+    return 0 if report['algorithms']['fsrs']['scored'] else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,224 @@
+"""Array-backed snapshots of users' card states for the read endpoints.
+
+/get_due_cards, /deck_status, /forecast and the /next_card plan only need
+a user's card ids, due times and scheduler state. A StateSnapshot holds
+them for one user and algorithm as NumPy columns sorted by card id, 40
+bytes per card with the due-order index. Due-card selection, keyset
+pages and due counts then become binary searches over the due times.
+Card text never changes once a card is added, so card_text() caches it
+per process.
+
+Snapshots are versioned by user_deck_stats.version, which every write to a
+user's card states increments in its own transaction. A read looks up the
+version with one primary-key read and reloads the snapshot if it moved.
+A worker therefore never serves states older than the version it just
+read, whichever worker wrote them. The worker that made a write replaces
+its own snapshot with a patched copy when the write moved the version
+exactly one past it, i.e. no other write came in between.
+
+Snapshots are kept per worker in an LRU bounded by SNAPSHOT_CACHE_MB. At
+0 they are disabled and the endpoints query the database directly.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy import select
+
+from models import db, Card, CardState, DeckStats
+
+STATE_COLUMNS = {
+    'sm2': {'interval': np.int32, 'repetitions': np.int32, 'ease_factor': np.float64},
+    'fsrs': {'difficulty': np.float64, 'stability': np.float64},
+}
+
+
+class StateSnapshot:
+    """One user's states for one algorithm at a deck_stats version. Never modified once built."""
+
+    __slots__ = ('version', 'card_id', 'due', 'state', '_order', '_sorted_due')
+
+    def __init__(self, version, card_id, due, state, order=None):
+        self.version = version
+        self.card_id = card_id
+        self.due = due
+        self.state = state
+        # Card positions in (due, card_id) order: the columns are sorted by
+        # card id, so a stable sort by due breaks ties by card id
+        self._order = np.argsort(due, kind='stable').astype(np.int32) if order is None else order
+        self._sorted_due = due[self._order]
+
+    @property
+    def nbytes(self):
+        return (self.card_id.nbytes + self.due.nbytes + self._order.nbytes + self._sorted_due.nbytes
+                + sum(column.nbytes for column in self.state.values()))
+
+    def __len__(self):
+        return len(self.card_id)
+
+    def due_count(self, now):
+        return int(np.searchsorted(self._sorted_due, np.datetime64(now, 'us'), side='right'))
+
+    def due_page(self, now, after=None, limit=None, due=True):
+        """[(card_id, due)] of the page due_page_query returns, in (due, card_id) order"""
+        split = self.due_count(now)
+        low, high = (0, split) if due else (split, len(self))
+        if after is not None:
+            after_due = np.datetime64(after[0], 'us')
+            start = int(np.searchsorted(self._sorted_due, after_due, side='left'))
+            ties = int(np.searchsorted(self._sorted_due, after_due, side='right'))
+            # Cards due at the cursor's time come in card id order; skip up to the cursor's card
+            start += int(np.searchsorted(self.card_id[self._order[start:ties]], after[1], side='right'))
+            low = max(low, start)
+        positions = self._order[low:high if limit is None else min(high, low + limit)]
+        return list(zip(self.card_id[positions].tolist(), self.due[positions].tolist()))
+
+    def due_before(self, when, limit=None):
+        """Ids of the cards due before when, in (due, card_id) order"""
+        end = int(np.searchsorted(self._sorted_due, np.datetime64(when, 'us'), side='left'))
+        return self.card_id[self._order[:end if limit is None else min(end, limit)]].tolist()
+
+    def columns_before(self, when):
+        """(due times, {column: values}) of the cards due before when"""
+        positions = self._order[:int(np.searchsorted(self._sorted_due, np.datetime64(when, 'us'), side='left'))]
+        return self.due[positions], {name: column[positions] for name, column in self.state.items()}
+
+    def patched(self, state_rows, version):
+        """A copy with the user's changed state rows applied, or None if some of their cards aren't in it"""
+        if not state_rows:
+            return StateSnapshot(version, self.card_id, self.due, self.state, self._order)
+        card_ids = np.array([row['card_id'] for row in state_rows])
+        positions = np.searchsorted(self.card_id, card_ids)
+        if np.any(positions >= len(self)) or np.any(self.card_id[np.minimum(positions, len(self) - 1)] != card_ids):
+            return None
+        due = self.due.copy()
+        due[positions] = np.array([row['next_review'] for row in state_rows], dtype='datetime64[us]')
+        state = {}
+        for name, column in self.state.items():
+            state[name] = column.copy()
+            state[name][positions] = [row[name] for row in state_rows]
+        return StateSnapshot(version, self.card_id, due, state)
+
+
+def load_snapshot(user_id, algorithm, version):
+    columns = STATE_COLUMNS[algorithm]
+    rows = db.session.execute(
+        select(CardState.card_id, CardState.next_review, *(getattr(CardState, name) for name in columns))
+        .where(CardState.user_id == user_id, CardState.algorithm == algorithm)
+        .order_by(CardState.card_id)
+    ).all()
+    return StateSnapshot(
+        version,
+        np.array([row[0] for row in rows], dtype=np.int32),
+        np.array([row[1] for row in rows], dtype='datetime64[us]'),
+        {name: np.array([row[i + 2] for row in rows], dtype=dtype) for i, (name, dtype) in enumerate(columns.items())}
+    )
+
+
+class SnapshotCache:
+    def __init__(self, app=None):
+        self.app = None
+        self._snapshots = OrderedDict()
+        self._bytes = 0
+        self._text = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'loads': 0, 'patches': 0, 'evictions': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SNAPSHOT_CACHE_MB', float(os.environ.get('SNAPSHOT_CACHE_MB', 64)))
+        # Cards whose front and back are kept in memory
+        app.config.setdefault('CARD_TEXT_CACHE_SIZE', int(os.environ.get('CARD_TEXT_CACHE_SIZE', 20000)))
+        self.app = app
+        app.extensions['snapshots'] = self
+
+    @property
+    def enabled(self):
+        return self.app is not None and self.app.config['SNAPSHOT_CACHE_MB'] > 0
+
+    def get(self, user_id, algorithm, version=None):
+        """The user's snapshot at their current deck_stats version, or None when disabled or they have no deck_stats row.
+
+        Pass version when the caller has just read the user's deck_stats row.
+        """
+        if not self.enabled:
+            return None
+        if version is None:
+            version = db.session.scalar(select(DeckStats.version).where(DeckStats.user_id == user_id))
+            if version is None:
+                return None
+        key = (user_id, algorithm)
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None and snapshot.version == version:
+                self._snapshots.move_to_end(key)
+                self.counters['hits'] += 1
+                return snapshot
+        snapshot = load_snapshot(user_id, algorithm, version)
+        with self._lock:
+            self.counters['loads'] += 1
+            self._put(key, snapshot)
+        return snapshot
+
+    def written(self, user_id, state_rows, version):
+        """Bring this worker's snapshots of a user up to a committed write of state_rows.
+
+        version is the one the write moved the user's deck_stats to, or None
+        if unknown, in which case the snapshots are dropped.
+        """
+        with self._lock:
+            for algorithm in STATE_COLUMNS:
+                key = (user_id, algorithm)
+                snapshot = self._snapshots.get(key)
+                if snapshot is None:
+                    continue
+                patched = None
+                if version is not None and snapshot.version == version - 1:
+                    patched = snapshot.patched([row for row in state_rows if row['algorithm'] == algorithm], version)
+                self._remove(key)
+                if patched is not None:
+                    self._put(key, patched)
+                    self.counters['patches'] += 1
+
+    def card_text(self, card_ids):
+        """{card_id: (front, back)}, from the process-wide cache where possible"""
+        found = {}
+        with self._lock:
+            for card_id in card_ids:
+                text = self._text.get(card_id)
+                if text is not None:
+                    self._text.move_to_end(card_id)
+                    found[card_id] = text
+        missing = [card_id for card_id in card_ids if card_id not in found]
+        if missing:
+            rows = db.session.execute(select(Card.id, Card.front, Card.back).where(Card.id.in_(missing))).all()
+            with self._lock:
+                for card_id, front, back in rows:
+                    found[card_id] = self._text[card_id] = (front, back)
+                while len(self._text) > self.app.config['CARD_TEXT_CACHE_SIZE']:
+                    self._text.popitem(last=False)
+        return found
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, snapshots=len(self._snapshots), bytes=self._bytes, cards_text=len(self._text))
+
+    def _put(self, key, snapshot):
+        self._remove(key)
+        self._snapshots[key] = snapshot
+        self._bytes += snapshot.nbytes
+        limit = self.app.config['SNAPSHOT_CACHE_MB'] * 1024 * 1024
+        while self._bytes > limit and len(self._snapshots) > 1:
+            _, evicted = self._snapshots.popitem(last=False)
+            self._bytes -= evicted.nbytes
+            self.counters['evictions'] += 1
+
+    def _remove(self, key):
+        snapshot = self._snapshots.pop(key, None)
+        if snapshot is not None:
+            self._bytes -= snapshot.nbytes
+
+
+snapshots = SnapshotCache()
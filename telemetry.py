@@ -0,0 +1,169 @@
+"""Buffered background writer for telemetry rows.
+
+UserActivity and AlgorithmPerformance rows are only ever appended, so they
+don't need to be written on the request's latency path. Requests put rows on
+a bounded in-process queue and a worker thread drains it, writing each model
+with one bulk insert once batch_size rows are waiting or flush_interval
+seconds have passed. When the queue is full, new rows are dropped and counted
+rather than blocking the request. The same thread also runs periodic
+maintenance tasks registered with every().
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+class TelemetryWriter:
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.counters = {'enqueued': 0, 'dropped': 0, 'written': 0, 'failed': 0, 'flushes': 0}
+        self._tasks = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TELEMETRY_ASYNC', os.environ.get('TELEMETRY_ASYNC', '1') == '1')
+        app.config.setdefault('TELEMETRY_QUEUE_SIZE', int(os.environ.get('TELEMETRY_QUEUE_SIZE', 10000)))
+        app.config.setdefault('TELEMETRY_BATCH_SIZE', int(os.environ.get('TELEMETRY_BATCH_SIZE', 500)))
+        app.config.setdefault('TELEMETRY_FLUSH_INTERVAL', float(os.environ.get('TELEMETRY_FLUSH_INTERVAL', 2.0)))
+        self.app = app
+        self._queue = queue.Queue(maxsize=app.config['TELEMETRY_QUEUE_SIZE'])
+        app.extensions['telemetry'] = self
+        atexit.register(self.stop)
+
+    def record(self, model, **values):
+        """Queue one row for model, returns False if it had to be dropped"""
+        values.setdefault('timestamp', datetime.utcnow())
+        if not self.app.config['TELEMETRY_ASYNC']:
+            self._write({model: [values]})
+            return True
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((model, values))
+        except queue.Full:
+            with self._lock:
+                self.counters['dropped'] += 1
+                dropped = self.counters['dropped']
+            if dropped == 1 or dropped % 1000 == 0:
+                logger.warning(f"Telemetry queue full, {dropped} rows dropped so far")
+            return False
+        with self._lock:
+            self.counters['enqueued'] += 1
+        return True
+
+    def every(self, interval, task):
+        """Run task() inside an app context every interval seconds on the worker thread"""
+        self._tasks.append([interval, task, time.monotonic() + interval])
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats['queue_depth'] = self._queue.qsize() if self._queue is not None else 0
+        return stats
+
+    def stop(self, timeout=10.0):
+        """Flush everything still queued and stop the worker thread"""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        self._stopping.set()
+        thread.join(timeout)
+        self._thread = None
+        logger.info(f"Telemetry writer stopped: {self.stats()}")
+
+    def _ensure_worker(self):
+        # Started lazily, and again after a fork, since threads don't survive into
+        # gunicorn workers forked from a preloaded app
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='telemetry-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        batch_size = self.app.config['TELEMETRY_BATCH_SIZE']
+        interval = self.app.config['TELEMETRY_FLUSH_INTERVAL']
+        pending = {}
+        count = 0
+        deadline = time.monotonic() + interval
+        while not self._stopping.is_set():
+            try:
+                model, values = self._queue.get(timeout=max(0.0, min(0.1, deadline - time.monotonic())))
+                pending.setdefault(model, []).append(values)
+                count += 1
+            except queue.Empty:
+                pass
+            if count and (count >= batch_size or time.monotonic() >= deadline):
+                self._write(pending)
+                pending = {}
+                count = 0
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + interval
+                self._run_tasks()
+        self._drain(pending, count, batch_size)
+
+    def _drain(self, pending, count, batch_size):
+        """Write pending and everything left on the queue, batch_size rows per flush"""
+        while True:
+            try:
+                model, values = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            pending.setdefault(model, []).append(values)
+            count += 1
+            if count >= batch_size:
+                self._write(pending)
+                pending = {}
+                count = 0
+        if count:
+            self._write(pending)
+
+    def _run_tasks(self):
+        now = time.monotonic()
+        for entry in self._tasks:
+            interval, task, due = entry
+            if now < due:
+                continue
+            entry[2] = now + interval
+            try:
+                with self.app.app_context():
+                    task()
+            except Exception as e:
+                logger.error(f"Telemetry task {task.__name__} failed: {str(e)}")
+
+    def _write(self, pending):
+        rows = sum(len(values) for values in pending.values())
+        try:
+            with self.app.app_context():
+                for model, values in pending.items():
+                    db.session.execute(insert(model), values)
+                db.session.commit()
+        except Exception as e:
+            logger.error(f"Failed to write {rows} telemetry rows: {str(e)}")
+            with self._lock:
+                self.counters['failed'] += rows
+            return
+        with self._lock:
+            self.counters['written'] += rows
+            self.counters['flushes'] += 1
+
+
+telemetry = TelemetryWriter()
@@ -0,0 +1,18 @@
+import pytest
+
+from app import create_app
+from models import db
+
+
+@pytest.fixture
+def app(tmp_path):
+    """An app on a fresh file-backed SQLite database, with telemetry written synchronously"""
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'flashcards.db'}",
+        'TELEMETRY_ASYNC': False,
+    })
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.engine.dispose()
@@ -0,0 +1,44 @@
+import threading
+from datetime import datetime
+
+from analytics import REVIEW_COUNTERS, review_counts, update_analytics
+from models import db, Analytics
+
+THREADS = 8
+BATCHES = 25
+
+
+def test_concurrent_update_analytics_loses_no_increments(app):
+    batches = [
+        [('sm2', 4), ('fsrs', 2)],
+        [('fsrs', 3), ('fsrs', 1), ('sm2', 1)],
+        [('sm2', 3)],
+    ]
+    errors = []
+    start = threading.Barrier(THREADS)
+
+    def worker(n):
+        try:
+            start.wait()
+            for i in range(BATCHES):
+                with app.app_context():
+                    update_analytics(f'session-{n}', batches[(n + i) % len(batches)])
+                    db.session.commit()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+    expected = dict.fromkeys(REVIEW_COUNTERS, 0)
+    for n in range(THREADS):
+        for i in range(BATCHES):
+            for name, count in review_counts(batches[(n + i) % len(batches)]).items():
+                expected[name] += count
+    with app.app_context():
+        row = Analytics.query.filter_by(date=datetime.utcnow().date()).one()
+        assert {name: getattr(row, name) for name in REVIEW_COUNTERS} == expected
@@ -0,0 +1,38 @@
+from sqlalchemy import insert
+
+import app as app_module
+from app import enroll_cards, get_deck_stats
+from models import db, Card, CardState, DeckStats
+
+
+def test_statistics_for_a_new_user_writes_nothing(app):
+    client = app.test_client()
+    for path in ('/statistics', '/deck_status'):
+        assert client.get(path, headers={'Cookie': 'session_id=newcomer'}).status_code == 200
+    with app.app_context():
+        assert DeckStats.query.count() == 0
+
+
+def test_get_deck_stats_reads_a_row_saved_concurrently(app, monkeypatch):
+    with app.app_context():
+        db.session.execute(insert(Card), [{'front': f'front {i}', 'back': f'back {i}'} for i in range(3)])
+        enroll_cards('racer')
+        db.session.commit()
+        db.session.query(DeckStats).delete()
+        db.session.commit()
+
+    totals = app_module.deck_stats_totals
+
+    def totals_then_concurrent_insert(*criteria):
+        # Another request saves the row between our lookup and our insert
+        result = totals(*criteria)
+        with db.engine.begin() as connection:
+            connection.execute(insert(DeckStats).values(user_id='racer', card_count=3, enrolled_through=3))
+        return result
+
+    monkeypatch.setattr(app_module, 'deck_stats_totals', totals_then_concurrent_insert)
+    with app.app_context():
+        stats = get_deck_stats('racer')
+        assert stats.card_count == 3
+        assert stats.enrolled_through == 3
+        assert CardState.query.filter_by(user_id='racer').count() == 6
@@ -0,0 +1,53 @@
+import io
+import threading
+
+from app import import_cards
+from models import db, Card
+
+THREADS = 4
+CARDS = 300
+
+
+def test_concurrent_imports_add_each_card_once(app):
+    data = ''.join(f'front {i},back {i}\n' for i in range(CARDS)).encode()
+    results = []
+    errors = []
+    start = threading.Barrier(THREADS)
+
+    def worker():
+        try:
+            start.wait()
+            with app.app_context():
+                results.append(import_cards(io.BytesIO(data), 'csv', batch_size=50))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+    assert sum(result['imported'] for result in results) == CARDS
+    assert sum(result['duplicates'] for result in results) == CARDS * (THREADS - 1)
+    with app.app_context():
+        assert db.session.query(Card.front).distinct().count() == Card.query.count() == CARDS
+
+
+def test_import_skips_fronts_already_in_the_deck(app):
+    with app.app_context():
+        db.session.add(Card(front='front 1', back='old'))
+        db.session.commit()
+        result = import_cards(io.BytesIO(b'front,back\nfront 1,new\nfront 2,back 2\nfront 2,again\n'), 'csv')
+        assert (result['imported'], result['duplicates']) == (1, 2)
+        assert Card.query.filter_by(front='front 1').one().back == 'old'
+
+
+def test_add_card_refuses_a_duplicate_front(app):
+    client = app.test_client()
+    first = client.post('/add_card', json={'front': 'front 1', 'back': 'back 1'})
+    assert first.status_code == 200
+    again = client.post('/add_card', json={'front': 'front 1', 'back': 'other'})
+    assert again.status_code == 409
+    assert again.json['id'] == first.json['id']
@@ -0,0 +1,25 @@
+import re
+
+from sqlalchemy import event
+
+from app import create_app
+from models import db
+
+
+def test_each_statement_is_counted_once_with_several_apps(tmp_path):
+    apps = [create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / f'flashcards-{n}.db'}",
+        'TELEMETRY_ASYNC': False,
+        'INSTRUMENTATION': True,
+    }) for n in range(2)]
+    app = apps[-1]
+    statements = []
+    with app.app_context():
+        db.create_all()
+        event.listen(db.engine, 'after_cursor_execute', lambda *args: statements.append(args[2]))
+
+    response = app.test_client().get('/statistics')
+    assert response.status_code == 200
+    assert statements
+    timing = ', '.join(response.headers.getlist('Server-Timing'))
+    assert re.search(r'desc="(\d+) queries"', timing).group(1) == str(len(statements))
@@ -0,0 +1,21 @@
+import os
+import subprocess
+import sys
+
+from benchmarks.startup import probe
+from benchmarks.worker_profiles import ROOT
+
+# Budgets for a cold start, as checked by benchmarks.startup
+MAX_CONNECTIONS_AT_IMPORT = 0
+MAX_FIRST_REQUEST_STATEMENTS = 0
+
+
+def test_startup_stays_off_the_database(tmp_path):
+    database_url = f"sqlite:///{tmp_path / 'flashcards.db'}"
+    subprocess.run([sys.executable, 'migrations.py'], cwd=ROOT, check=True, stdout=subprocess.DEVNULL,
+                   env=dict(os.environ, DATABASE_URL=database_url))
+
+    result = probe(database_url)
+    assert result['first_request_status'] == 200
+    assert result['connections_at_import'] <= MAX_CONNECTIONS_AT_IMPORT
+    assert result['first_request_statements'] <= MAX_FIRST_REQUEST_STATEMENTS